@@ -1,4 +1,7 @@
-from typing import Set, Dict, Optional, Union
+import asyncio
+from datetime import datetime, timezone
+from time import monotonic, perf_counter
+from typing import Set, Dict, Optional, Union, Tuple, List
 
 import discord
 from discord.ext import commands
@@ -7,9 +10,15 @@ from types import MethodType
 
 from discord.ext.commands import NoPrivateMessage, MissingRole
 
+from FleetRollout import owner_only
+from HttpScheduler import priority, BULK
+from Metrics import guild_id_of
 from NoConflictCog import NoConflictCog
+from PermissionIndex import PermissionIndex, accessor_kind
+from ProtectionJournal import ProtectionJournal
+from SpecialChecks import pipelines
 from bot import MyDiscordBot
-from os import path, makedirs
+from os import path
 
 
 # TODO: Add protections for single command
@@ -27,6 +36,11 @@ from os import path, makedirs
 
 class AdminCommands(NoConflictCog):
 
+    # how many users may be fetched from discord at once while loading protections, discord allows 50 requests a second
+    FETCH_CONCURRENCY = 50
+    # seconds between attempts to fetch the users discord could not give us while loading protections
+    FETCH_RETRY_INTERVAL = 60.0
+
     def __init__(self, bot):
         self.bot: MyDiscordBot = bot
         self.__roles: Dict[str, discord.role] = {}
@@ -34,43 +48,170 @@ class AdminCommands(NoConflictCog):
         self.__protections: Dict[str, Set[Union[discord.Role, discord.User, discord.TextChannel]]] = {
             self.qualified_name: set()
         }
-        self.__protections_checked = False
+        # the protections are loaded once, whoever needs them first waits for the same load
+        self.__protections_loaded: Optional[asyncio.Future] = None
+        # snowflake -> the protections it is part of, for the users which could not be fetched yet
+        self.__unresolved: Dict[int, List[str]] = {}
+        self.__retrying: Optional[asyncio.Future] = None
+        self.__retry_at = 0.0
+        self.__index = PermissionIndex(lambda name: self.__protections.get(name))
+        self.__owner_protected = False
+        self.__journal: Optional[ProtectionJournal] = None
 
     async def __load_protections(self):
         """
-        If existing protections exist in the folder add them to be able to protect the cogs on the bot
+        If existing protections exist in the folder add them to be able to protect the cogs on the bot.
+        Protections saved by older versions as a single pickle are moved into the journal.
         """
+        guild: Optional[discord.Guild] = getattr(self.bot, "guild", None)
+        if guild is None:
+            # the main bot only answers direct messages, every guild's protections belong to the guild's own bot
+            return
+        legacy = path.join("..", str(guild.id), self.qualified_name)
+        self.__journal = ProtectionJournal(legacy + ".journal", self.__snapshot)
         try:
-            try:
-                config: Dict[str, Set[int]] = pickle.load(
-                    open(path.join("..", str(self.bot.guilds[0].id), self.qualified_name), 'rb'))
-                for protection in config:
-                    for snowflake in config[protection]:
-                        try:
-                            self.__protections.setdefault(protection, set()).add(await self.bot.fetch_user(snowflake))
-                        except discord.NotFound:
-                            try:
-                                self.__protections[protection].add(self.bot.guilds[0].get_role(snowflake))
-                            except discord.NotFound:
-                                self.__protections[protection].add(self.bot.guilds[0].get_channel(snowflake))
-            except FileNotFoundError:
-                self.__protections: Dict[str, Set[Union[discord.Role, discord.User]]] = {
-                    self.qualified_name: set()
-                }
-        except IndexError:
-            print("index error")
-
-    def __save_protections(self):
-        """
-        Save existing protections to disk
-        """
-        filename = path.join("..", str(self.bot.guilds[0].id), self.qualified_name)
-        makedirs(path.dirname(filename), exist_ok=True)
-        config: Dict[str, Set[int]] = {}
-        protection: str
-        for protection in self.__protections:
-            config[protection] = set(map(lambda x: x.id, self.__protections[protection]))
-        pickle.dump(config, open(filename, 'wb'))
+            initial: Optional[Dict[str, Set[Union[Tuple[str, int], int]]]] = pickle.load(open(legacy, 'rb'))
+        except FileNotFoundError:
+            initial = None
+        config = await self.__journal.open(initial)
+        self.__protections = {self.qualified_name: set()}
+        self.__protections.update(await self.__resolve(guild, config))
+        self.__index.clear()
+
+    async def __resolve(self, guild: discord.Guild, config: Dict[str, Set[Union[Tuple[str, int], int]]]) \
+            -> Dict[str, Set[Union[discord.Role, discord.User, discord.TextChannel]]]:
+        """
+        Turn stored snowflakes back into roles, users and channels. Snowflakes are resolved from the gateway cache
+        first, any users which are not cached are fetched concurrently.
+        """
+        protections: Dict[str, Set[Union[discord.Role, discord.User, discord.TextChannel]]] = {}
+        # snowflake -> the protections it is part of, for everything which is not in the cache
+        unresolved: Dict[int, List[str]] = {}
+        for protection in config:
+            accessors = protections.setdefault(protection, set())
+            for entry in config[protection]:
+                # protections saved before the kind was recorded are bare snowflakes
+                kind, snowflake = entry if isinstance(entry, tuple) else (None, entry)
+                accessor = self.__cached_accessor(guild, kind, snowflake)
+                if accessor is not None:
+                    accessors.add(accessor)
+                elif kind in (None, "user"):
+                    unresolved.setdefault(snowflake, []).append(protection)
+                else:
+                    print(f"{kind} {snowflake} protecting {protection} no longer exists")
+        await self.__fetch_users(unresolved, protections)
+        # protections whose accessors are all gone are not protecting anything, unless users are still to be fetched
+        pending = {name for names in self.__unresolved.values() for name in names}
+        return {name: accessors for name, accessors in protections.items() if accessors or name in pending}
+
+    async def __fetch_users(self, unresolved: Dict[int, List[str]],
+                            protections: Dict[str, Set[Union[discord.Role, discord.User, discord.TextChannel]]]):
+        """
+        Fetch the users the cache does not know concurrently and add them to their protections. Users discord could not
+        give us right now are kept and fetched again later, they are still part of their protections.
+        """
+        limit = asyncio.Semaphore(self.FETCH_CONCURRENCY)
+
+        async def fetch(snowflake: int):
+            async with limit:
+                try:
+                    user = await self.bot.fetch_user(snowflake)
+                except discord.NotFound:
+                    print(f"{snowflake} protecting {', '.join(unresolved[snowflake])} no longer exists")
+                    return
+                except discord.HTTPException as e:
+                    print(f"Could not fetch {snowflake} protecting {', '.join(unresolved[snowflake])}, "
+                          f"retrying later: {e}")
+                    self.__unresolved[snowflake] = unresolved[snowflake]
+                    return
+            for name in unresolved[snowflake]:
+                protections.setdefault(name, set()).add(user)
+                self.__index.invalidate(name)
+
+        await asyncio.gather(*map(fetch, unresolved))
+
+    async def __retry_unresolved(self):
+        self.__retry_at = monotonic() + self.FETCH_RETRY_INTERVAL
+        unresolved, self.__unresolved = self.__unresolved, {}
+        await self.__fetch_users(unresolved, self.__protections)
+
+    def __cached_accessor(self, guild: discord.Guild, kind: Optional[str], snowflake: int) \
+            -> Optional[Union[discord.Role, discord.User, discord.TextChannel]]:
+        """
+        Look up a protection's accessor without going to discord
+        :param kind: what the snowflake is, if None every kind is tried
+        """
+        if kind in (None, "role"):
+            role = guild.get_role(snowflake)
+            if role is not None:
+                return role
+        if kind in (None, "channel"):
+            channel = guild.get_channel(snowflake)
+            if channel is not None:
+                return channel
+        if kind in (None, "user"):
+            return guild.get_member(snowflake) or self.bot.get_user(snowflake)
+        return None
+
+    def __snapshot(self) -> Dict[str, Set[Tuple[str, int]]]:
+        """
+        The protections as they are stored, each snowflake along with what kind of object it is
+        """
+        snapshot = {
+            protection: set(map(lambda x: (accessor_kind(x), x.id), accessors))
+            for protection, accessors in self.__protections.items()
+        }
+        # users which could not be fetched yet are still protecting
+        for snowflake, names in self.__unresolved.items():
+            for name in names:
+                snapshot.setdefault(name, set()).add(("user", snowflake))
+        return snapshot
+
+    def __protect(self, name: str, accessor: Union[discord.Role, discord.User, discord.TextChannel]):
+        """
+        Add an accessor to a protection and record the change
+        """
+        self.__protections.setdefault(name, set()).add(accessor)
+        self.__index.invalidate(name)
+        if self.__journal is not None:
+            self.__journal.record("add", name, (accessor_kind(accessor), accessor.id))
+
+    def __unprotect(self, name: str, accessor: Union[discord.Role, discord.User, discord.TextChannel]):
+        """
+        Remove an accessor from a protection and record the change
+        """
+        accessors = self.__protections.get(name)
+        if accessors is not None:
+            accessors.discard(accessor)
+            # an empty protection would only let the owner in, the cog is unprotected once nobody is left. This cog's
+            # own protection only lets the owner in until the super user is seeded, it is never dropped
+            if not accessors and name != self.qualified_name:
+                del self.__protections[name]
+        self.__index.invalidate(name)
+        if self.__journal is not None:
+            self.__journal.record("remove", name, (accessor_kind(accessor), accessor.id))
+
+    async def __ensure_protections(self):
+        """
+        Load the protections the first time they are needed
+        """
+        if self.__protections_loaded is None:
+            self.__protections_loaded = asyncio.ensure_future(self.__load_protections())
+        loading = self.__protections_loaded
+        try:
+            await asyncio.shield(loading)
+        except Exception:
+            # the next caller loads them again instead of getting the same failure forever
+            if self.__protections_loaded is loading:
+                self.__protections_loaded = None
+            raise
+        if self.__unresolved and (self.__retrying is None or self.__retrying.done()) \
+                and monotonic() >= self.__retry_at:
+            self.__retrying = asyncio.ensure_future(self.__retry_unresolved())
+
+    async def warm_up(self):
+        await super().warm_up()
+        await self.__ensure_protections()
 
     async def cog_before_invoke(self, ctx):
         """
@@ -79,14 +220,18 @@ class AdminCommands(NoConflictCog):
         TODO: Might have to move the loading to before any command within the given bot is loaded
         :param ctx:
         """
-        if not self.__protections_checked:
-            self.__protections_checked = True
-            await self.__load_protections()
+        await self.__ensure_protections()
+        await self.__seed_super_user(ctx.guild)
+
+    async def __seed_super_user(self, server: discord.Guild):
+        """
+        Resolve the super user role, creating it if the guild does not have it, and make sure it and the owner are
+        allowed to use this cog. Until then the protection of this cog is empty, which would only let the owner in.
+        """
         if self.__roles == {}:
             role: discord.Role
-            for role in ctx.guild.roles:
+            for role in server.roles:
                 self.__roles[role.name] = role
-        server: discord.Guild = ctx.guild
         if self.__SUPER_USER_ROLE_NAME not in self.__roles:
             role: discord.Role = await server.create_role(
                 name=self.__SUPER_USER_ROLE_NAME,
@@ -94,10 +239,15 @@ class AdminCommands(NoConflictCog):
                 permissions=discord.Permissions.general()
             )
             self.__roles[role.name] = role
-        if await self.bot.fetch_user(self.bot.owner_id) not in self.__protections[self.qualified_name]:
-            self.__protections[self.qualified_name].add(await self.bot.fetch_user(self.bot.owner_id))
-        if self.__SUPER_USER_ROLE_NAME not in self.__protections[self.qualified_name]:
-            self.__protections[self.qualified_name].add(self.__roles[self.__SUPER_USER_ROLE_NAME])
+        protections = self.__protections[self.qualified_name]
+        if not self.__owner_protected:
+            # the owner is only looked up once, afterwards the index knows their snowflake
+            owner = self.bot.get_user(self.bot.owner_id) or await self.bot.fetch_user(self.bot.owner_id)
+            if owner not in protections:
+                self.__protect(self.qualified_name, owner)
+            self.__owner_protected = True
+        if self.__roles[self.__SUPER_USER_ROLE_NAME] not in protections:
+            self.__protect(self.qualified_name, self.__roles[self.__SUPER_USER_ROLE_NAME])
 
     async def bot_check(self, ctx: commands.Context) -> bool:
         """
@@ -108,17 +258,52 @@ class AdminCommands(NoConflictCog):
         command: commands.Command = ctx.command
 
         if ctx.channel is not None and cog is not None:
-            if cog.qualified_name in self.__protections:
-                return await self.check_restrictions(cog.qualified_name, ctx)
-            if cog.qualified_name + command.qualified_name in self.__protections:
-                return await self.check_restrictions(cog.qualified_name + "__" + command.qualified_name, ctx)
+            await self.__ensure_protections()
+            if cog is self and ctx.guild is not None:
+                # the global checks run before cog_before_invoke, the super user must be let in by the first command
+                await self.__seed_super_user(ctx.guild)
+            return await self.check_restrictions(cog.qualified_name, ctx) and \
+                await self.check_restrictions(cog.qualified_name + "__" + command.qualified_name, ctx)
         else:
             return await self.bot.is_owner(ctx.author)
 
     async def check_restrictions(self, name: str, ctx: commands.Context) -> bool:
-        return ctx.author in self.__protections[name] or self.__protections[name] \
-            .difference(set(ctx.author.roles)) is not None or await self.bot.is_owner(ctx.author) or ctx.channel in \
-            self.__protections
+        """
+        Whether the author of the context may use what is protected under the given name, unprotected names are
+        always allowed
+        """
+        metrics = self.bot.metrics
+        if not metrics.enabled:
+            return self.__index.allows(name, ctx.author, ctx.channel) or await self.bot.is_owner(ctx.author)
+        start = perf_counter()
+        try:
+            return self.__index.allows(name, ctx.author, ctx.channel) or await self.bot.is_owner(ctx.author)
+        finally:
+            metrics.observe("check", guild_id_of(ctx) if metrics.tracking else 0, self.qualified_name,
+                            "check_restrictions", perf_counter() - start)
+
+    @commands.Cog.listener()
+    async def on_guild_role_update(self, before: discord.Role, after: discord.Role):
+        if self.__roles.get(before.name) == before:
+            del self.__roles[before.name]
+            self.__roles[after.name] = after
+
+    @commands.Cog.listener()
+    async def on_guild_role_delete(self, role: discord.Role):
+        for name, protections in list(self.__protections.items()):
+            if role in protections:
+                self.__unprotect(name, role)
+        self.__roles.pop(role.name, None)
+        self.__index.invalidate_role(role.id)
+
+    @commands.Cog.listener()
+    async def on_member_update(self, before: discord.Member, after: discord.Member):
+        if before.roles != after.roles:
+            self.__index.invalidate_member(after.id)
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member: discord.Member):
+        self.__index.invalidate_member(member.id)
 
     async def cog_check(self, ctx):
         return ctx.guild is not None
@@ -145,7 +330,9 @@ class AdminCommands(NoConflictCog):
         """
         Purge all messages from the channel
         """
-        await ctx.channel.purge()
+        # deleting can take many requests, they must not hold up replies to anyone
+        with priority(BULK):
+            await ctx.channel.purge()
 
     @commands.command()
     async def loaded_extensions(self, ctx: commands.Context):
@@ -167,6 +354,36 @@ class AdminCommands(NoConflictCog):
             await ctx.send("Extension could not be reloaded.")
             raise e
 
+    @owner_only()
+    @commands.command()
+    async def fleet_reload(self, ctx: commands.Context, extension: str):
+        """
+        Reload an extension in every server at once, if too many servers fail all of them go back to the old version
+        :param extension: the extension to reload
+        """
+        fleet = (getattr(ctx.bot, "parent", None) or ctx.bot).fleet
+        try:
+            report = await fleet.reload(extension)
+        except Exception as e:
+            await ctx.send(f"{extension} could not be reloaded: {e}")
+            return
+        await ctx.send(report.summary())
+
+    @owner_only()
+    @commands.command()
+    async def fleet_load(self, ctx: commands.Context, extension: str):
+        """
+        Load an extension in every server at once, if too many servers fail it is unloaded from all of them again
+        :param extension: the extension to load
+        """
+        fleet = (getattr(ctx.bot, "parent", None) or ctx.bot).fleet
+        try:
+            report = await fleet.load(extension)
+        except Exception as e:
+            await ctx.send(f"{extension} could not be loaded: {e}")
+            return
+        await ctx.send(report.summary())
+
     @commands.guild_only()
     @commands.command()
     async def add_su(self, ctx: commands.Context, user: discord.Member):
@@ -178,7 +395,7 @@ class AdminCommands(NoConflictCog):
             await user.add_roles(self.__roles[self.__SUPER_USER_ROLE_NAME])
             await ctx.send(f"User {user} was added to the sudoers.")
         if self.__roles[self.__SUPER_USER_ROLE_NAME] not in self.__protections[self.qualified_name]:
-            self.__protections[self.qualified_name].add(self.__roles[self.__SUPER_USER_ROLE_NAME])
+            self.__protect(self.qualified_name, self.__roles[self.__SUPER_USER_ROLE_NAME])
 
     @commands.guild_only()
     @commands.command()
@@ -214,6 +431,67 @@ class AdminCommands(NoConflictCog):
                 end += f"{cog}\r"
         await ctx.send(ret + end)
 
+    @commands.command()
+    async def check_stats(self, ctx: commands.Context):
+        """
+        How often the checks guarding each listener turn events down and what they cost
+        """
+        ret = ""
+        for cog in self.bot.cogs.values():
+            for pipeline in pipelines(cog):
+                ret += pipeline.report()
+        await ctx.send(ret or "No listener has checks")
+
+    @commands.command()
+    async def latency(self, ctx: commands.Context, name: Optional[str] = None):
+        """
+        How long the commands, checks and listeners of this server take, servers are only measured once this was
+        asked for
+        :param name: Optional, only show what has this in its cog or name
+        """
+        metrics = self.bot.metrics
+        guild_id = guild_id_of(ctx)
+        if not metrics.tracked(guild_id):
+            metrics.track(guild_id)
+            await ctx.send("This server was not being measured, it is from now on. Ask again in a while.")
+            return
+        ret = ""
+        for (kind, cog, series_name), histogram in sorted(metrics.series(guild_id).items()):
+            label = f"{cog}.{series_name}" if cog else series_name
+            if name is not None and name not in label:
+                continue
+            # only some listener runs are timed, their count is an estimate
+            runs = f"~{histogram.count}" if kind == "listener" and metrics.listener_sample_every > 1 \
+                else histogram.count
+            ret += f"{kind} {label}: {runs} runs, p50 {histogram.quantile(0.5) * 1000:g}ms, " \
+                   f"p99 {histogram.quantile(0.99) * 1000:g}ms, mean {histogram.mean * 1000:.2f}ms\r"
+        await ctx.send(ret or "Nothing has been measured yet")
+
+    @commands.command()
+    async def slow_callbacks(self, ctx: commands.Context):
+        """
+        The latest times code of this server blocked the bot, stalling every other server meanwhile
+        """
+        if self.bot.watchdog is None:
+            await ctx.send("The event loop is not being watched")
+            return
+        offenders = self.bot.watchdog.recent(guild_id_of(ctx))
+        ret = "\r".join(str(offender) for offender in offenders[:20])
+        await ctx.send(ret or "Nothing from this server blocked the bot recently")
+
+    @commands.command()
+    async def outbox(self, ctx: commands.Context):
+        """
+        How many messages and edits the bot held back and merged in each channel of this server
+        """
+        ret = ""
+        for channel in ctx.guild.text_channels if ctx.guild is not None else [ctx.channel]:
+            stats = self.bot.outbox.channels.get(channel.id)
+            if stats is not None:
+                ret += f"#{channel.name}: {stats.flushes} flushes, {stats.sent}/{stats.queued} messages and " \
+                       f"{stats.edits_sent}/{stats.edits_queued} edits sent, {stats.requests_saved} requests saved\r"
+        await ctx.send(ret or "Nothing has been sent through the outbox yet")
+
     @commands.command()
     async def load_extension(self, ctx: commands.Context, extension):
         """
@@ -261,16 +539,15 @@ class AdminCommands(NoConflictCog):
             protections = self.__protections.setdefault(cog_name, set())
             super_user_role = self.__roles[self.__SUPER_USER_ROLE_NAME]
             if role is None and super_user_role not in protections:
-                protections.add(super_user_role)
+                self.__protect(cog_name, super_user_role)
                 await ctx.send(f"{cog_name} is protected to group {self.__SUPER_USER_ROLE_NAME}")
             elif role is None and super_user_role in protections:
                 await ctx.send(f"{cog_name} is protected to group {self.__SUPER_USER_ROLE_NAME}")
             elif role is not None and role not in protections:
-                protections.add(role)
+                self.__protect(cog_name, role)
                 await ctx.send(f"{cog_name} is protected to {role.name}")
         else:
             await ctx.send(f"{cog_name} does not exist")
-        self.__save_protections()
 
     @protect_cog.error
     async def protect_cog_error(self, ctx: commands.Context, error: commands.CommandError):
@@ -291,19 +568,18 @@ class AdminCommands(NoConflictCog):
             super_user_role = self.__roles[self.__SUPER_USER_ROLE_NAME]
             protections = self.__protections[cog_name]
             if role is None and super_user_role in protections:
-                protections.remove(super_user_role)
+                self.__unprotect(cog_name, super_user_role)
                 await ctx.send(f"{cog_name} unprotected from {self.__SUPER_USER_ROLE_NAME}")
             elif role is None and super_user_role not in protections:
                 await ctx.send(f"Please specify a group to unprotect {cog_name} from")
             elif role is not None and role in protections:
-                protections.remove(role)
+                self.__unprotect(cog_name, role)
                 await ctx.send(f"{cog_name} unprotected from {role}")
         else:
-            if cog_name not in self.bot.cogs:
+            if self.bot.get_cog(cog_name) is None:
                 await ctx.send(f"{cog_name} does not exist")
             else:
                 await ctx.send(f"{cog_name} has no protections")
-        self.__save_protections()
 
     @commands.is_owner()
     @commands.command()
@@ -317,15 +593,65 @@ class AdminCommands(NoConflictCog):
     @commands.command()
     async def save_config(self, ctx: commands.Context):
         """
-        Since the bot cannot be reliably killed if it is in the communal bot space, we must allow the user to save
-        protections at a given point in case the bot were to go down
-        TODO: Possibly make this automatically called at a given interval
-        TODO: Possibly support rolling back changes made within the given interval
+        Every change to the protections is journaled as it happens, this waits for the journal to be written and
+        compacts it into a snapshot which can be rolled back to
         TODO: Maybe allow premium users to have more extensive history of saves
         :param ctx:
         :return:
         """
-        self.__save_protections()
+        await self.__ensure_protections()
+        if self.__journal is not None:
+            await self.__journal.compact()
+            await ctx.send("Protections saved.")
+
+    class TimestampConverter(commands.Converter):
+
+        async def convert(self, ctx, argument) -> float:
+            try:
+                return float(argument)
+            except ValueError:
+                pass
+            try:
+                moment = datetime.fromisoformat(argument)
+            except ValueError:
+                raise commands.BadArgument(f"{argument} is neither a unix timestamp nor a date like 2020-05-01T18:30")
+            if moment.tzinfo is None:
+                moment = moment.replace(tzinfo=timezone.utc)
+            return moment.timestamp()
+
+    @commands.guild_only()
+    @commands.command()
+    async def rollback(self, ctx: commands.Context, timestamp: TimestampConverter):
+        """
+        Roll the protections back to how they were at a point in time by replaying the journal
+        :param timestamp: a unix timestamp or a date and time in UTC, like 2020-05-01T18:30
+        """
+        await self.__ensure_protections()
+        if self.__journal is None:
+            await ctx.send("There is no history to roll back to")
+            return
+        try:
+            config = await self.__journal.state_at(timestamp)
+        except ValueError as e:
+            await ctx.send(str(e))
+            return
+        # the target replaces every protection, the users which are still unresolved included
+        stale, self.__unresolved = self.__unresolved, {}
+        target = await self.__resolve(ctx.guild, config)
+        for snowflake, names in stale.items():
+            for name in set(names) - set(self.__unresolved.get(snowflake, ())):
+                if all(accessor.id != snowflake for accessor in target.get(name, ())):
+                    self.__journal.record("remove", name, ("user", snowflake))
+        # the rollback itself is journaled, so it can be rolled back as well
+        for name, accessors in list(self.__protections.items()):
+            for accessor in accessors - target.get(name, set()):
+                self.__unprotect(name, accessor)
+        for name, accessors in target.items():
+            for accessor in accessors - self.__protections.get(name, set()):
+                self.__protect(name, accessor)
+        await self.__journal.flush()
+        moment = datetime.fromtimestamp(timestamp, timezone.utc)
+        await ctx.send(f"Protections rolled back to {moment.strftime('%Y-%m-%d %H:%M:%S')} UTC")
 
     @commands.command()
     async def protect_command(self, ctx: commands.Context, cog: str, command: str,
@@ -336,16 +662,15 @@ class AdminCommands(NoConflictCog):
             protections = self.__protections.setdefault(prepared_name, set())
             super_user_role = self.__roles[self.__SUPER_USER_ROLE_NAME]
             if role is None and super_user_role not in protections:
-                protections.add(super_user_role)
+                self.__protect(prepared_name, super_user_role)
                 await ctx.send(f"{command} of {cog} is protected to group {self.__SUPER_USER_ROLE_NAME}")
             elif role is None and super_user_role in protections:
                 await ctx.send(f"{command} of {cog} is protected to group {self.__SUPER_USER_ROLE_NAME}")
             elif role is not None and role not in protections:
-                protections.add(role)
+                self.__protect(prepared_name, role)
                 await ctx.send(f"{command} of {cog} is protected to {role.name}")
         else:
             await ctx.send(f"{command} of {cog} does not exist")
-        self.__save_protections()
 
     @commands.command()
     async def unprotect_command(self, ctx: commands.Context, cog: str, command: str,
@@ -355,12 +680,12 @@ class AdminCommands(NoConflictCog):
             super_user_role = self.__roles[self.__SUPER_USER_ROLE_NAME]
             protections = self.__protections[prepared_name]
             if role is None and super_user_role in protections:
-                protections.remove(super_user_role)
+                self.__unprotect(prepared_name, super_user_role)
                 await ctx.send(f"{prepared_name} unprotected from {self.__SUPER_USER_ROLE_NAME}")
             elif role is None and super_user_role not in protections:
                 await ctx.send(f"Please specify a group to unprotect {prepared_name} from")
             elif role is not None and role in protections:
-                protections.remove(role)
+                self.__unprotect(prepared_name, role)
                 await ctx.send(f"{prepared_name} unprotected from {role}")
         else:
             if cog not in self.bot.cogs:
@@ -370,7 +695,6 @@ class AdminCommands(NoConflictCog):
                     await ctx.send(f"{cog} has no such command {command}")
                 else:
                     await ctx.send(f"{command} of {cog} has no protections")
-        self.__save_protections()
 
 
 def setup(bot: commands.Bot):
@@ -0,0 +1,132 @@
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+import discord
+
+# (kind, snowflake) where kind is one of "channel", "user", "guild" or "message"
+RouteKey = Tuple[str, int]
+KINDS = ("channel", "user", "guild", "message")
+
+
+def routed(name: Optional[str] = None):
+    """
+    Mark a cog method as a listener which is only called for the events its cog declared interest in with
+    NoConflictCog.route, the counterpart of commands.Cog.listener
+    :param name: the event to listen to, defaults to the name of the method
+    """
+    def decorator(func):
+        func.__routed_listener__ = name or func.__name__
+        return func
+    return decorator
+
+
+def route_keys(*args) -> Iterator[RouteKey]:
+    """
+    Every key an event with the given arguments can be routed by
+    """
+    for arg in args:
+        if isinstance(arg, discord.Message):
+            yield "message", arg.id
+            yield "channel", arg.channel.id
+            yield "user", arg.author.id
+            if arg.guild is not None:
+                yield "guild", arg.guild.id
+        elif isinstance(arg, discord.Reaction):
+            yield from route_keys(arg.message)
+        elif isinstance(arg, (discord.RawReactionActionEvent, discord.RawMessageUpdateEvent,
+                              discord.RawMessageDeleteEvent)):
+            yield "message", arg.message_id
+            yield "channel", arg.channel_id
+            if getattr(arg, "user_id", None) is not None:
+                yield "user", arg.user_id
+            if arg.guild_id is not None:
+                yield "guild", arg.guild_id
+        elif isinstance(arg, discord.abc.User):
+            yield "user", arg.id
+            if isinstance(arg, discord.Member):
+                yield "guild", arg.guild.id
+        elif isinstance(arg, discord.abc.GuildChannel):
+            yield "channel", arg.id
+            yield "guild", arg.guild.id
+        elif isinstance(arg, discord.Guild):
+            yield "guild", arg.id
+
+
+class EventRouter:
+    """
+    Finds the listeners interested in an event through hashed indexes of the channels, users, guilds and messages they
+    asked for, so the cost of an event depends on how many listeners care about it rather than how many exist.
+    A listener interested in several keys of the same event is called once.
+    """
+
+    def __init__(self):
+        # event -> key -> listeners, dicts keep the order listeners subscribed in
+        self.__index: Dict[str, Dict[RouteKey, Dict[Callable, None]]] = {}
+        self.__subscriptions: Dict[Callable, Set[Tuple[str, RouteKey]]] = {}
+        # called with the name of an event when it gets its first or loses its last listener
+        self.on_change: Optional[Callable[[str], None]] = None
+
+    def subscribe(self, event: str, listener: Callable, kind: str, snowflake: int) -> None:
+        """
+        Call the listener for the event whenever it involves the given snowflake
+        :param event: the name of the event, like on_message
+        :param kind: one of KINDS
+        """
+        if kind not in KINDS:
+            raise ValueError(f"Cannot route by {kind}")
+        key = (kind, snowflake)
+        new = event not in self.__index
+        self.__index.setdefault(event, {}).setdefault(key, {})[listener] = None
+        self.__subscriptions.setdefault(listener, set()).add((event, key))
+        if new and self.on_change is not None:
+            self.on_change(event)
+
+    def unsubscribe(self, event: str, listener: Callable, kind: str, snowflake: int) -> None:
+        key = (kind, snowflake)
+        index = self.__index.get(event, {})
+        listeners = index.get(key, {})
+        listeners.pop(listener, None)
+        if not listeners:
+            index.pop(key, None)
+        subscriptions = self.__subscriptions.get(listener, set())
+        subscriptions.discard((event, key))
+        if not subscriptions:
+            self.__subscriptions.pop(listener, None)
+        if not index and self.__index.pop(event, None) is not None and self.on_change is not None:
+            self.on_change(event)
+
+    def forget(self, listener: Callable) -> None:
+        """
+        Drop every subscription of a listener
+        """
+        for event, (kind, snowflake) in list(self.__subscriptions.get(listener, ())):
+            self.unsubscribe(event, listener, kind, snowflake)
+
+    def forget_owner(self, owner: object) -> None:
+        """
+        Drop every subscription of the listeners bound to the given object, e.g. a cog being unloaded
+        """
+        for listener in [listener for listener in self.__subscriptions if getattr(listener, "__self__", None) is owner]:
+            self.forget(listener)
+
+    def listens(self, event: str) -> bool:
+        """
+        Whether any listener is subscribed to the event
+        """
+        return event in self.__index
+
+    def subscriptions(self, listener: Callable) -> Set[Tuple[str, RouteKey]]:
+        return set(self.__subscriptions.get(listener, ()))
+
+    def listeners(self, event: str, *args) -> List[Callable]:
+        """
+        The listeners interested in an event with the given arguments
+        """
+        index = self.__index.get(event)
+        if not index:
+            return []
+        interested: Dict[Callable, None] = {}
+        for key in route_keys(*args):
+            listeners = index.get(key)
+            if listeners:
+                interested.update(listeners)
+        return list(interested)
@@ -0,0 +1,78 @@
+import importlib.util
+import sys
+from types import ModuleType
+from typing import Dict, Optional
+
+from discord.ext.commands import errors
+
+from LazyExtensions import ExtensionManifest
+
+
+class ExtensionTemplates:
+    """
+    Extension modules executed once and shared by every bot which loads them. The cog classes, and with them the
+    command objects and their parsed signatures, exist once, each bot only gets its own cog instances.
+    """
+
+    def __init__(self):
+        self.__modules: Dict[str, ModuleType] = {}
+        self.__manifests: Dict[str, ExtensionManifest] = {}
+        self.executions = 0
+        self.loads = 0
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.__modules
+
+    def module(self, name: str) -> ModuleType:
+        """
+        The module of an extension, executing it the first time it is asked for
+        :param name: the resolved name of the extension
+        :raises ExtensionNotFound: if there is no such module
+        :raises ExtensionFailed: if the module raised while being executed
+        :raises NoEntryPointError: if the module has no setup function
+        """
+        self.loads += 1
+        lib = self.__modules.get(name)
+        if lib is not None:
+            return lib
+        lib = sys.modules.get(name)
+        if lib is None:
+            spec = importlib.util.find_spec(name)
+            if spec is None:
+                raise errors.ExtensionNotFound(name)
+            lib = importlib.util.module_from_spec(spec)
+            sys.modules[name] = lib
+            try:
+                spec.loader.exec_module(lib)
+            except Exception as e:
+                del sys.modules[name]
+                raise errors.ExtensionFailed(name, e) from e
+            self.executions += 1
+        if not hasattr(lib, "setup"):
+            raise errors.NoEntryPointError(name)
+        self.__modules[name] = lib
+        return lib
+
+    def manifest(self, name: str) -> ExtensionManifest:
+        """
+        What the extension registers, for loading it lazily
+        """
+        manifest = self.__manifests.get(name)
+        if manifest is None:
+            manifest = self.__manifests[name] = ExtensionManifest.build(name, self.module(name))
+        return manifest
+
+    def forget(self, name: str) -> Optional[ModuleType]:
+        """
+        Drop an extension's module, the next bot loading it executes it again
+        :return: the module which was dropped
+        """
+        self.__manifests.pop(name, None)
+        return self.__modules.pop(name, None)
+
+    def share(self, name: str, lib: ModuleType) -> None:
+        """
+        Make an already executed module the shared one of the extension, e.g. when a reload is rolled back
+        """
+        self.__manifests.pop(name, None)
+        self.__modules[name] = lib
@@ -0,0 +1,178 @@
+import asyncio
+import sys
+from typing import Any, Dict, Iterable, List
+
+from discord.ext import commands
+
+from NoConflictCog import NoConflictCog
+
+
+class FleetReport:
+    """
+    How an extension rollout across the guild bots went, by guild id
+    """
+
+    def __init__(self, extension: str, action: str, targets: int):
+        self.extension = extension
+        self.action = action
+        self.targets = targets
+        self.succeeded: List[int] = []
+        self.failed: Dict[int, str] = {}
+        # guilds whose bots were never changed because the rollout was stopped first
+        self.skipped = 0
+        self.rolled_back = False
+        self.rollback_failed: Dict[int, str] = {}
+
+    def summary(self, max_failures: int = 10) -> str:
+        ret = f"{self.action} {self.extension}: {len(self.succeeded)}/{self.targets} guilds succeeded, " \
+              f"{len(self.failed)} failed"
+        if self.skipped:
+            ret += f", {self.skipped} skipped"
+        ret += "\r"
+        for guild_id, error in list(self.failed.items())[:max_failures]:
+            ret += f"\t{guild_id}: {error}\r"
+        if len(self.failed) > max_failures:
+            ret += f"\t... and {len(self.failed) - max_failures} more\r"
+        if self.rolled_back:
+            ret += "Rolled back, the failure rate passed the threshold"
+            if self.rollback_failed:
+                ret += f", {len(self.rollback_failed)} guilds could not be rolled back: " \
+                       f"{', '.join(map(str, self.rollback_failed))}"
+            ret += "\r"
+        return ret
+
+
+class FleetRollout:
+    """
+    Loads or reloads an extension on every live guild bot at once. The module is executed once and shared, the bots
+    are switched over a few at a time, and if too many of them fail every bot goes back to how it was.
+    Hibernated guilds are not woken up, they load the extension's current module when they are restored. An extension
+    loaded across the fleet becomes one of the main bot's guild extensions, so bots built or restored later get it too.
+    """
+
+    def __init__(self, bot, parallelism: int = 8, failure_threshold: float = 0.1):
+        """
+        :param bot: the MainBot whose guild bots are rolled out to
+        :param parallelism: the amount of guild bots switched over at once
+        :param failure_threshold: the share of guild bots which may fail before the rollout is rolled back
+        """
+        self.bot = bot
+        self.parallelism = parallelism
+        self.failure_threshold = failure_threshold
+        # only one rollout at a time, two of them would roll each other's bots back
+        self.__lock = asyncio.Lock()
+
+    def __bots(self) -> List[Any]:
+        return [self.bot] + list(self.bot.registry)
+
+    async def reload(self, name: str) -> FleetReport:
+        """
+        Execute a new version of an extension once and switch every bot which has it loaded over to it
+        :raises ExtensionError: if the new version could not be executed, no bot was touched
+        """
+        async with self.__lock:
+            templates = self.bot.templates
+            old = templates.forget(name)
+            previous = sys.modules.pop(name, None)
+            try:
+                new = templates.module(name)
+            except Exception:
+                self.__restore_module(name, old, previous)
+                raise
+            bots = [bot for bot in self.__bots() if name in bot.extensions]
+            report = FleetReport(name, "reload", len(bots))
+            await self.__roll_out(report, bots, lambda bot: bot.replace_extension(name))
+            if report.failed and self.__past_threshold(report):
+                self.__restore_module(name, old, previous)
+                # bots built or restored during the rollout loaded the new version as well
+                await self.__roll_back(report, lambda bot: bot.extensions.get(name) is new,
+                                       lambda bot: bot.replace_extension(name))
+            return report
+
+    async def load(self, name: str) -> FleetReport:
+        """
+        Load an extension into every bot which does not have it yet, and into every guild bot built from now on
+        :raises ExtensionError: if the extension could not be executed, no bot was touched
+        """
+        async with self.__lock:
+            self.bot.templates.module(name)
+            had = {self.__guild_id(bot) for bot in self.__bots() if name in bot.extensions}
+            extensions = self.bot.GUILD_EXTENSIONS
+            if name not in extensions:
+                self.bot.GUILD_EXTENSIONS = extensions + (name,)
+            bots = [bot for bot in self.__bots() if name not in bot.extensions]
+            report = FleetReport(name, "load", len(bots))
+            await self.__roll_out(report, bots, lambda bot: bot.load_extension(name))
+            if report.failed and self.__past_threshold(report):
+                self.bot.GUILD_EXTENSIONS = extensions
+                # bots built or restored during the rollout loaded it as well
+                await self.__roll_back(report, lambda bot: name in bot.extensions and self.__guild_id(bot) not in had,
+                                       lambda bot: bot.unload_extension(name))
+            return report
+
+    def __past_threshold(self, report: FleetReport) -> bool:
+        return len(report.failed) > self.failure_threshold * report.targets
+
+    def __restore_module(self, name: str, old, previous) -> None:
+        if previous is not None:
+            sys.modules[name] = previous
+        else:
+            sys.modules.pop(name, None)
+        if old is not None:
+            self.bot.templates.share(name, old)
+        else:
+            self.bot.templates.forget(name)
+
+    async def __roll_out(self, report: FleetReport, bots: Iterable[Any], switch) -> None:
+        queue = list(bots)
+        queue.reverse()
+        guild_ids = {id(bot): self.__guild_id(bot) for bot in queue}
+
+        async def worker():
+            while queue and not self.__past_threshold(report):
+                bot = queue.pop()
+                guild_id = guild_ids[id(bot)]
+                try:
+                    switch(bot)
+                    # the new cogs read their state before the next bot is switched
+                    await asyncio.gather(*(cog.load_stored_state() for cog in bot.cogs.values()
+                                           if isinstance(cog, NoConflictCog)))
+                except Exception as e:
+                    report.failed[guild_id] = str(getattr(e, "original", None) or e)
+                else:
+                    report.succeeded.append(guild_id)
+                # give the events of the other guilds a turn
+                await asyncio.sleep(0)
+
+        await asyncio.gather(*(worker() for _ in range(self.parallelism)))
+        report.skipped = len(queue)
+
+    async def __roll_back(self, report: FleetReport, changed, undo) -> None:
+        report.rolled_back = True
+        for bot in self.__bots():
+            # bots hibernated meanwhile are restored with whatever the templates hold now
+            if not changed(bot):
+                continue
+            try:
+                undo(bot)
+            except Exception as e:
+                report.rollback_failed[self.__guild_id(bot)] = str(e)
+            await asyncio.sleep(0)
+
+    @staticmethod
+    def __guild_id(bot) -> int:
+        guild = getattr(bot, "guild", None)
+        # the main bot is not bound to a guild
+        return guild.id if guild is not None else 0
+
+
+def owner_only():
+    """
+    A check which only lets the owner of the whole bot through, the owner of a guild bot is the guild's owner
+    """
+    async def predicate(ctx: commands.Context) -> bool:
+        bot = getattr(ctx.bot, "parent", None) or ctx.bot
+        if not await bot.is_owner(ctx.author):
+            raise commands.NotOwner("Only the owner of the bot can roll out extensions")
+        return True
+    return commands.check(predicate)
@@ -1,10 +1,11 @@
 from datetime import datetime
 from math import floor
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Any, Tuple
 
 import discord
 from discord.ext import commands
 
+from EventRouter import routed
 from NoConflictCog import NoConflictCog
 
 
@@ -16,6 +17,30 @@ class GuildExtension(NoConflictCog):
             Dict[int, List[discord.User]] = {}
         self.watched_channels = []
 
+    def export_state(self) -> Dict[str, Any]:
+        return {
+            "tracked_messages": {
+                message_id: [user.id for user in users] for message_id, users in self.tracked_messages.items()
+            }
+        }
+
+    def import_state(self, state: Dict[str, Any]) -> None:
+        # users which are no longer cached are kept as plain snowflakes, reactions are matched by id
+        self.tracked_messages = {
+            message_id: [self.bot.get_user(user_id) or discord.Object(user_id) for user_id in users]
+            for message_id, users in state["tracked_messages"].items()
+        }
+        self.unroute(self.on_reaction_add)
+        for message_id in self.tracked_messages:
+            self.route(self.on_reaction_add, message=message_id)
+
+    @classmethod
+    def routes(cls, state: Dict[str, Any]) -> List[Tuple[str, str, int]]:
+        return [("on_reaction_add", "message", message_id) for message_id in state.get("tracked_messages", {})]
+
+    async def cog_before_invoke(self, ctx: commands.Context):
+        await self.load_stored_state()
+
     class DateTimeConverter(commands.Converter):
 
         async def convert(self, ctx, argument) -> datetime:
@@ -43,19 +68,27 @@ class GuildExtension(NoConflictCog):
                                  f"React to this when you are paid or if you wish to donate.\r"
                                  f"{' '.join([str(user.mention) for user in users])}")
         self.tracked_messages.update({message.id: list(users)})
+        self.route(self.on_reaction_add, message=message.id)
+        self.persist("tracked_messages")
 
-    @commands.Cog.listener()
+    @routed()
     async def on_reaction_add(self, reaction: discord.Reaction, user: discord.User):
+        await self.load_stored_state()
         if reaction.message.id in self.tracked_messages:
-            if user in self.tracked_messages[reaction.message.id]:
-                self.tracked_messages[reaction.message.id].remove(user)
+            payee = next((x for x in self.tracked_messages[reaction.message.id] if x.id == user.id), None)
+            if payee is not None:
+                self.tracked_messages[reaction.message.id].remove(payee)
+                self.persist("tracked_messages")
                 r: discord.Message
                 r = reaction.message
-                new_content = r.content.replace(user.mention, "", 1)
+                # reactions arriving together are one edit, each has to build on the one still queued
+                content = self.bot.outbox.pending_edit(r).get("content", r.content)
+                new_content = content.replace(user.mention, "", 1)
                 if len(self.tracked_messages[r.id]) == 0:
-                    await r.edit(content="All users paid! :smile:")
+                    self.unroute(self.on_reaction_add, message=r.id)
+                    await self.bot.outbox.edit(r, content="All users paid! :smile:")
                 else:
-                    await r.edit(content=new_content)
+                    await self.bot.outbox.edit(r, content=new_content)
 
 
 def setup(bot: commands.Bot):
@@ -0,0 +1,236 @@
+import asyncio
+import pickle
+from collections import OrderedDict
+from os import path, makedirs, remove
+from time import monotonic, perf_counter
+from typing import Callable, Dict, Iterator, Optional, Any
+
+import discord
+
+from NoConflictCog import NoConflictCog
+
+
+class GuildBotRegistry:
+    """
+    A bounded mapping of guild ids to the bot serving that guild.
+
+    Bots which have not seen a message for longer than the idle ttl, or which fall off the end of the LRU when the
+    registry is full, are hibernated: the extensions they had loaded and the state of their cogs is written to disk and
+    the bot is dropped. The next time the guild is seen the bot is rebuilt from that state.
+    """
+
+    HIBERNATION_FILE = "Hibernation"
+
+    def __init__(self, factory: Callable[[discord.Guild], Any], capacity: int = 1000, ttl: float = 3600.0):
+        """
+        :param factory: builds a fresh bot (with the default extensions loaded) for the given guild
+        :param capacity: the maximum amount of bots kept alive at once
+        :param ttl: the amount of seconds a bot can go unused before it is hibernated
+        """
+        self.__factory = factory
+        self.capacity = capacity
+        self.ttl = ttl
+        # guild id -> bot, least recently used first
+        self.__bots: "OrderedDict[int, Any]" = OrderedDict()
+        self.__last_used: Dict[int, float] = {}
+        # hibernations which are still being written, a restore must wait for these
+        self.__pending: Dict[int, asyncio.Future] = {}
+        # restores which are still reading their file, whoever needs the guild's bot meanwhile waits for the same one
+        self.__restoring: Dict[int, asyncio.Future] = {}
+        # the sweep runs beside the messages, a message never waits for other guilds to be written to disk
+        self.__sweeping: Optional[asyncio.Future] = None
+
+        self.hits = 0
+        self.misses = 0
+        self.restores = 0
+        self.hibernations = 0
+        self.warmed = 0
+        self.restore_time = 0.0
+        self.max_restore_time = 0.0
+
+    def __contains__(self, guild_id: int) -> bool:
+        return guild_id in self.__bots
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(list(self.__bots.values()))
+
+    def __len__(self) -> int:
+        return len(self.__bots)
+
+    @classmethod
+    def hibernation_path(cls, guild_id: int) -> str:
+        return path.join("..", str(guild_id), cls.HIBERNATION_FILE)
+
+    def peek(self, guild_id: int) -> Optional[Any]:
+        """
+        Get the live bot for a guild without counting it as a use
+        """
+        return self.__bots.get(guild_id)
+
+    async def get(self, guild: discord.Guild):
+        """
+        Get the bot for a guild, building or restoring it if it is not alive
+        """
+        now = monotonic()
+        bot = self.__bots.get(guild.id)
+        if bot is not None:
+            self.hits += 1
+            self.__bots.move_to_end(guild.id)
+        else:
+            self.misses += 1
+            bot = await self.__restore(guild)
+            self.__bots[guild.id] = bot
+        self.__last_used[guild.id] = now
+        if (self.__sweeping is None or self.__sweeping.done()) and self.__needs_sweep(now):
+            self.__sweeping = asyncio.ensure_future(self.sweep())
+        return bot
+
+    async def warm(self, guild: discord.Guild) -> bool:
+        """
+        Build or restore the bot of a guild ahead of its first message. Warm bots have not been used, when the registry
+        is full they are the first to go.
+        :return: False if the guild's bot is alive already or the registry is full
+        """
+        if guild.id in self.__bots or len(self.__bots) >= self.capacity:
+            return False
+        bot = await self.__restore(guild)
+        if guild.id in self.__bots:
+            return False
+        self.__bots[guild.id] = bot
+        self.__bots.move_to_end(guild.id, last=False)
+        self.__last_used[guild.id] = monotonic()
+        self.warmed += 1
+        return True
+
+    async def sweep(self, now: Optional[float] = None) -> None:
+        """
+        Hibernate every bot which has been idle for longer than the ttl and, if the registry is over capacity, the
+        least recently used bots.
+        """
+        now = monotonic() if now is None else now
+        while self.__needs_sweep(now):
+            await self.hibernate(next(iter(self.__bots)))
+
+    def __needs_sweep(self, now: float) -> bool:
+        if not self.__bots:
+            return False
+        return len(self.__bots) > self.capacity or now - self.__last_used[next(iter(self.__bots))] >= self.ttl
+
+    async def close(self) -> None:
+        """
+        Wait for the running sweep, so no hibernation is cut off halfway
+        """
+        if self.__sweeping is not None:
+            await self.__sweeping
+
+    async def hibernate(self, guild_id: int) -> None:
+        """
+        Write the state of a guild's bot to disk and evict it
+        """
+        bot = self.__bots.pop(guild_id, None)
+        self.__last_used.pop(guild_id, None)
+        if bot is None:
+            return
+        # the state of cogs which were never created since the bot was restored is still waiting to be imported
+        state: Dict[str, Dict[str, Any]] = dict(getattr(bot, "deferred_states", {}))
+        for name, cog in bot.cogs.items():
+            if isinstance(cog, NoConflictCog):
+                state[name] = cog.export_state()
+        record = {"extensions": list(bot.extensions), "cogs": state}
+        if hasattr(bot, "listeners_changed"):
+            # unloading must not take the guild out of the events it listens to, those wake it up again
+            bot.listeners_changed = None
+        for extension in list(bot.extensions):
+            try:
+                bot.unload_extension(extension)
+            except Exception as e:
+                print(f"Could not unload {extension} while hibernating {guild_id}: {e}")
+        self.hibernations += 1
+
+        write = asyncio.get_event_loop().run_in_executor(None, self.__write, guild_id, record)
+        self.__pending[guild_id] = write
+        try:
+            await write
+        finally:
+            if self.__pending.get(guild_id) is write:
+                del self.__pending[guild_id]
+
+    def __write(self, guild_id: int, record: Dict[str, Any]) -> None:
+        filename = self.hibernation_path(guild_id)
+        makedirs(path.dirname(filename), exist_ok=True)
+        with open(filename, 'wb') as f:
+            pickle.dump(record, f)
+
+    def __read(self, guild_id: int) -> Dict[str, Any]:
+        with open(self.hibernation_path(guild_id), 'rb') as f:
+            return pickle.load(f)
+
+    async def __restore(self, guild: discord.Guild):
+        restoring = self.__restoring.get(guild.id)
+        if restoring is None:
+            restoring = asyncio.ensure_future(self.__rebuild(guild))
+            self.__restoring[guild.id] = restoring
+            try:
+                return await asyncio.shield(restoring)
+            finally:
+                if self.__restoring.get(guild.id) is restoring:
+                    del self.__restoring[guild.id]
+        return await asyncio.shield(restoring)
+
+    async def __rebuild(self, guild: discord.Guild):
+        pending = self.__pending.get(guild.id)
+        if pending is not None:
+            await asyncio.shield(pending)
+            # whoever waited on the hibernation first restored the bot, the file is gone now
+            bot = self.__bots.get(guild.id)
+            if bot is not None:
+                return bot
+
+        if not path.exists(self.hibernation_path(guild.id)):
+            return self.__factory(guild)
+        start = perf_counter()
+        try:
+            # large guilds take a while to unpickle, the other guilds' events go on meanwhile
+            record: Dict[str, Any] = await asyncio.get_event_loop().run_in_executor(None, self.__read, guild.id)
+        except FileNotFoundError:
+            return self.__factory(guild)
+
+        bot = self.__factory(guild)
+        for extension in record["extensions"]:
+            if extension not in bot.extensions:
+                try:
+                    bot.load_extension(extension)
+                except Exception as e:
+                    print(f"Could not restore {extension} for {guild.id}: {e}")
+        for name, state in record["cogs"].items():
+            # not get_cog, asking for a cog by name creates the cogs of a lazily loaded extension
+            cog = bot.cogs.get(name)
+            if isinstance(cog, NoConflictCog):
+                cog.import_state(state)
+            elif hasattr(bot, "deferred_states"):
+                # the extension was loaded lazily, the cog imports it when it is created
+                bot.deferred_states[name] = state
+        # once the bot is alive the file is stale, the next hibernation will write a fresh one
+        remove(self.hibernation_path(guild.id))
+
+        elapsed = perf_counter() - start
+        self.restores += 1
+        self.restore_time += elapsed
+        self.max_restore_time = max(self.max_restore_time, elapsed)
+        return bot
+
+    def stats(self) -> Dict[str, float]:
+        """
+        The counters of the registry, restore times are in seconds
+        """
+        return {
+            "alive": len(self.__bots),
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+            "restores": self.restores,
+            "hibernations": self.hibernations,
+            "warmed": self.warmed,
+            "mean_restore_time": self.restore_time / self.restores if self.restores else 0.0,
+            "max_restore_time": self.max_restore_time,
+        }
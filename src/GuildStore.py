@@ -0,0 +1,238 @@
+import asyncio
+import pickle
+import sqlite3
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from os import path, makedirs
+from typing import Any, Dict, List, Optional, Tuple
+
+# (guild id, namespace, key)
+StoreKey = Tuple[int, str, str]
+
+# marks a key which is known not to exist in the cache, or which is waiting to be deleted
+_MISSING = object()
+
+
+class GuildStore:
+    """
+    A key-value store shared by every guild and cog, backed by a single SQLite database.
+
+    Namespaces are read as a whole and kept in an LRU cache which writes go through. Writes are buffered and
+    committed together in one transaction every flush_interval seconds. All database work happens on a single
+    background thread so the event loop never waits on the disk.
+    """
+
+    def __init__(self, filename: str = path.join("..", "state.sqlite3"), cache_size: int = 10000,
+                 flush_interval: float = 1.0):
+        """
+        :param filename: where the database is kept
+        :param cache_size: the amount of values kept in memory, whole namespaces are evicted to stay below it
+        :param flush_interval: the amount of seconds writes are held to be committed together
+        """
+        self.filename = filename
+        self.cache_size = cache_size
+        self.flush_interval = flush_interval
+        # (guild id, namespace) -> every value of the namespace, least recently used first
+        self.__cache: "OrderedDict[Tuple[int, str], Dict[str, Any]]" = OrderedDict()
+        self.__cached_values = 0
+        self.__pending: Dict[StoreKey, Any] = {}
+        # the batches being committed, oldest first, until they are their values are newer than the database's
+        self.__committing: List[Dict[StoreKey, Any]] = []
+        # the namespaces being read, along with the writes made to them meanwhile
+        self.__reading: Dict[Tuple[int, str], asyncio.Future] = {}
+        self.__written: Dict[Tuple[int, str], Dict[str, Any]] = {}
+        self.__flushing: Optional[asyncio.TimerHandle] = None
+        self.__executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="GuildStore")
+        self.__connection: Optional[sqlite3.Connection] = None
+
+        self.hits = 0
+        self.misses = 0
+        self.commits = 0
+
+    def namespace(self, guild_id: int, namespace: str) -> "StoreNamespace":
+        return StoreNamespace(self, guild_id, namespace)
+
+    async def __run(self, func, *args):
+        return await asyncio.get_event_loop().run_in_executor(self.__executor, func, *args)
+
+    def __connect(self) -> sqlite3.Connection:
+        if self.__connection is None:
+            if path.dirname(self.filename):
+                makedirs(path.dirname(self.filename), exist_ok=True)
+            self.__connection = sqlite3.connect(self.filename, check_same_thread=False)
+            self.__connection.execute("PRAGMA journal_mode=WAL")
+            self.__connection.execute(
+                "CREATE TABLE IF NOT EXISTS state ("
+                "guild INTEGER NOT NULL, namespace TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, "
+                "PRIMARY KEY (guild, namespace, key)) WITHOUT ROWID"
+            )
+        return self.__connection
+
+    def __select_namespace(self, guild_id: int, namespace: str) -> Dict[str, Any]:
+        rows = self.__connect().execute(
+            "SELECT key, value FROM state WHERE guild = ? AND namespace = ?", (guild_id, namespace))
+        return {key: pickle.loads(value) for key, value in rows}
+
+    def __select_by_guild(self, namespace: str, key: str) -> Dict[int, Any]:
+        rows = self.__connect().execute(
+            "SELECT guild, value FROM state WHERE namespace = ? AND key = ?", (namespace, key))
+        return {guild_id: pickle.loads(value) for guild_id, value in rows}
+
+    def __commit(self, batch: Dict[StoreKey, Any]) -> None:
+        connection = self.__connect()
+        with connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO state (guild, namespace, key, value) VALUES (?, ?, ?, ?)",
+                [key + (pickle.dumps(value),) for key, value in batch.items() if value is not _MISSING])
+            connection.executemany(
+                "DELETE FROM state WHERE guild = ? AND namespace = ? AND key = ?",
+                [key for key, value in batch.items() if value is _MISSING])
+
+    def __remember(self, namespace: Tuple[int, str], values: Dict[str, Any]) -> None:
+        self.__cached_values += len(values) - len(self.__cache.pop(namespace, ()))
+        self.__cache[namespace] = values
+        while self.__cached_values > self.cache_size and len(self.__cache) > 1:
+            self.__cached_values -= len(self.__cache.popitem(last=False)[1])
+
+    async def __namespace(self, guild_id: int, namespace: str) -> Dict[str, Any]:
+        """
+        The cached values of a namespace, read as a whole the first time it is needed
+        """
+        cached = self.__cache.get((guild_id, namespace))
+        if cached is not None:
+            self.hits += 1
+            self.__cache.move_to_end((guild_id, namespace))
+            return cached
+        reading = self.__reading.get((guild_id, namespace))
+        if reading is None:
+            self.misses += 1
+            # writes made from now on are newer than whatever the read returns
+            self.__written[(guild_id, namespace)] = {}
+            reading = asyncio.ensure_future(self.__read_namespace(guild_id, namespace))
+            self.__reading[(guild_id, namespace)] = reading
+        return await asyncio.shield(reading)
+
+    async def __read_namespace(self, guild_id: int, namespace: str) -> Dict[str, Any]:
+        try:
+            values = await self.__run(self.__select_namespace, guild_id, namespace)
+        finally:
+            written = self.__written.pop((guild_id, namespace))
+            del self.__reading[(guild_id, namespace)]
+        # writes which were not committed when the read started, or which came in while it was running, are newer than
+        # what was read
+        for batch in self.__committing + [self.__pending]:
+            for key, value in batch.items():
+                if key[:2] == (guild_id, namespace):
+                    self.__apply(values, key[2], value)
+        for key, value in written.items():
+            self.__apply(values, key, value)
+        self.__remember((guild_id, namespace), values)
+        return values
+
+    @staticmethod
+    def __apply(values: Dict[str, Any], key: str, value: Any) -> int:
+        """
+        Write a value into the values of a namespace
+        :return: how many values were added, -1 if one was deleted
+        """
+        if value is _MISSING:
+            return -1 if values.pop(key, _MISSING) is not _MISSING else 0
+        added = key not in values
+        values[key] = value
+        return int(added)
+
+    async def get(self, key: StoreKey, default: Any = None) -> Any:
+        for batch in [self.__pending] + self.__committing[::-1]:
+            if key in batch:
+                value = batch[key]
+                break
+        else:
+            value = (await self.__namespace(key[0], key[1])).get(key[2], _MISSING)
+        return default if value is _MISSING else value
+
+    async def items(self, guild_id: int, namespace: str) -> Dict[str, Any]:
+        """
+        Every key of a namespace along with its value
+        """
+        return dict(await self.__namespace(guild_id, namespace))
+
+    async def by_guild(self, namespace: str, key: str) -> Dict[int, Any]:
+        """
+        The value of a key in every guild which has it, the values are not cached
+        """
+        values = await self.__run(self.__select_by_guild, namespace, key)
+        for (guild_id, pending_namespace, pending_key), value in self.__pending.items():
+            if (pending_namespace, pending_key) == (namespace, key):
+                if value is _MISSING:
+                    values.pop(guild_id, None)
+                else:
+                    values[guild_id] = value
+        return values
+
+    def set(self, key: StoreKey, value: Any) -> None:
+        """
+        Set a value, the write is buffered and committed with the next batch
+        """
+        self.__pending[key] = value
+        cached = self.__cache.get(key[:2])
+        if cached is not None:
+            self.__cached_values += self.__apply(cached, key[2], value)
+        written = self.__written.get(key[:2])
+        if written is not None:
+            written[key[2]] = value
+        if self.__flushing is None:
+            # a timer rather than a sleeping task, the flush does not belong to the handler which happened to write first
+            self.__flushing = asyncio.get_event_loop().call_later(self.flush_interval, self.__flush_later)
+
+    def delete(self, key: StoreKey) -> None:
+        self.set(key, _MISSING)
+
+    def __flush_later(self) -> None:
+        self.__flushing = None
+        asyncio.ensure_future(self.flush())
+
+    async def flush(self) -> None:
+        """
+        Commit every buffered write
+        """
+        while self.__pending:
+            batch, self.__pending = self.__pending, {}
+            self.__committing.append(batch)
+            try:
+                await self.__run(self.__commit, batch)
+            finally:
+                self.__committing.remove(batch)
+            self.commits += 1
+
+    async def close(self) -> None:
+        if self.__flushing is not None:
+            self.__flushing.cancel()
+            self.__flushing = None
+        await self.flush()
+        if self.__connection is not None:
+            await self.__run(self.__connection.close)
+            self.__connection = None
+        self.__executor.shutdown(wait=True)
+
+
+class StoreNamespace:
+    """
+    The part of the store belonging to one cog of one guild
+    """
+
+    def __init__(self, store: GuildStore, guild_id: int, namespace: str):
+        self.store = store
+        self.guild_id = guild_id
+        self.namespace = namespace
+
+    async def get(self, key: str, default: Any = None) -> Any:
+        return await self.store.get((self.guild_id, self.namespace, key), default)
+
+    async def items(self) -> Dict[str, Any]:
+        return await self.store.items(self.guild_id, self.namespace)
+
+    def set(self, key: str, value: Any) -> None:
+        self.store.set((self.guild_id, self.namespace, key), value)
+
+    def delete(self, key: str) -> None:
+        self.store.delete((self.guild_id, self.namespace, key))
@@ -0,0 +1,196 @@
+import asyncio
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+from typing import Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+from discord.http import Route
+
+from Metrics import Metrics
+
+# the order requests are let through in, a request waits for every waiting request of an earlier level
+INTERACTIVE = 0
+NORMAL = 1
+BULK = 2
+LEVELS: Tuple[int, ...] = (INTERACTIVE, NORMAL, BULK)
+LEVEL_NAMES: Tuple[str, ...] = ("interactive", "normal", "bulk")
+
+_priority: ContextVar[int] = ContextVar("http_priority", default=NORMAL)
+
+
+@contextmanager
+def priority(level: int) -> Iterator[None]:
+    """
+    Send the requests made in the block, and in the tasks started from it, at the given level
+    """
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class GuildQueue:
+    """
+    The requests of one guild which are waiting or being sent
+    """
+
+    __slots__ = ("waiting", "in_flight", "sent", "waited")
+
+    def __init__(self):
+        self.waiting: List[Deque[asyncio.Future]] = [deque() for _ in LEVELS]
+        self.in_flight = 0
+        self.sent = 0
+        self.waited = 0.0
+
+    @property
+    def queued(self) -> int:
+        return sum(len(waiting) for waiting in self.waiting)
+
+
+class HttpScheduler:
+    """
+    Sits in front of the http client every bot shares and decides which request goes next. Requests are let through
+    by priority level, within a level the guilds with waiting requests take turns, so a guild purging a channel only
+    delays its own requests. A guild never has more than per_guild requests in flight, which keeps a guild waiting
+    on an exhausted rate limit bucket from holding every slot. Requests are paced to stay under discord's global rate
+    limit, hitting it would make discord.py stop every request, the quiet guilds' included.
+    """
+
+    def __init__(self, guild_of: Callable[[Route], int], rate: float = 45.0, burst: int = 5, concurrency: int = 16,
+                 per_guild: int = 4, high_water: int = 20, metrics: Optional[Metrics] = None, shards: int = 1):
+        """
+        :param guild_of: the id of the guild a request is made for, 0 if none
+        :param rate: the maximum amount of requests started per second
+        :param burst: how many requests can start at once after a quiet moment
+        :param concurrency: the maximum amount of requests in flight
+        :param per_guild: the maximum amount of requests of one guild in flight
+        :param high_water: the amount of waiting requests above which a guild is congested
+        :param metrics: where the time requests spent waiting is recorded
+        :param shards: the amount of shard processes sending requests with the same token, the global rate limit is
+        per token so rate and burst are split evenly between them
+        """
+        self.guild_of = guild_of
+        self.rate = rate / shards
+        self.burst = max(1, burst // shards)
+        self.concurrency = concurrency
+        self.per_guild = per_guild
+        self.high_water = high_water
+        self.metrics = metrics
+        self.in_flight = 0
+        self.guilds: Dict[int, GuildQueue] = {}
+        # per level, the guilds with waiting requests in the order they get their turn
+        self.__turns: List["OrderedDict[int, None]"] = [OrderedDict() for _ in LEVELS]
+        self.__send: Optional[Callable] = None
+        self.__tokens = float(self.burst)
+        self.__refilled = perf_counter()
+        self.__wakeup: Optional[asyncio.TimerHandle] = None
+
+    def install(self, http) -> None:
+        """
+        Put the scheduler in front of the http client's requests
+        """
+        self.__send = http.request
+        http.request = self.request
+
+    def queued(self, guild_id: int) -> int:
+        guild = self.guilds.get(guild_id)
+        return guild.queued if guild is not None else 0
+
+    def congested(self, guild_id: int) -> bool:
+        """
+        Whether the guild has so many requests waiting that whatever can wait should
+        """
+        return self.queued(guild_id) >= self.high_water
+
+    async def request(self, route: Route, **kwargs):
+        guild_id = self.guild_of(route)
+        guild = self.guilds.get(guild_id)
+        if guild is None:
+            guild = self.guilds[guild_id] = GuildQueue()
+        level = _priority.get()
+        start = perf_counter()
+        if self.__can_start() and guild.in_flight < self.per_guild and not any(self.__turns):
+            self.__acquire(guild)
+        else:
+            future = asyncio.get_event_loop().create_future()
+            guild.waiting[level].append(future)
+            self.__turns[level][guild_id] = None
+            self.__next()
+            try:
+                await future
+            except asyncio.CancelledError:
+                # the turn may have been given just before the cancellation
+                if not future.cancelled():
+                    self.__release(guild)
+                else:
+                    self.__forget(guild_id, guild, level, future)
+                raise
+        waited = perf_counter() - start
+        guild.waited += waited
+        if self.metrics is not None and self.metrics.enabled:
+            self.metrics.observe("http", guild_id, None, LEVEL_NAMES[level], waited)
+        try:
+            return await self.__send(route, **kwargs)
+        finally:
+            self.__release(guild)
+
+    def __forget(self, guild_id: int, guild: GuildQueue, level: int, future: asyncio.Future) -> None:
+        waiting = guild.waiting[level]
+        waiting.remove(future)
+        if not waiting:
+            self.__turns[level].pop(guild_id, None)
+
+    def __can_start(self) -> bool:
+        if self.in_flight >= self.concurrency:
+            return False
+        now = perf_counter()
+        self.__tokens = min(self.burst, self.__tokens + (now - self.__refilled) * self.rate)
+        self.__refilled = now
+        return self.__tokens >= 1
+
+    def __acquire(self, guild: GuildQueue) -> None:
+        self.__tokens -= 1
+        self.in_flight += 1
+        guild.in_flight += 1
+        guild.sent += 1
+
+    def __release(self, guild: GuildQueue) -> None:
+        self.in_flight -= 1
+        guild.in_flight -= 1
+        self.__next()
+
+    def __woken(self) -> None:
+        self.__wakeup = None
+        self.__next()
+
+    def __next(self) -> None:
+        """
+        Let waiting requests through while there are free slots, one per guild and turn
+        """
+        progress = True
+        while progress:
+            progress = False
+            for level, turns in zip(LEVELS, self.__turns):
+                for guild_id in list(turns):
+                    if not self.__can_start():
+                        if self.in_flight < self.concurrency and self.__wakeup is None:
+                            # out of tokens rather than slots, nothing finishing would call this again
+                            self.__wakeup = asyncio.get_event_loop().call_later(
+                                (1 - self.__tokens) / self.rate, self.__woken)
+                        return
+                    guild = self.guilds[guild_id]
+                    if guild.in_flight >= self.per_guild:
+                        continue
+                    waiting = guild.waiting[level]
+                    self.__acquire(guild)
+                    waiting.popleft().set_result(None)
+                    progress = True
+                    # the guild goes to the back of the line, or out of it when it has nothing left at this level
+                    del turns[guild_id]
+                    if waiting:
+                        turns[guild_id] = None
+                if progress:
+                    # a higher level may have become sendable again
+                    break
@@ -0,0 +1,81 @@
+from types import ModuleType
+from typing import Dict, List, Set
+
+from discord.ext import commands
+
+
+class LazyCommand(commands.Command):
+    """
+    Stands in for a command of an extension whose cogs have not been created yet. Invoking it creates them and hands
+    the invocation to the real command, which parses the arguments and runs the checks.
+    A stub holds nothing of a bot, one is shared by every bot the extension is loaded lazily into.
+    """
+
+    def __init__(self, extension: str, command: commands.Command):
+        async def stub(ctx):
+            pass
+
+        super().__init__(stub, name=command.name, aliases=list(command.aliases), help=command.help,
+                         brief=command.brief, usage=command.usage or command.signature, hidden=command.hidden,
+                         description=command.description)
+        self.extension = extension
+        # unloading the extension removes the commands of its module
+        self.module = extension
+
+    async def invoke(self, ctx: commands.Context):
+        ctx.bot.materialize(self.extension)
+        ctx.command = ctx.bot.get_command(self.name)
+        await ctx.command.invoke(ctx)
+
+
+class ExtensionManifest:
+    """
+    What an extension registers on a bot, found by loading it into a scratch bot once
+    """
+
+    def __init__(self, name: str, cogs: List[str], stubs: List[LazyCommand], events: Set[str],
+                 routed: Dict[str, Set[str]], classes: Dict[str, type], eager: bool):
+        """
+        :param cogs: the names of the cogs its setup adds
+        :param stubs: a stand-in for each of its top level commands
+        :param events: the events its cogs listen to without routing
+        :param routed: the events only routed listeners of it listen to, along with the cogs whose listeners those are
+        :param classes: the class of each of its cogs
+        :param eager: whether it has to be loaded right away, because it adds checks or hooks which apply to every
+                      command of the bot
+        """
+        self.name = name
+        self.cogs = cogs
+        self.stubs = stubs
+        self.events = events
+        self.routed = routed
+        self.classes = classes
+        self.eager = eager
+
+    @classmethod
+    def build(cls, name: str, lib: ModuleType) -> "ExtensionManifest":
+        scratch = commands.Bot(command_prefix="", help_command=None)
+        lib.setup(scratch)
+        try:
+            cogs = list(scratch.cogs)
+            stubs = [LazyCommand(name, command) for command in scratch.commands]
+            events = {event for event, listeners in scratch.extra_events.items() if listeners}
+            routed: Dict[str, Set[str]] = {}
+            for cog_name, cog in scratch.cogs.items():
+                for base in type(cog).__mro__:
+                    for member in vars(base).values():
+                        event = getattr(member, "__routed_listener__", None)
+                        if event is not None and event not in events:
+                            routed.setdefault(event, set()).add(cog_name)
+            classes = {cog_name: type(cog) for cog_name, cog in scratch.cogs.items()}
+            eager = bool(scratch._checks or scratch._check_once or scratch._before_invoke or scratch._after_invoke)
+        finally:
+            for cog in list(scratch.cogs):
+                scratch.remove_cog(cog)
+            teardown = getattr(lib, "teardown", None)
+            if teardown is not None:
+                try:
+                    teardown(scratch)
+                except Exception:
+                    pass
+        return cls(name, cogs, stubs, events, routed, classes, eager)
@@ -0,0 +1,127 @@
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Deque, List, Optional
+
+from discord.ext import commands
+
+
+class SlowCallback:
+    """
+    A stretch of time the event loop was blocked and what it was running meanwhile
+    """
+
+    def __init__(self, started: float, cog: Optional[str], function: str, guild_id: Optional[int],
+                 task: Optional[str], stack: List[str]):
+        """
+        :param started: the unix time the loop stopped answering
+        :param cog: the cog whose code was running, None if no cog was on the stack
+        :param function: the innermost cog function on the stack, or the innermost function if there was none
+        :param stack: the innermost frames, formatted
+        """
+        self.started = started
+        self.duration = 0.0
+        self.cog = cog
+        self.function = function
+        self.guild_id = guild_id
+        self.task = task
+        self.stack = stack
+
+    def __str__(self):
+        where = f"{self.cog}.{self.function}" if self.cog else self.function
+        return f"{time.strftime('%H:%M:%S', time.gmtime(self.started))} UTC {where} blocked for " \
+               f"{self.duration * 1000:.0f}ms ({self.task or 'no task'})"
+
+
+class LoopWatchdog:
+    """
+    Watches an event loop from a separate thread. The loop bumps a heartbeat every interval, when the heartbeat is
+    older than threshold the loop is stuck in a callback and the watchdog looks at the loop thread's stack to find the
+    cog, listener or command responsible. The most recent offenders are kept in a ring buffer.
+    """
+
+    def __init__(self, threshold: float = 0.1, interval: float = 0.025, history: int = 100):
+        """
+        :param threshold: seconds the loop can be blocked before it is reported
+        :param interval: seconds between two heartbeats
+        :param history: how many offenders are kept
+        """
+        self.threshold = threshold
+        self.interval = interval
+        self.offenders: Deque[SlowCallback] = deque(maxlen=history)
+        self.max_lag = 0.0
+        self.last_lag = 0.0
+        self.__heartbeat = time.monotonic()
+        self.__loop: Optional[asyncio.AbstractEventLoop] = None
+        self.__loop_thread: Optional[int] = None
+        self.__beating: Optional[asyncio.Task] = None
+        self.__stopped = threading.Event()
+        self.__thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """
+        Start watching the running loop
+        """
+        self.__loop = asyncio.get_event_loop()
+        self.__loop_thread = threading.get_ident()
+        self.__heartbeat = time.monotonic()
+        self.__stopped.clear()
+        self.__beating = asyncio.ensure_future(self.__beat())
+        self.__thread = threading.Thread(target=self.__watch, name="LoopWatchdog", daemon=True)
+        self.__thread.start()
+
+    def stop(self) -> None:
+        self.__stopped.set()
+        if self.__beating is not None:
+            self.__beating.cancel()
+
+    async def __beat(self) -> None:
+        while True:
+            before = time.monotonic()
+            self.__heartbeat = before
+            await asyncio.sleep(self.interval)
+            self.last_lag = max(0.0, time.monotonic() - before - self.interval)
+            self.max_lag = max(self.max_lag, self.last_lag)
+
+    def __watch(self) -> None:
+        stall: Optional[SlowCallback] = None
+        stalled_at = 0.0
+        while not self.__stopped.wait(self.interval / 2):
+            heartbeat = self.__heartbeat
+            blocked = time.monotonic() - heartbeat
+            if blocked > self.interval + self.threshold:
+                if stall is None or stalled_at != heartbeat:
+                    stall = self.__inspect(time.time() - blocked + self.interval)
+                    stalled_at = heartbeat
+                    if stall is not None:
+                        self.offenders.append(stall)
+                if stall is not None:
+                    stall.duration = blocked - self.interval
+
+    def __inspect(self, started: float) -> Optional[SlowCallback]:
+        frame = sys._current_frames().get(self.__loop_thread)
+        if frame is None:
+            return None
+        stack = traceback.format_stack(frame, limit=8)
+        function = frame.f_code.co_name
+        cog: Optional[commands.Cog] = None
+        while frame is not None:
+            owner = frame.f_locals.get("self")
+            if isinstance(owner, commands.Cog):
+                cog = owner
+                function = frame.f_code.co_name
+                break
+            frame = frame.f_back
+        current = asyncio.current_task(self.__loop)
+        guild = getattr(getattr(cog, "bot", None), "guild", None)
+        return SlowCallback(started, cog.qualified_name if cog else None, function,
+                            guild.id if guild is not None else None, current.get_name() if current else None, stack)
+
+    def recent(self, guild_id: Optional[int] = None) -> List[SlowCallback]:
+        """
+        The offenders kept, newest first, only those of one guild if it is given
+        """
+        return [offender for offender in reversed(self.offenders) if guild_id is None or offender.guild_id == guild_id]
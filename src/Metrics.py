@@ -0,0 +1,251 @@
+import asyncio
+import os
+from bisect import bisect_left
+from collections import OrderedDict
+from contextlib import contextmanager
+from time import perf_counter, monotonic
+from typing import Dict, List, Optional, Tuple, Iterator
+
+import discord
+
+# upper bounds in seconds, the last bucket catches everything slower
+BUCKETS: Tuple[float, ...] = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                              2.5, 5.0, 10.0, float("inf"))
+
+# (kind, cog, name) where kind is "command", "check", "listener", "outbox", "http" or "warm_up"
+SeriesKey = Tuple[str, str, str]
+
+
+def guild_id_of(*args) -> int:
+    """
+    The id of the guild an event happened in, read from the first argument which has one
+    """
+    for arg in args:
+        guild = getattr(arg, "guild", None)
+        if guild is not None:
+            return guild.id
+        # raw events only carry the id
+        guild_id = getattr(arg, "guild_id", None)
+        if guild_id is not None:
+            return guild_id
+        # reactions only know their message
+        message = getattr(arg, "message", None)
+        if message is not None and getattr(message, "guild", None) is not None:
+            return message.guild.id
+        if isinstance(arg, discord.Guild):
+            return arg.id
+    return 0
+
+
+class LatencyHistogram:
+    """
+    Counts of observed latencies in fixed buckets, cheap enough to update on every event
+    """
+
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts: List[int] = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float, weight: int = 1) -> None:
+        """
+        :param weight: the amount of observations this one stands for when only some of them are timed
+        """
+        self.counts[bisect_left(BUCKETS, seconds)] += weight
+        self.sum += seconds * weight
+        self.count += weight
+
+    def quantile(self, q: float) -> float:
+        """
+        An estimate of the q-quantile, the upper bound of the bucket it falls in
+        """
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank and count:
+                return bound
+        return 0.0
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+
+class Metrics:
+    """
+    Latency histograms of commands, checks and listeners by cog and name, shared by every bot of the process.
+
+    Everything is added up over all guilds. Only the guilds which are tracked, at most max_guilds of them, get series
+    of their own as well, so the amount of series does not grow with the amount of guilds. A tracked guild nothing was
+    observed for in guild_idle seconds is forgotten.
+
+    Every message runs several listeners, only one run in listener_sample_every is timed and counts for that many.
+    """
+
+    LISTENER_SAMPLE_EVERY = 8
+
+    def __init__(self, enabled: bool = True, max_guilds: int = 50, guild_idle: float = 3600.0,
+                 listener_sample_every: int = LISTENER_SAMPLE_EVERY):
+        """
+        :param max_guilds: the maximum amount of guilds tracked at once, the one tracked first makes room
+        :param guild_idle: seconds after which a tracked guild nothing was observed for is forgotten
+        :param listener_sample_every: time one listener run in this many, 1 to time all of them
+        """
+        self.enabled = enabled
+        self.max_guilds = max_guilds
+        self.guild_idle = guild_idle
+        self.listener_sample_every = listener_sample_every
+        # listener runs since the last one which was timed
+        self.listener_runs = 0
+        self.__series: Dict[SeriesKey, LatencyHistogram] = {}
+        # guild id -> the series of that guild, oldest tracked first
+        self.__guilds: "OrderedDict[int, Dict[SeriesKey, LatencyHistogram]]" = OrderedDict()
+        self.__last_observed: Dict[int, float] = {}
+        self.__gauges: Dict[str, float] = {}
+
+    @property
+    def tracking(self) -> bool:
+        """
+        Whether any guild is tracked, while none is the guild of what is observed does not matter
+        """
+        return bool(self.__guilds)
+
+    def observe(self, kind: str, guild_id: int, cog: Optional[str], name: str, seconds: float,
+                weight: int = 1) -> None:
+        key = (kind, cog or "", name)
+        histogram = self.__series.get(key)
+        if histogram is None:
+            histogram = self.__series[key] = LatencyHistogram()
+        histogram.observe(seconds, weight)
+        if self.__guilds:
+            series = self.__guilds.get(guild_id)
+            if series is not None:
+                self.__last_observed[guild_id] = monotonic()
+                histogram = series.get(key)
+                if histogram is None:
+                    histogram = series[key] = LatencyHistogram()
+                histogram.observe(seconds, weight)
+
+    def track(self, guild_id: int) -> None:
+        """
+        Keep series of the guild's own from now on
+        """
+        if guild_id in self.__guilds:
+            return
+        self.__guilds[guild_id] = {}
+        self.__last_observed[guild_id] = monotonic()
+        while len(self.__guilds) > self.max_guilds:
+            self.untrack(next(iter(self.__guilds)))
+
+    def untrack(self, guild_id: int) -> None:
+        self.__guilds.pop(guild_id, None)
+        self.__last_observed.pop(guild_id, None)
+
+    def tracked(self, guild_id: int) -> bool:
+        return guild_id in self.__guilds
+
+    def evict_idle(self, now: Optional[float] = None) -> None:
+        """
+        Forget the tracked guilds nothing was observed for in guild_idle seconds
+        """
+        now = monotonic() if now is None else now
+        for guild_id, observed in list(self.__last_observed.items()):
+            if now - observed >= self.guild_idle:
+                self.untrack(guild_id)
+
+    @contextmanager
+    def time(self, kind: str, guild_id: int, cog: Optional[str], name: str) -> Iterator[None]:
+        """
+        Observe how long the block takes, awaiting included. For what runs rarely, the hot paths time themselves
+        """
+        if not self.enabled:
+            yield
+            return
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(kind, guild_id, cog, name, perf_counter() - start)
+
+    def gauge(self, name: str, value: float) -> None:
+        """
+        Set a value which is exported as it is, like how many guild bots are warm
+        """
+        self.__gauges[name] = value
+
+    def gauges(self) -> Dict[str, float]:
+        return dict(self.__gauges)
+
+    def series(self, guild_id: Optional[int] = None) -> Dict[SeriesKey, LatencyHistogram]:
+        """
+        The histograms of every guild added up, or those of one tracked guild if it is given
+        """
+        if guild_id is None:
+            return dict(self.__series)
+        return dict(self.__guilds.get(guild_id, {}))
+
+    def clear(self) -> None:
+        self.__series.clear()
+        for series in self.__guilds.values():
+            series.clear()
+        self.__gauges.clear()
+
+    def prometheus(self) -> str:
+        """
+        Every histogram in the Prometheus text exposition format, those of the tracked guilds in a metric of their own
+        so summing the totals never counts them twice
+        """
+        lines = ["# HELP discord_bot_latency_seconds Time taken by commands, checks and listeners",
+                 "# TYPE discord_bot_latency_seconds histogram"]
+        for (kind, cog, name), histogram in sorted(self.__series.items()):
+            self.__histogram(lines, "discord_bot_latency_seconds", f'kind="{kind}",cog="{cog}",name="{name}"',
+                             histogram)
+        if self.__guilds:
+            lines.append("# HELP discord_bot_guild_latency_seconds Time taken by commands, checks and listeners of "
+                         "the tracked guilds")
+            lines.append("# TYPE discord_bot_guild_latency_seconds histogram")
+        for guild_id, series in sorted(self.__guilds.items()):
+            for (kind, cog, name), histogram in sorted(series.items()):
+                self.__histogram(lines, "discord_bot_guild_latency_seconds",
+                                 f'kind="{kind}",guild="{guild_id}",cog="{cog}",name="{name}"', histogram)
+        for name, value in sorted(self.__gauges.items()):
+            lines.append(f"# TYPE discord_bot_{name} gauge")
+            lines.append(f"discord_bot_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def __histogram(lines: List[str], metric: str, labels: str, histogram: LatencyHistogram) -> None:
+        cumulative = 0
+        for bound, count in zip(BUCKETS, histogram.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f'{metric}_bucket{{{labels},le="{le}"}} {cumulative}')
+        lines.append(f"{metric}_sum{{{labels}}} {histogram.sum}")
+        lines.append(f"{metric}_count{{{labels}}} {histogram.count}")
+
+    def write_prometheus(self, filename: str) -> None:
+        """
+        Write the histograms for a textfile collector, replacing the file at once so it is never read half written
+        """
+        self.__write(filename, self.prometheus())
+
+    async def export(self, filename: str, interval: float = 15.0) -> None:
+        """
+        Write the histograms to a file every interval seconds until cancelled
+        """
+        loop = asyncio.get_event_loop()
+        while True:
+            await asyncio.sleep(interval)
+            self.evict_idle()
+            text = self.prometheus()
+            await loop.run_in_executor(None, self.__write, filename, text)
+
+    @staticmethod
+    def __write(filename: str, text: str) -> None:
+        temporary = filename + ".tmp"
+        with open(temporary, "w") as f:
+            f.write(text)
+        os.replace(temporary, filename)
@@ -1,29 +1,95 @@
-from discord.ext.commands import Command, Cog
+import asyncio
+import itertools
+from typing import Dict, Any, Optional, Callable, List, Set, Tuple
+
+from discord.ext.commands import Command, Cog, GroupMixin
+
+from GuildStore import StoreNamespace
+
+
+def share_command(command: Command) -> Command:
+    """
+    A copy of a command for one cog instance which shares the callback and parsed signature with the original. Only
+    what a bot may change per instance is copied: its name and aliases when it is renamed, its checks, cooldowns and
+    concurrency limits, and the subcommands of a group, which are added back by the caller.
+    """
+    copy = object.__new__(type(command))
+    copy.__dict__.update(command.__dict__)
+    copy.aliases = list(command.aliases)
+    copy.checks = list(command.checks)
+    copy._buckets = command._buckets.copy()
+    if command._max_concurrency is not None:
+        copy._max_concurrency = command._max_concurrency.copy()
+    if isinstance(command, GroupMixin):
+        copy.all_commands = type(command.all_commands)()
+    return copy
+
+
+class HandOver:
+    """
+    What an instance of a cog passes on to the next one when its extension is reloaded
+    """
+
+    def __init__(self, cog: "NoConflictCog"):
+        self.state = cog.export_state()
+        self.handed = cog.hand_over()
+        stored = getattr(cog, "_stored_state", None)
+        # once the stored state has been read the new instance does not have to read it again
+        self.stored = stored is not None and stored.done() and not stored.cancelled()
+
+    def apply(self, cog: "NoConflictCog") -> None:
+        try:
+            cog.take_over(self.handed)
+        except Exception as e:
+            print(f"{cog.qualified_name} could not take over from its previous instance, importing its state: {e}")
+            cog.import_state(self.state)
+        loading = getattr(cog, "_stored_state", None)
+        if self.stored and loading is not None:
+            # reading the store again would only replace the handed over objects with rebuilt ones
+            loading.cancel()
+            cog._stored_state = loaded = asyncio.get_event_loop().create_future()
+            loaded.set_result(None)
 
 
 class NoConflictCog(Cog):
 
+    def __new__(cls, *args, **kwargs):
+        if cls.__cog_settings__:
+            # the command attributes of the cog have to be applied by constructing the commands anew
+            return super().__new__(cls, *args, **kwargs)
+        self = object.__new__(cls)
+        self.__cog_commands__ = tuple(share_command(command) for command in cls.__cog_commands__)
+        lookup = {command.qualified_name: command for command in self.__cog_commands__}
+        for command in self.__cog_commands__:
+            setattr(self, command.callback.__name__, command)
+            if command.parent is not None:
+                # the copy still points at the class's group, move it under this instance's copy of the group
+                lookup[command.parent.qualified_name].add_command(command)
+        return self
+
     def _inject(self, bot):
         cls = self.__class__
 
-        # realistically, the only thing that can cause loading errors
-        # is essentially just the command loading, which raises if there are
-        # duplicates. When this condition is met, we want to undo all what
-        # we've added so far for some form of atomic loading.
-        index: int
+        # every name is checked against the bot's commands before anything is added, the names which are taken are
+        # replaced by free ones. Should adding fail anyway, what was added is undone for some form of atomic loading.
+        renames = self.__free_names(bot)
+        originals = {command: (command.name, command.aliases) for command in renames}
+        for command, (name, aliases) in renames.items():
+            command.name, command.aliases = name, aliases
+        added: List[Command] = []
         command: Command
-        for index, command in enumerate(self.__cog_commands__):
-            command.cog = self
-            if command.parent is None:
-                try:
+        try:
+            for command in self.__cog_commands__:
+                command.cog = self
+                if command.parent is None:
                     bot.add_command(command)
-                except Exception as e:
-                    # undo our additions
-                    for to_undo in self.__cog_commands__[:index]:
-                        bot.remove_command(to_undo)
-                    # rename commands to prevent conflict
-                    self.__attempt_rename()
-                    self._inject(bot)
+                    added.append(command)
+        except Exception:
+            for command in added:
+                bot.remove_command(command.name)
+            for command, (name, aliases) in originals.items():
+                command.name, command.aliases = name, aliases
+            raise
 
         # check if we're overriding the default
         if cls.bot_check is not Cog.bot_check:
@@ -39,9 +105,160 @@ class NoConflictCog(Cog):
         for name, method_name in self.__cog_listeners__:
             bot.add_listener(getattr(self, method_name), name)
 
+        # start reading the persisted state right away so it is there before the first event
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        else:
+            self._stored_state = asyncio.ensure_future(self.__load_stored_state())
+
         return self
 
-    def __attempt_rename(self) -> None:
-        command: Command
+    def _eject(self, bot):
+        try:
+            super()._eject(bot)
+        finally:
+            router = getattr(bot, "router", None)
+            if router is not None:
+                router.forget_owner(self)
+
+    def route(self, listener: Callable, **interest: int) -> None:
+        """
+        Call a routed listener of this cog for the events involving the given snowflakes
+        :param listener: a method decorated with EventRouter.routed
+        :param interest: snowflakes by kind, e.g. channel=..., user=...
+        """
+        router = getattr(self.bot, "router", None)
+        if router is None:
+            return
+        for kind, snowflake in interest.items():
+            router.subscribe(listener.__routed_listener__, listener, kind, snowflake)
+
+    def unroute(self, listener: Callable, **interest: int) -> None:
+        """
+        Stop calling a routed listener for the given snowflakes, or for any event when none are given
+        """
+        router = getattr(self.bot, "router", None)
+        if router is None:
+            return
+        if not interest:
+            router.forget(listener)
+        for kind, snowflake in interest.items():
+            router.unsubscribe(listener.__routed_listener__, listener, kind, snowflake)
+
+    @classmethod
+    def routes(cls, state: Dict[str, Any]) -> Optional[List[Tuple[str, str, int]]]:
+        """
+        What an instance importing the state would route its listeners to, worked out without creating one. A bot
+        which has not created the cog yet only creates it for the events routed there.
+        :param state: what export_state returned, or the part of it which was persisted
+        :return: (event, kind, snowflake) for each route, None if the cog cannot tell without being created
+        """
+        return None
+
+    def export_state(self) -> Dict[str, Any]:
+        """
+        Export the state of the cog which should outlive this instance, for example when the guild's bot is
+        hibernated. The returned value must be picklable.
+        """
+        return {}
+
+    def import_state(self, state: Dict[str, Any]) -> None:
+        """
+        Restore the state previously returned by export_state into a freshly loaded instance
+        :param state: the exported state
+        """
+        pass
+
+    def hand_over(self) -> Dict[str, Any]:
+        """
+        Export what the next instance needs to carry on where this one stops, when the extension is reloaded within the
+        process. Unlike export_state it is never pickled, so compiled and cached objects can be handed over as they
+        are instead of being built again. By default it is the exported state.
+        """
+        return self.export_state()
+
+    def take_over(self, handed: Dict[str, Any]) -> None:
+        """
+        Import what the previous instance handed over. It may come from an older version of the cog, if this raises
+        the state it exported is imported instead.
+        :param handed: what hand_over of the previous instance returned
+        """
+        self.import_state(handed)
+
+    @property
+    def store(self) -> Optional[StoreNamespace]:
+        """
+        This cog's part of the guild's store, None when the cog is not loaded into a guild's bot
+        """
+        store = getattr(self.bot, "store", None)
+        guild = getattr(self.bot, "guild", None)
+        if store is None or guild is None:
+            return None
+        return store.namespace(guild.id, self.qualified_name)
+
+    async def __load_stored_state(self) -> None:
+        store = self.store
+        if store is None:
+            return
+        stored = await store.items()
+        if stored:
+            state = self.export_state()
+            state.update(stored)
+            self.import_state(state)
+
+    async def load_stored_state(self) -> None:
+        """
+        Wait until the state persisted with persist has been imported, reading it if that has not started yet
+        """
+        if getattr(self, "_stored_state", None) is None:
+            self._stored_state = asyncio.ensure_future(self.__load_stored_state())
+        await self._stored_state
+
+    async def warm_up(self) -> None:
+        """
+        Get ready for the first event of the guild before it comes in, called when the bot is built ahead of time.
+        Reads the persisted state, cogs which load more on first use should load it here as well.
+        """
+        await self.load_stored_state()
+
+    def persist(self, *keys: str) -> None:
+        """
+        Write the given keys of export_state to the guild's store
+        """
+        store = self.store
+        if store is None:
+            return
+        state = self.export_state()
+        for key in keys:
+            store.set(key, state[key])
+
+    def __free_names(self, bot) -> Dict[Command, Tuple[str, List[str]]]:
+        """
+        The name and aliases each top level command has to be added under so that none of them is taken, in one pass
+        over the bot's command index. A taken name is prefixed with the name of the cog, and numbered if that is taken
+        as well, e.g. add_pattern becomes TimeExtension.add_pattern or TimeExtension.add_pattern.2
+        :return: the new name and aliases of the commands which have to be renamed
+        """
+        fold: Callable[[str], str] = str.lower if bot.case_insensitive else str
+        # the names given to this cog's commands so far, they are not in the index until they are added
+        claimed: Set[str] = set()
+
+        def free(name: str) -> str:
+            prefixed = f"{self.qualified_name}.{name}"
+            candidates = itertools.chain((name, prefixed), (f"{prefixed}.{n}" for n in itertools.count(2)))
+            for candidate in candidates:
+                if candidate not in bot.all_commands and fold(candidate) not in claimed:
+                    claimed.add(fold(candidate))
+                    return candidate
+
+        renames: Dict[Command, Tuple[str, List[str]]] = {}
         for command in self.__cog_commands__:
-            command.name = self.qualified_name + "." + command.name
+            if command.parent is not None:
+                continue
+            name = free(command.name)
+            aliases = [free(alias) for alias in command.aliases]
+            if name != command.name or aliases != command.aliases:
+                renames[command] = (name, aliases)
+        return renames
@@ -0,0 +1,203 @@
+import asyncio
+from collections import OrderedDict
+from copy import deepcopy
+from time import perf_counter
+from typing import Dict, List, Optional, Any, Tuple
+
+import discord
+
+from HttpScheduler import HttpScheduler
+from Metrics import Metrics
+
+# discord refuses embeds with more fields than this
+MAX_FIELDS = 25
+
+
+def merge_embeds(embeds: List[discord.Embed]) -> List[discord.Embed]:
+    """
+    Merge embeds into as few as possible, the first keeps its title and link and every other one is introduced by a
+    field holding its title and link
+    """
+    return place_embeds(embeds)[0]
+
+
+def place_embeds(embeds: List[discord.Embed]) -> Tuple[List[discord.Embed], List[int]]:
+    """
+    Merge embeds like merge_embeds
+    :return: the merged embeds and, for every embed, the index of the merged embed it ended up in
+    """
+    merged: List[discord.Embed] = []
+    placed: List[int] = []
+    current: Optional[discord.Embed] = None
+    for embed in embeds:
+        header = []
+        if current is not None and (embed.title or embed.url):
+            header = [(str(embed.title or "Link"), f"[{embed.url}]({embed.url})" if embed.url else "​")]
+        fields = header + [(field.name, field.value) for field in embed.fields]
+        if current is None or len(current.fields) + len(fields) > MAX_FIELDS:
+            # Embed.copy shares the list of fields, adding to it would change the embed of whoever queued it
+            current = discord.Embed.from_dict(deepcopy(embed.to_dict()))
+            merged.append(current)
+        else:
+            for name, value in fields:
+                current.add_field(name=name, value=value)
+        placed.append(len(merged) - 1)
+    return merged, placed
+
+
+class ChannelFlushes:
+    """
+    What the outbox did for one channel
+    """
+
+    def __init__(self):
+        self.flushes = 0
+        self.queued = 0
+        self.sent = 0
+        self.edits_queued = 0
+        self.edits_sent = 0
+
+    @property
+    def requests_saved(self) -> int:
+        return self.queued - self.sent + self.edits_queued - self.edits_sent
+
+
+class Outbox:
+    """
+    Holds outgoing messages for window seconds so a burst of them costs discord as few requests as possible. Embeds
+    sent to the same channel are merged into one message and of several edits to the same message only the latest is
+    made. While the guild's requests are congested in the scheduler messages are held for up to MAX_HOLD windows
+    more, so they keep merging instead of adding to the queue.
+
+    What was done is counted for the max_channels channels which used the outbox last.
+    """
+
+    MAX_HOLD = 10
+
+    def __init__(self, window: float = 0.5, metrics: Optional[Metrics] = None,
+                 scheduler: Optional[HttpScheduler] = None, max_channels: int = 1000):
+        """
+        :param window: seconds messages are held before they are sent
+        :param metrics: where the time from the first queued message to the flush is recorded
+        :param scheduler: the scheduler whose congestion makes messages wait longer
+        :param max_channels: the maximum amount of channels counted at once, the one used least recently makes room
+        """
+        self.window = window
+        self.metrics = metrics
+        self.scheduler = scheduler
+        self.max_channels = max_channels
+        # channel id -> the channel, its queued embeds and the futures of whoever queued them
+        self.__sends: Dict[int, Tuple[discord.abc.Messageable, List[discord.Embed], List[asyncio.Future], float]] = {}
+        # message id -> the message, the latest edit and the futures of whoever asked for an edit
+        self.__edits: Dict[int, Tuple[discord.Message, Dict[str, Any], List[asyncio.Future], float]] = {}
+        # channel id -> what was done for the channel, least recently used first
+        self.channels: "OrderedDict[int, ChannelFlushes]" = OrderedDict()
+
+    def __stats(self, channel_id: int) -> ChannelFlushes:
+        stats = self.channels.get(channel_id)
+        if stats is None:
+            stats = self.channels[channel_id] = ChannelFlushes()
+            while len(self.channels) > self.max_channels:
+                self.channels.popitem(last=False)
+        else:
+            self.channels.move_to_end(channel_id)
+        return stats
+
+    def __observe(self, channel: discord.abc.Messageable, started: float) -> None:
+        if self.metrics is not None and self.metrics.enabled:
+            guild = getattr(channel, "guild", None)
+            self.metrics.observe("outbox", guild.id if guild is not None else 0, None, "flush",
+                                 perf_counter() - started)
+
+    async def __hold(self, channel: discord.abc.Messageable) -> None:
+        await asyncio.sleep(self.window)
+        guild = getattr(channel, "guild", None)
+        if self.scheduler is None or guild is None:
+            return
+        for _ in range(self.MAX_HOLD):
+            if not self.scheduler.congested(guild.id):
+                return
+            await asyncio.sleep(self.window)
+
+    def send(self, channel: discord.abc.Messageable, embed: discord.Embed) -> asyncio.Future:
+        """
+        Queue an embed for the channel
+        :return: a future of the message the embed ended up in, or of why that message could not be sent
+        """
+        future = asyncio.get_event_loop().create_future()
+        pending = self.__sends.get(channel.id)
+        if pending is None:
+            pending = self.__sends[channel.id] = (channel, [], [], perf_counter())
+            asyncio.ensure_future(self.__flush_sends(channel.id))
+        pending[1].append(embed)
+        pending[2].append(future)
+        self.__stats(channel.id).queued += 1
+        return future
+
+    def edit(self, message: discord.Message, **fields) -> asyncio.Future:
+        """
+        Queue an edit of the message, replacing any edit of it which is still queued
+        :return: a future which is done once the message has been edited
+        """
+        future = asyncio.get_event_loop().create_future()
+        pending = self.__edits.get(message.id)
+        if pending is None:
+            pending = self.__edits[message.id] = (message, fields, [], perf_counter())
+            asyncio.ensure_future(self.__flush_edits(message.id))
+        else:
+            pending[1].clear()
+            pending[1].update(fields)
+        pending[2].append(future)
+        self.__stats(message.channel.id).edits_queued += 1
+        return future
+
+    def pending_edit(self, message: discord.Message) -> Dict[str, Any]:
+        """
+        The edit of the message which is still queued, so the next edit can build on it rather than on the message
+        """
+        pending = self.__edits.get(message.id)
+        return dict(pending[1]) if pending is not None else {}
+
+    async def __flush_sends(self, channel_id: int) -> None:
+        await self.__hold(self.__sends[channel_id][0])
+        channel, embeds, futures, started = self.__sends.pop(channel_id)
+        stats = self.__stats(channel_id)
+        stats.flushes += 1
+        merged, placed = place_embeds(embeds)
+        messages = []
+        error: Optional[Exception] = None
+        try:
+            for embed in merged:
+                messages.append(await channel.send(embed=embed))
+                stats.sent += 1
+        except Exception as e:
+            error = e
+        finally:
+            self.__observe(channel, started)
+        # the embeds in messages which were sent before one failed did make it
+        for future, index in zip(futures, placed):
+            if future.done():
+                continue
+            if index < len(messages):
+                future.set_result(messages[index])
+            else:
+                future.set_exception(error)
+
+    async def __flush_edits(self, message_id: int) -> None:
+        await self.__hold(self.__edits[message_id][0].channel)
+        message, fields, futures, started = self.__edits.pop(message_id)
+        stats = self.__stats(message.channel.id)
+        stats.flushes += 1
+        try:
+            await message.edit(**fields)
+            stats.edits_sent += 1
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self.__observe(message.channel, started)
+        for future in futures:
+            if not future.done():
+                future.set_result(message)
@@ -0,0 +1,291 @@
+import asyncio
+import multiprocessing
+import queue
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple, Any, FrozenSet
+
+from TimeScanner import sre_parse, required_characters
+
+# (pattern, flags) as sent to a worker
+PatternSource = Tuple[str, int]
+# (index of the pattern, start, end, named groups) as sent back by a worker
+FoundMatch = Tuple[int, int, int, Dict[str, Any]]
+
+# strings which make badly written patterns backtrack for a very long time
+STRESS_CORPUS = [
+    "1" * 64,
+    "1" * 64 + "x",
+    ":" * 64,
+    "1:" * 32 + "x",
+    "11:11 " * 16 + "!",
+    " " * 64 + "x",
+    "a" * 64 + "!",
+    "/" * 64,
+    "aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa1:00 UTC 12/24" * 2,
+]
+
+
+def nested_quantifier(pattern: re.Pattern) -> Optional[str]:
+    """
+    Look for a repetition of something which can itself repeat, like (a+)+ or (\\d*:?)*, which lets the regex engine
+    try exponentially many ways to split a string that does not match
+    :return: a description of the problem, None if the pattern looks safe
+    """
+    def repeats(parsed) -> bool:
+        for op, av in parsed:
+            if op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT) and av[1] > 1:
+                return True
+            if op is sre_parse.SUBPATTERN and repeats(av[-1]):
+                return True
+            if op is sre_parse.BRANCH and any(repeats(branch) for branch in av[1]):
+                return True
+        return False
+
+    def walk(parsed) -> Optional[str]:
+        for op, av in parsed:
+            if op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+                if av[1] > 1 and repeats(av[2]):
+                    return "a repeated group contains another repetition"
+                found = walk(av[2])
+            elif op is sre_parse.SUBPATTERN:
+                found = walk(av[-1])
+            elif op is sre_parse.BRANCH:
+                found = next(filter(None, (walk(branch) for branch in av[1])), None)
+            else:
+                found = None
+            if found:
+                return found
+        return None
+
+    try:
+        return walk(sre_parse.parse(pattern.pattern, pattern.flags))
+    except Exception as e:
+        return str(e)
+
+
+def _serve(connection, running) -> None:
+    """
+    The loop of a worker process, searches a string with every pattern it is sent
+    :param running: set to the index of the pattern being searched with, so a timeout can be blamed on it
+    """
+    # starting up must not count against the time of the first search
+    connection.send(None)
+    while True:
+        try:
+            patterns, content = connection.recv()
+        except EOFError:
+            return
+        found: List[FoundMatch] = []
+        for index, (source, flags) in enumerate(patterns):
+            running.value = index
+            for match in re.compile(source, flags).finditer(content):
+                found.append((index, match.start(), match.end(), match.groupdict()))
+        running.value = -1
+        connection.send(found)
+
+
+class PatternTimeout(Exception):
+    def __init__(self, index: int):
+        """
+        :param index: the index of the pattern which was running when the time ran out
+        """
+        super().__init__(f"Pattern {index} timed out")
+        self.index = index
+
+
+class WorkerDied(Exception):
+    def __init__(self, index: int):
+        """
+        :param index: the index of the pattern which was running when the worker died, -1 if none was
+        """
+        super().__init__(f"The sandbox worker died while pattern {index} was running")
+        self.index = index
+
+
+class _Worker:
+    """
+    A process searching strings with untrusted patterns, killed and replaced when a search takes too long
+    """
+
+    def __init__(self, context):
+        self.__context = context
+        self.__start()
+
+    def __start(self) -> None:
+        self.connection, child = self.__context.Pipe()
+        self.running = self.__context.Value("i", -1, lock=False)
+        self.process = self.__context.Process(target=_serve, args=(child, self.running), name="PatternSandbox",
+                                              daemon=True)
+        self.process.start()
+        self.connection.recv()
+
+    @property
+    def alive(self) -> bool:
+        return self.process.is_alive()
+
+    def scan(self, patterns: List[PatternSource], content: str, timeout: float) -> List[FoundMatch]:
+        """
+        :raises PatternTimeout: the worker was replaced by a fresh one
+        :raises WorkerDied: the worker is gone, it cannot be used again
+        """
+        try:
+            self.connection.send((patterns, content))
+            if self.connection.poll(timeout):
+                return self.connection.recv()
+        except (EOFError, OSError) as e:
+            self.close()
+            raise WorkerDied(self.running.value) from e
+        culprit = self.running.value
+        self.close()
+        self.__start()
+        raise PatternTimeout(culprit)
+
+    def close(self) -> None:
+        self.process.kill()
+        self.process.join()
+        self.connection.close()
+
+
+class WorkerPool:
+    """
+    A few worker processes shared by every guild, searches run on threads which block on the workers' pipes
+    """
+
+    def __init__(self, size: int = 2):
+        self.size = size
+        self.__idle: "queue.Queue[_Worker]" = queue.Queue()
+        self.__executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix="PatternSandbox")
+        # a fresh interpreter rather than a fork of the bot with its threads and sockets
+        self.__context = multiprocessing.get_context("spawn")
+
+    def __scan(self, patterns: List[PatternSource], content: str, timeout: float) -> List[FoundMatch]:
+        try:
+            worker = self.__idle.get_nowait()
+        except queue.Empty:
+            # there is one thread per worker so a new one is only made while fewer than size exist
+            worker = _Worker(self.__context)
+        try:
+            return worker.scan(patterns, content, timeout)
+        finally:
+            # a worker which died, or could not be restarted after a timeout, is dropped and the next search starts
+            # a new one in its place
+            if worker.alive:
+                self.__idle.put(worker)
+
+    async def scan(self, patterns: List[PatternSource], content: str, timeout: float) -> List[FoundMatch]:
+        """
+        Every match of the patterns in the content
+        :raises PatternTimeout: if the patterns took longer than timeout seconds
+        :raises WorkerDied: if the worker searching the content died
+        """
+        return await asyncio.get_event_loop().run_in_executor(self.__executor, self.__scan, patterns, content,
+                                                              timeout)
+
+
+_pool: Optional[WorkerPool] = None
+
+
+def pool() -> WorkerPool:
+    global _pool
+    if _pool is None:
+        _pool = WorkerPool()
+    return _pool
+
+
+class SandboxMatch:
+    """
+    What a worker found, answers the parts of re.Match the time conversion uses
+    """
+
+    def __init__(self, pattern: re.Pattern, string: str, start: int, end: int, groups: Dict[str, Any]):
+        self.re = pattern
+        self.string = string
+        self.__start = start
+        self.__end = end
+        self.__groups = groups
+
+    def start(self) -> int:
+        return self.__start
+
+    def end(self) -> int:
+        return self.__end
+
+    def span(self) -> Tuple[int, int]:
+        return self.__start, self.__end
+
+    def group(self, group: int = 0) -> str:
+        if group != 0:
+            raise IndexError("Only the whole match is kept")
+        return self.string[self.__start:self.__end]
+
+    def groupdict(self) -> Dict[str, Any]:
+        return dict(self.__groups)
+
+
+class PatternSandbox:
+    """
+    Patterns added by users, which never run on the event loop. They are checked for nested quantifiers and tried
+    against a stress corpus when added, afterwards they search messages in a worker process which is killed when it
+    takes longer than TIMEOUT. A pattern which times out STRIKES times in a row is disabled.
+    """
+
+    TIMEOUT = 0.05
+    TRIAL_TIMEOUT = 0.5
+    STRIKES = 3
+
+    def __init__(self, patterns: List[re.Pattern] = (), disabled: Dict[str, str] = None):
+        """
+        :param disabled: the patterns which were disabled along with why
+        """
+        self.patterns: List[re.Pattern] = list(patterns)
+        self.disabled: Dict[str, str] = dict(disabled or {})
+        self.__strikes: Dict[str, int] = {}
+        self.__required: Dict[str, FrozenSet[str]] = {}
+
+    def __required_characters(self, pattern: re.Pattern) -> FrozenSet[str]:
+        required = self.__required.get(pattern.pattern)
+        if required is None:
+            required = self.__required[pattern.pattern] = required_characters(pattern)
+        return required
+
+    async def validate(self, pattern: re.Pattern) -> Optional[str]:
+        """
+        Check a pattern before it is added
+        :return: why the pattern is refused, None if it can be used
+        """
+        problem = nested_quantifier(pattern)
+        if problem:
+            return problem
+        for line in STRESS_CORPUS:
+            try:
+                await pool().scan([(pattern.pattern, pattern.flags)], line, self.TRIAL_TIMEOUT)
+            except PatternTimeout:
+                return f"it took more than {self.TRIAL_TIMEOUT}s to search {line[:20]!r}..."
+        return None
+
+    async def scan(self, content: str) -> Tuple[List[SandboxMatch], List[re.Pattern]]:
+        """
+        Search the content with every enabled pattern
+        :return: the matches and the patterns which were disabled by this search
+        """
+        candidates = [pattern for pattern in self.patterns if pattern.pattern not in self.disabled and
+                      all(character in content for character in self.__required_characters(pattern))]
+        if not candidates:
+            return [], []
+        try:
+            found = await pool().scan([(pattern.pattern, pattern.flags) for pattern in candidates], content,
+                                      self.TIMEOUT)
+        except PatternTimeout as e:
+            if not 0 <= e.index < len(candidates):
+                return [], []
+            culprit = candidates[e.index]
+            strikes = self.__strikes[culprit.pattern] = self.__strikes.get(culprit.pattern, 0) + 1
+            if strikes < self.STRIKES:
+                return [], []
+            self.disabled[culprit.pattern] = f"timed out {strikes} times in a row"
+            return [], [culprit]
+        for pattern in candidates:
+            self.__strikes.pop(pattern.pattern, None)
+        return [SandboxMatch(candidates[index], content, start, end, groups)
+                for index, start, end, groups in found], []
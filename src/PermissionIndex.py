@@ -0,0 +1,94 @@
+from typing import Callable, Dict, FrozenSet, Iterable, Tuple, Union, Optional, Set
+
+import discord
+
+Accessor = Union[discord.Role, discord.abc.User, discord.abc.GuildChannel]
+# role ids, user ids, channel ids
+CompiledProtection = Tuple[FrozenSet[int], FrozenSet[int], FrozenSet[int]]
+
+
+def accessor_kind(accessor: Accessor) -> str:
+    """
+    What kind of snowflake an accessor of a protection is: a role, a channel or a user
+    """
+    if isinstance(accessor, discord.Role):
+        return "role"
+    if isinstance(accessor, discord.abc.GuildChannel):
+        return "channel"
+    return "user"
+
+
+class PermissionIndex:
+    """
+    A compiled view of the protections of a guild. Every protection (keyed by cog or cog__command) is flattened to
+    sets of role, user and channel snowflakes, so checking it is a few integer set lookups.
+
+    Protections are compiled lazily from their source and recompiled only after they are invalidated. The role ids
+    of members are cached as well and invalidated when the member is updated.
+    """
+
+    def __init__(self, source: Callable[[str], Optional[Iterable[Accessor]]]):
+        """
+        :param source: gets the accessors of a protection by name, or None if the name is not protected
+        """
+        self.__source = source
+        self.__compiled: Dict[str, Optional[CompiledProtection]] = {}
+        self.__member_roles: Dict[int, FrozenSet[int]] = {}
+
+    @staticmethod
+    def compile(accessors: Iterable[Accessor]) -> CompiledProtection:
+        snowflakes: Dict[str, Set[int]] = {"role": set(), "user": set(), "channel": set()}
+        for accessor in accessors:
+            snowflakes[accessor_kind(accessor)].add(accessor.id)
+        return frozenset(snowflakes["role"]), frozenset(snowflakes["user"]), frozenset(snowflakes["channel"])
+
+    def get(self, name: str) -> Optional[CompiledProtection]:
+        try:
+            return self.__compiled[name]
+        except KeyError:
+            accessors = self.__source(name)
+            compiled = None if accessors is None else self.compile(accessors)
+            self.__compiled[name] = compiled
+            return compiled
+
+    def member_roles(self, member: discord.abc.User) -> FrozenSet[int]:
+        try:
+            return self.__member_roles[member.id]
+        except KeyError:
+            roles = frozenset(role.id for role in getattr(member, "roles", ()))
+            self.__member_roles[member.id] = roles
+            return roles
+
+    def is_protected(self, name: str) -> bool:
+        return self.get(name) is not None
+
+    def allows(self, name: str, author: discord.abc.User, channel: discord.abc.Snowflake) -> bool:
+        """
+        Whether the author may use what is protected under the name from the given channel
+        """
+        compiled = self.get(name)
+        if compiled is None:
+            return True
+        roles, users, channels = compiled
+        return author.id in users or channel.id in channels or not roles.isdisjoint(self.member_roles(author))
+
+    def invalidate(self, name: str) -> None:
+        self.__compiled.pop(name, None)
+
+    def invalidate_member(self, member_id: int) -> None:
+        self.__member_roles.pop(member_id, None)
+
+    def invalidate_role(self, role_id: int) -> None:
+        """
+        Drop every compiled entry which references the role, as well as any cached member which has it
+        """
+        for name, compiled in list(self.__compiled.items()):
+            if compiled is not None and role_id in compiled[0]:
+                del self.__compiled[name]
+        for member_id, roles in list(self.__member_roles.items()):
+            if role_id in roles:
+                del self.__member_roles[member_id]
+
+    def clear(self) -> None:
+        self.__compiled.clear()
+        self.__member_roles.clear()
@@ -0,0 +1,202 @@
+import asyncio
+import os
+import pickle
+import struct
+import time
+import zlib
+from os import path, makedirs
+from typing import Dict, Set, Tuple, List, Optional, Callable
+
+# (kind, snowflake) as described in PermissionIndex.accessor_kind
+Entry = Tuple[str, int]
+Protections = Dict[str, Set[Entry]]
+# (timestamp, "add" or "remove", protection name, entry)
+Record = Tuple[float, str, str, Entry]
+
+# every record is framed by its length and crc32 so a torn write can be told apart from a complete one
+FRAME = struct.Struct(">II")
+
+
+class ProtectionJournal:
+    """
+    An append-only log of changes to the protections of a guild.
+
+    The journal is split into generations, each one a snapshot of the protections when it was started and the log of
+    every change made afterwards. Records are written off the event loop, everything recorded while a write is in
+    progress is committed together by the next one. Every COMPACT_EVERY records a new generation is started, only the
+    last HISTORY generations are kept and those bound how far back a rollback can go.
+    """
+
+    COMPACT_EVERY = 500
+    HISTORY = 10
+
+    def __init__(self, directory: str, state: Callable[[], Protections]):
+        """
+        :param directory: the folder the generations are kept in
+        :param state: returns the current protections, used for the snapshot when compacting
+        """
+        self.directory = directory
+        self.__state = state
+        self.__generation: Optional[int] = None
+        self.__records = 0
+        self.__pending: List[bytes] = []
+        self.__flushing: Optional[asyncio.Task] = None
+        self.__compacting: Optional[asyncio.Task] = None
+        # set while a snapshot is written, records made meanwhile belong to the next generation
+        self.__snapshotting: Optional[asyncio.Future] = None
+
+    def __generations(self) -> List[int]:
+        try:
+            return sorted(int(name[:-len(".snapshot")]) for name in os.listdir(self.directory)
+                          if name.endswith(".snapshot"))
+        except FileNotFoundError:
+            return []
+
+    def __file(self, generation: int, extension: str) -> str:
+        return path.join(self.directory, f"{generation}.{extension}")
+
+    @staticmethod
+    def apply(protections: Protections, record: Record) -> None:
+        _, operation, name, entry = record
+        if operation == "add":
+            protections.setdefault(name, set()).add(entry)
+        else:
+            entries = protections.get(name)
+            if entries is not None:
+                entries.discard(entry)
+                # a protection is dropped with its last entry, the cog is unprotected
+                if not entries:
+                    del protections[name]
+
+    def __read_log(self, generation: int) -> Tuple[List[Record], int]:
+        """
+        Read every complete record of a generation's log
+        :return: the records and the offset the last complete record ends at
+        """
+        records: List[Record] = []
+        offset = 0
+        try:
+            with open(self.__file(generation, "log"), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return records, offset
+        while offset + FRAME.size <= len(data):
+            length, checksum = FRAME.unpack_from(data, offset)
+            body = data[offset + FRAME.size:offset + FRAME.size + length]
+            if len(body) < length or zlib.crc32(body) != checksum:
+                # a torn write, everything before it is intact
+                break
+            records.append(pickle.loads(body))
+            offset += FRAME.size + length
+        return records, offset
+
+    def __read_generation(self, generation: int, until: float = float("inf")) -> Protections:
+        with open(self.__file(generation, "snapshot"), 'rb') as f:
+            protections: Protections = pickle.load(f)
+        for record in self.__read_log(generation)[0]:
+            if record[0] > until:
+                break
+            self.apply(protections, record)
+        return protections
+
+    def __write_snapshot(self, generation: int, protections: Protections) -> None:
+        makedirs(self.directory, exist_ok=True)
+        temporary = self.__file(generation, "snapshot.tmp")
+        with open(temporary, 'wb') as f:
+            pickle.dump(protections, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.__file(generation, "snapshot"))
+        for old in self.__generations()[:-self.HISTORY]:
+            for extension in ("snapshot", "log"):
+                try:
+                    os.remove(self.__file(old, extension))
+                except FileNotFoundError:
+                    pass
+
+    def __open(self, initial: Optional[Protections]) -> Protections:
+        generations = self.__generations()
+        if not generations:
+            self.__generation = int(time.time() * 1000)
+            self.__write_snapshot(self.__generation, initial or {})
+            return initial or {}
+        self.__generation = generations[-1]
+        records, end = self.__read_log(self.__generation)
+        # drop a torn tail so new records are not appended after garbage
+        if path.exists(self.__file(self.__generation, "log")):
+            with open(self.__file(self.__generation, "log"), 'r+b') as f:
+                f.truncate(end)
+        self.__records = len(records)
+        return self.__read_generation(self.__generation)
+
+    async def open(self, initial: Optional[Protections] = None) -> Protections:
+        """
+        Read the current protections
+        :param initial: the protections to start the journal with if it does not exist yet
+        """
+        return await asyncio.get_event_loop().run_in_executor(None, self.__open, initial)
+
+    def record(self, operation: str, name: str, entry: Entry) -> None:
+        """
+        Queue a change to be committed, returns immediately
+        :param operation: "add" or "remove"
+        """
+        body = pickle.dumps((time.time(), operation, name, entry))
+        self.__pending.append(FRAME.pack(len(body), zlib.crc32(body)) + body)
+        if self.__flushing is None or self.__flushing.done():
+            self.__flushing = asyncio.ensure_future(self.__flush())
+
+    def __append(self, generation: int, frames: bytes) -> None:
+        makedirs(self.directory, exist_ok=True)
+        with open(self.__file(generation, "log"), 'ab') as f:
+            f.write(frames)
+            f.flush()
+            os.fsync(f.fileno())
+
+    async def __flush(self) -> None:
+        loop = asyncio.get_event_loop()
+        while self.__pending:
+            if self.__snapshotting is not None:
+                await asyncio.shield(self.__snapshotting)
+            frames, self.__pending = self.__pending, []
+            await loop.run_in_executor(None, self.__append, self.__generation, b"".join(frames))
+            self.__records += len(frames)
+        if self.__records >= self.COMPACT_EVERY and (self.__compacting is None or self.__compacting.done()):
+            self.__compacting = asyncio.ensure_future(self.compact())
+
+    async def flush(self) -> None:
+        """
+        Wait until everything recorded so far is on disk
+        """
+        while self.__flushing is not None and not self.__flushing.done():
+            await self.__flushing
+
+    async def compact(self) -> None:
+        """
+        Start a new generation from a snapshot of the current protections
+        """
+        await self.flush()
+        protections = {name: set(entries) for name, entries in self.__state().items()}
+        generation = max(int(time.time() * 1000), self.__generation + 1)
+        self.__snapshotting = asyncio.get_event_loop().run_in_executor(
+            None, self.__write_snapshot, generation, protections)
+        try:
+            await self.__snapshotting
+            self.__generation = generation
+            self.__records = 0
+        finally:
+            self.__snapshotting = None
+
+    def __state_at(self, timestamp: float) -> Protections:
+        candidates = [generation for generation in self.__generations() if generation <= timestamp * 1000]
+        if not candidates:
+            raise ValueError("There is no history that far back")
+        return self.__read_generation(candidates[-1], until=timestamp)
+
+    async def state_at(self, timestamp: float) -> Protections:
+        """
+        Rebuild the protections as they were at the given unix time by replaying the journal
+        :raises ValueError: if the time is older than the oldest generation kept
+        """
+        await self.flush()
+        return await asyncio.get_event_loop().run_in_executor(None, self.__state_at, timestamp)
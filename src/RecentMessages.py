@@ -0,0 +1,46 @@
+from collections import deque
+from typing import Deque, Iterable, Iterator, Set
+
+
+class RecentMessages:
+    """
+    The ids of recently seen messages, a set for constant time lookups and a ring of the same ids in the order they
+    were added so the oldest can be forgotten.
+
+    A message is forgotten once it is more than window seconds older than the newest one, or once there are more than
+    capacity messages, so memory stays fixed no matter how many messages pass through. Ages are read from the
+    snowflakes themselves, replaying old messages after a reconnect does not need a clock.
+    """
+
+    def __init__(self, ids: Iterable[int] = (), window: float = 24 * 60 * 60, capacity: int = 10000):
+        """
+        :param ids: messages to start with, oldest first
+        :param window: the amount of seconds a message is remembered for
+        :param capacity: the maximum amount of messages remembered
+        """
+        # snowflakes keep their millisecond timestamp above the lowest 22 bits
+        self.__window = int(window * 1000) << 22
+        self.capacity = capacity
+        self.__ids: Set[int] = set()
+        self.__order: Deque[int] = deque()
+        self.__newest = 0
+        for message_id in ids:
+            self.add(message_id)
+
+    def add(self, message_id: int) -> None:
+        if message_id in self.__ids:
+            return
+        self.__ids.add(message_id)
+        self.__order.append(message_id)
+        self.__newest = max(self.__newest, message_id)
+        while len(self.__order) > self.capacity or self.__newest - self.__order[0] > self.__window:
+            self.__ids.discard(self.__order.popleft())
+
+    def __contains__(self, message_id: int) -> bool:
+        return message_id in self.__ids
+
+    def __len__(self) -> int:
+        return len(self.__ids)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.__order)
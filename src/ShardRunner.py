@@ -0,0 +1,110 @@
+import argparse
+import asyncio
+import multiprocessing
+import time
+from typing import Callable, Dict, Tuple, Any, Optional
+
+
+def shard_for(guild_id: int, shard_count: int) -> int:
+    """
+    The shard a guild belongs to, this is the same partitioning the discord gateway uses
+    """
+    return (guild_id >> 22) % shard_count
+
+
+def run_shard(shard_id: int, shard_count: int, token: str) -> None:
+    """
+    Run one shard of the bot against the real gateway, discord will only send this shard the events of its guilds
+    """
+    from bot import MainBot
+
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    client = MainBot(command_prefix="$", shard_id=shard_id, shard_count=shard_count)
+    client.load_extension("AdminCommands")
+    client.load_extension("SafetyChecks")
+    client.run(token)
+
+
+class ShardSupervisor:
+    """
+    Runs every shard in its own process and restarts the shards which crash
+    """
+
+    def __init__(self, target: Callable[..., None], shard_count: int, args: Tuple[Any, ...] = (),
+                 max_restarts: int = 5, backoff: float = 1.0):
+        """
+        :param target: the function a shard runs, called with the shard id, the shard count and then args
+        :param shard_count: the amount of shards to run
+        :param max_restarts: how many times a single shard may crash before it is given up on
+        :param backoff: seconds to wait before restarting a shard, doubled on every consecutive crash
+        """
+        self.target = target
+        self.shard_count = shard_count
+        self.args = args
+        self.max_restarts = max_restarts
+        self.backoff = backoff
+        self.restarts: Dict[int, int] = {}
+        self.__workers: Dict[int, multiprocessing.Process] = {}
+
+    def __spawn(self, shard_id: int) -> None:
+        worker = multiprocessing.Process(target=self.target, args=(shard_id, self.shard_count) + self.args,
+                                         name=f"shard-{shard_id}", daemon=True)
+        worker.start()
+        self.__workers[shard_id] = worker
+
+    def supervise(self, poll: float = 0.5, timeout: Optional[float] = None) -> bool:
+        """
+        Start every shard and block until all of them have exited cleanly or crashed too often
+        :param timeout: seconds after which the shards still running are terminated
+        :return: False if shards had to be terminated
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        # shard id -> when the crashed shard is started again, the other shards are watched meanwhile
+        restart_at: Dict[int, float] = {}
+        for shard_id in range(self.shard_count):
+            self.restarts[shard_id] = 0
+            self.__spawn(shard_id)
+        while self.__workers or restart_at:
+            now = time.monotonic()
+            if deadline is not None and now >= deadline:
+                unfinished = sorted(set(self.__workers) | set(restart_at))
+                print(f"Shards {', '.join(map(str, unfinished))} did not finish in time, terminating them")
+                self.terminate()
+                self.__workers.clear()
+                return False
+            for shard_id, at in list(restart_at.items()):
+                if now >= at:
+                    del restart_at[shard_id]
+                    self.restarts[shard_id] += 1
+                    self.__spawn(shard_id)
+            if not self.__workers:
+                time.sleep(max(0.0, min(poll, min(restart_at.values()) - now)))
+                continue
+            for shard_id, worker in list(self.__workers.items()):
+                worker.join(poll / len(self.__workers))
+                if worker.exitcode is None:
+                    continue
+                del self.__workers[shard_id]
+                if worker.exitcode == 0:
+                    continue
+                if self.restarts[shard_id] >= self.max_restarts:
+                    print(f"Shard {shard_id} crashed {self.restarts[shard_id] + 1} times, giving up")
+                    continue
+                delay = self.backoff * 2 ** self.restarts[shard_id]
+                print(f"Shard {shard_id} exited with {worker.exitcode}, restarting in {delay:g}s")
+                restart_at[shard_id] = time.monotonic() + delay
+        return True
+
+    def terminate(self) -> None:
+        for worker in self.__workers.values():
+            worker.terminate()
+            worker.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the bot sharded over several processes")
+    parser.add_argument("token", help="the bot token")
+    parser.add_argument("--shards", type=int, default=multiprocessing.cpu_count())
+    arguments = parser.parse_args()
+
+    ShardSupervisor(run_shard, arguments.shards, args=(arguments.token,)).supervise()
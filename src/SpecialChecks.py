@@ -1,27 +1,190 @@
 from functools import wraps
-from typing import Callable, TypeVar, Generic, Any, Tuple
+from time import perf_counter
+from typing import Callable, TypeVar, Generic, Any, Tuple, List, Iterable, Optional, Dict
 
 import discord
 
 T = TypeVar("T")
 
+Predicate = Callable[[discord.Client, T, Tuple[Any, ...]], bool]
+
+
+class CheckStage:
+    """
+    One predicate of a CheckPipeline along with what it has cost so far
+    """
+
+    def __init__(self, name: str, predicate: Predicate, after: Iterable[Predicate] = ()):
+        """
+        :param after: predicates which have to run before this one whenever they are part of the same pipeline
+        """
+        self.name = name
+        self.predicate = predicate
+        self.after: Tuple[Predicate, ...] = tuple(after)
+        self.calls = 0
+        self.rejections = 0
+        self.seconds = 0.0
+
+    @property
+    def mean_cost(self) -> float:
+        return self.seconds / self.calls if self.calls else 0.0
+
+    @property
+    def reject_rate(self) -> float:
+        return self.rejections / self.calls if self.calls else 0.0
+
+    def score(self) -> float:
+        """
+        The expected cost of rejecting an event with this stage, the pipeline runs the lowest scores first
+        """
+        if not self.calls:
+            # nothing is known yet, run it early to find out
+            return 0.0
+        return self.mean_cost / max(self.reject_rate, 1e-6)
+
+
+class CheckPipeline:
+    """
+    The predicates guarding one listener, stacked EventCheck and EventCheckAny decorators all add to the same pipeline
+    rather than wrapping the listener again.
+
+    Predicates start in decorator order. Every REORDER_EVERY events they are sorted by their mean cost divided by how
+    often they reject, so the cheapest way to turn an event down is tried first, without ever moving a predicate ahead
+    of one it was declared to run after. Once a reorder keeps the order as it was, only every SAMPLE_EVERY-th event is
+    measured, until the order changes again.
+
+    The pipeline attached to the listener is a template, every instance of the listener's class gets its own copy the
+    first time the listener is called, so each cog orders its checks by the events of its own guild.
+    """
+
+    REORDER_EVERY = 1000
+    SAMPLE_EVERY = 32
+
+    def __init__(self, name: str):
+        self.name = name
+        self.stages: List[CheckStage] = []
+        self.calls = 0
+        self.passed = 0
+        # every event is measured until the order settles
+        self.sample_every = 1
+
+    def add(self, stage: CheckStage) -> None:
+        # decorators are applied innermost first but the outermost used to be checked first
+        self.stages.insert(0, stage)
+
+    def copy(self) -> "CheckPipeline":
+        """
+        The same stages in their declared order, without any of the costs measured so far
+        """
+        pipeline = CheckPipeline(self.name)
+        pipeline.stages = [CheckStage(stage.name, stage.predicate, stage.after) for stage in self.stages]
+        return pipeline
+
+    def check(self, bot_self: discord.Client, event: T, *args) -> bool:
+        self.calls += 1
+        if self.calls % self.REORDER_EVERY == 0:
+            self.sample_every = self.SAMPLE_EVERY if not self.reorder() else 1
+        if self.calls % self.sample_every:
+            for stage in self.stages:
+                if not stage.predicate(bot_self, event, *args):
+                    return False
+            self.passed += 1
+            return True
+        for stage in self.stages:
+            start = perf_counter()
+            result = stage.predicate(bot_self, event, *args)
+            stage.seconds += perf_counter() - start
+            stage.calls += 1
+            if not result:
+                stage.rejections += 1
+                return False
+        self.passed += 1
+        return True
+
+    def reorder(self) -> bool:
+        """
+        :return: whether the order changed
+        """
+        present = {stage.predicate for stage in self.stages}
+        placed = set()
+        remaining = list(self.stages)
+        ordered: List[CheckStage] = []
+        while remaining:
+            ready = [stage for stage in remaining
+                     if all(predicate in placed or predicate not in present for predicate in stage.after)]
+            # a cycle of constraints cannot be honoured, keep the declared order for what is left
+            best = min(ready, key=CheckStage.score) if ready else remaining[0]
+            remaining.remove(best)
+            ordered.append(best)
+            placed.add(best.predicate)
+        changed = ordered != self.stages
+        self.stages = ordered
+        return changed
+
+    def report(self) -> str:
+        ret = f"{self.name}: {self.calls} events, {self.passed} passed\r"
+        for stage in self.stages:
+            ret += f"\t{stage.name}: {stage.calls} calls measured, {stage.reject_rate:.0%} rejected, " \
+                   f"{stage.mean_cost * 1e6:.2f}µs each\r"
+        return ret
+
+
+def pipelines(obj: object) -> List[CheckPipeline]:
+    """
+    The object's check pipelines of every listener defined on its class
+    """
+    found = []
+    for cls in type(obj).__mro__:
+        for value in vars(cls).values():
+            template = getattr(value, "__check_pipeline__", None)
+            if template is not None:
+                found.append(_pipeline_of(obj, template))
+    return found
+
+
+def _pipeline_of(obj: object, template: CheckPipeline) -> CheckPipeline:
+    own: Dict[CheckPipeline, CheckPipeline] = vars(obj).setdefault("_check_pipelines", {})
+    pipeline = own.get(template)
+    if pipeline is None:
+        pipeline = own[template] = template.copy()
+    return pipeline
+
+
+def _add_stage(func, stage: CheckStage):
+    template: Optional[CheckPipeline] = getattr(func, "__check_pipeline__", None)
+    if template is None:
+        template = CheckPipeline(func.__qualname__)
+        listener = func
+
+        @wraps(listener)
+        async def wrapper(bot_self: discord.Client, event: T, *args):
+            try:
+                pipeline = bot_self._check_pipelines[template]
+            except (AttributeError, KeyError):
+                pipeline = _pipeline_of(bot_self, template)
+            if pipeline.check(bot_self, event, *args):
+                await listener(bot_self, event, *args)
+
+        wrapper.__check_pipeline__ = template
+        func = wrapper
+    template.add(stage)
+    return func
+
 
 class EventCheck(Generic[T]):
     """
     A check to be added for an event like on_message
     :type T An event type
     """
-    def __init__(self, predicate: Callable[[discord.Client, T, Tuple[Any, ...]], bool]):
+    def __init__(self, predicate: Predicate, after: Iterable[Predicate] = ()):
+        """
+        :param after: predicates of the same listener this one relies on having passed
+        """
         self.predicate = predicate
+        self.after = tuple(after)
 
     def __call__(self, func):
-        @wraps(func)
-        async def wrapper(bot_self: discord.Client, event: T, *args):
-            if self.predicate(bot_self, event, *args):
-                await func(bot_self, event, *args)
-            else:
-                return
-        return wrapper
+        return _add_stage(func, CheckStage(self.predicate.__name__, self.predicate, self.after))
 
 
 class EventCheckAny(Generic[T]):
@@ -31,14 +194,13 @@ class EventCheckAny(Generic[T]):
     :type T An event type
     """
 
-    def __init__(self, *predicates: Tuple[Callable[[discord.Client, T, Tuple[Any, ...]], bool], ...]):
+    def __init__(self, *predicates: Tuple[Predicate, ...], after: Iterable[Predicate] = ()):
         self.predicates = predicates
+        self.after = tuple(after)
 
     def __call__(self, func):
-        @wraps(func)
-        async def wrapper(bot_self: discord.Client, event: T, *args):
-            if any(map(lambda x: x(bot_self, event, *args), self.predicates)):
-                await func(bot_self, event, *args)
-            else:
-                return
-        return wrapper
\ No newline at end of file
+        def any_predicate(bot_self: discord.Client, event: T, *args) -> bool:
+            return any(map(lambda x: x(bot_self, event, *args), self.predicates))
+
+        name = f"any({', '.join(predicate.__name__ for predicate in self.predicates)})"
+        return _add_stage(func, CheckStage(name, any_predicate, self.after))
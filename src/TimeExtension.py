@@ -1,47 +1,171 @@
+import asyncio
 import re
-from datetime import datetime
-from typing import List, Iterator, Optional
+from collections import OrderedDict
+from datetime import datetime, tzinfo
+from functools import lru_cache
+from typing import List, Optional, Dict, Any, Tuple
 
 import discord
 from dateutil.tz import gettz
 from discord.ext import commands
 
 from NoConflictCog import NoConflictCog
-from SpecialChecks import EventCheck, EventCheckAny
+from RecentMessages import RecentMessages
+from EventRouter import routed
+from SpecialChecks import EventCheck
+from PatternSandbox import PatternSandbox, WorkerDied
+from TimeScanner import TimeScanner, non_overlapping
 from AdminCommands import AdminCommands
 
 
+@lru_cache(maxsize=256)
+def resolve_zone(name: str) -> Optional[tzinfo]:
+    """
+    gettz, remembering the zones mentioned in messages so a burst of them does not look the name up every time
+    """
+    return gettz(name)
+
+
+DEFAULT_PATTERNS: List[re.Pattern] = [
+    re.compile(r"(?#Default pattern for matching just a time)"
+               r"(?P<hour>\d{1,2}):(?P<minute>\d{2}) ?(?P<tz>[\w/]+)"),
+    re.compile(
+        r"(?#Default pattern for matching a date and a time)"
+        r"(?P<hour>[0-2]?[0-4]):(?P<minute>[0-5][0-9]) ?"
+        r"(?P<tz>[\w/]+) "
+        r"(?P<month>(?:0?[1-9]|1[012]))/(?P<day>(?:0[0-9]|2[0-9]|3[0-1]))"
+    )
+]
+
+
 class TimeExtension(NoConflictCog):
 
+    # the amount of rendered conversions kept, one per distinct minute mentioned
+    RENDER_CACHE_SIZE = 512
+    # converted messages are written to the store at most once per this many seconds, every write copies all of them
+    CONVERTED_PERSIST_INTERVAL = 5.0
+
     def __init__(self, bot: commands.Bot):
         self.bot = bot
         self.watched_channels: List[discord.ChannelType] = []
         self.watched_users: List[discord.abc.User] = []
-        self.formats: List[re.Pattern] = [
-            re.compile(r"(?#Default pattern for matching just a time)"
-                       r"(?P<hour>\d{1,2}):(?P<minute>\d{2}) ?(?P<tz>[\w/]+)"),
-            re.compile(
-                r"(?#Default pattern for matching a date and a time)"
-                r"(?P<hour>[0-2]?[0-4]):(?P<minute>[0-5][0-9]) ?"
-                r"(?P<tz>[\w/]+) "
-                r"(?P<month>(?:0?[1-9]|1[012]))/(?P<day>(?:0[0-9]|2[0-9]|3[0-1]))"
-            )
-        ]
+        # the default patterns are trusted and run on the loop, those added by users only run in the sandbox
+        self.formats: TimeScanner = TimeScanner(DEFAULT_PATTERNS)
+        self.sandbox = PatternSandbox()
         self.timezones = ["America/Los_Angeles", "America/Denver", "America/New_York", "Europe/Berlin",
                           "America/Chicago"]
-        self.converted_messages: List[int] = []
+        self.converted_messages = RecentMessages()
+        # the resolved zones of self.timezones, the version changes whenever the zones do
+        self.zones: Dict[str, tzinfo] = {}
+        self.zone_version = 0
+        self.__rendered: "OrderedDict[Tuple[int, int], List[Tuple[str, str]]]" = OrderedDict()
+        self.render_hits = 0
+        self.render_misses = 0
+        self.__persisting: Optional[asyncio.TimerHandle] = None
+        self.__resolve_zones()
+
+    def export_state(self) -> Dict[str, Any]:
+        return {
+            "formats": [f.pattern for f in self.__all_patterns()],
+            "disabled_patterns": dict(self.sandbox.disabled),
+            "timezones": list(self.timezones),
+            "watched_channels": [channel.id for channel in self.watched_channels],
+            "watched_users": [user.id for user in self.watched_users],
+            "converted_messages": list(self.converted_messages),
+        }
+
+    def import_state(self, state: Dict[str, Any]) -> None:
+        patterns = [re.compile(pattern) for pattern in state["formats"]]
+        self.formats = TimeScanner(pattern for pattern in patterns if pattern in DEFAULT_PATTERNS)
+        self.sandbox = PatternSandbox([pattern for pattern in patterns if pattern not in DEFAULT_PATTERNS],
+                                      state.get("disabled_patterns"))
+        self.timezones = list(state["timezones"])
+        self.__resolve_zones()
+        self.watched_channels = list(filter(None, map(self.bot.get_channel, state["watched_channels"])))
+        self.watched_users = list(filter(None, map(self.bot.get_user, state["watched_users"])))
+        self.converted_messages = RecentMessages(state["converted_messages"])
+        self.__route_watched()
+
+    @classmethod
+    def routes(cls, state: Dict[str, Any]) -> List[Tuple[str, str, int]]:
+        # as __route_watched does it
+        return [("on_message", "channel", channel_id) for channel_id in state.get("watched_channels", ())] + \
+               [("on_message", "user", user_id) for user_id in state.get("watched_users", ())]
+
+    def hand_over(self) -> Dict[str, Any]:
+        # the compiled patterns, resolved zones, rendered conversions and remembered messages go over as they are
+        return {
+            "formats": self.formats,
+            "sandbox": self.sandbox,
+            "timezones": self.timezones,
+            "zones": self.zones,
+            "zone_version": self.zone_version,
+            "rendered": self.__rendered,
+            "watched_channels": self.watched_channels,
+            "watched_users": self.watched_users,
+            "converted_messages": self.converted_messages,
+        }
+
+    def take_over(self, handed: Dict[str, Any]) -> None:
+        self.formats = handed["formats"]
+        self.sandbox = handed["sandbox"]
+        self.timezones = handed["timezones"]
+        self.zones = handed["zones"]
+        self.zone_version = handed["zone_version"]
+        # a version which renders conversions differently has to clear these
+        self.__rendered = handed["rendered"]
+        self.watched_channels = handed["watched_channels"]
+        self.watched_users = handed["watched_users"]
+        self.converted_messages = handed["converted_messages"]
+        self.__route_watched()
+
+    def __all_patterns(self) -> List[re.Pattern]:
+        return list(self.formats) + self.sandbox.patterns
+
+    def __remove_pattern(self, pattern: re.Pattern) -> None:
+        if pattern in self.formats:
+            self.formats.remove(pattern)
+        else:
+            self.sandbox.patterns.remove(pattern)
+            self.sandbox.disabled.pop(pattern.pattern, None)
+        self.persist("formats", "disabled_patterns")
+
+    def __resolve_zones(self) -> None:
+        self.zones = {timezone: zone for timezone, zone in zip(self.timezones, map(resolve_zone, self.timezones))
+                      if zone is not None}
+        self.zone_version += 1
+        # renders of the old zones can never be asked for again
+        self.__rendered.clear()
+
+    async def cog_before_invoke(self, ctx: commands.Context):
+        await self.load_stored_state()
+
+    def cog_unload(self) -> None:
+        if self.__persisting is not None:
+            self.__persisting.cancel()
+            self.__persist_converted()
+
+    def __persist_converted(self) -> None:
+        self.__persisting = None
+        store = self.store
+        if store is not None:
+            store.set("converted_messages", list(self.converted_messages))
 
     def __unconverted_message(self, message: discord.Message, *args) -> bool:
         return message.id not in self.converted_messages
 
-    def __watched_channel(self, message: discord.Message, *args) -> bool:
-        return message.channel in self.watched_channels
-
     def __not_self(self, message: discord.Message, *args) -> bool:
         return message.author.id != self.bot.user.id
 
-    def __check_user(self, message: discord.Message, *args) -> bool:
-        return message.author in self.watched_users
+    def __route_watched(self) -> None:
+        """
+        Have on_message called for messages in a watched channel or from a watched user
+        """
+        self.unroute(self.on_message)
+        for channel in self.watched_channels:
+            self.route(self.on_message, channel=channel.id)
+        for user in self.watched_users:
+            self.route(self.on_message, user=user.id)
 
     @commands.command()
     async def add_pattern(self, ctx: commands.Context, pattern: re.compile):
@@ -53,7 +177,16 @@ class TimeExtension(NoConflictCog):
         ?P<tz> to denote how to convert the string to a usable datetime.
         It is recommended you use a site like regex101.com before adding a pattern
         """
-        self.formats.append(pattern)
+        try:
+            problem = await self.sandbox.validate(pattern)
+        except WorkerDied:
+            # a pattern which kills the worker, by using up its memory say, is no safer than one which hangs it
+            problem = "the worker trying it died"
+        if problem is not None:
+            await ctx.send(f"Pattern {str(pattern.pattern)} could make the bot hang and was not added: {problem}")
+            return
+        self.sandbox.patterns.append(pattern)
+        self.persist("formats")
         await ctx.send(f"Now watching pattern {str(pattern)}")
 
     @commands.command()
@@ -64,11 +197,13 @@ class TimeExtension(NoConflictCog):
         return of $patterns)
         :param pattern: Optional, A pattern to remove
         """
-        if pattern_number and len(self.formats) > pattern_number > 0 and not pattern:
-            pattern = self.formats.pop(pattern_number)
+        patterns = self.__all_patterns()
+        if pattern_number and len(patterns) > pattern_number > 0 and not pattern:
+            pattern = patterns[pattern_number]
+            self.__remove_pattern(pattern)
             await ctx.send(f"Removed pattern: {str(pattern.pattern)}")
-        elif not pattern_number and pattern in self.formats:
-            self.formats.remove(pattern)
+        elif not pattern_number and pattern in patterns:
+            self.__remove_pattern(pattern)
             await ctx.send(f"Removed {pattern.pattern}")
         else:
             await ctx.send("Could not remove pattern")
@@ -79,6 +214,8 @@ class TimeExtension(NoConflictCog):
         When called in a channel, that channel will be added to the watchlist for time conversions
         """
         self.watched_channels.append(ctx.channel)
+        self.route(self.on_message, channel=ctx.channel.id)
+        self.persist("watched_channels")
         await ctx.send("Channel is now being watched")
 
     @commands.command()
@@ -88,6 +225,8 @@ class TimeExtension(NoConflictCog):
         """
         if ctx.channel in self.watched_channels:
             self.watched_channels.remove(ctx.channel)
+            self.unroute(self.on_message, channel=ctx.channel.id)
+            self.persist("watched_channels")
             await ctx.send("This channel is no longer being watched")
         else:
             await ctx.send("This channel is not currently being watched")
@@ -99,12 +238,15 @@ class TimeExtension(NoConflictCog):
         canonical timezone or in ISO UTC format (UTC[+-]# or UTC[+-]####)
         :param timezone: The valid timezone string
         """
-        if gettz(timezone) is None:
+        if resolve_zone(timezone) is None:
             await ctx.send("That timezone does not exist, please try again with the full timezone name supplied "
                            "(Ex. America/New_York)"
                            "or it is in UTC offset form (E.x UTC-4).")
-        await ctx.send(f"Timezone {timezone} added.")
+            return
         self.timezones.append(timezone)
+        self.__resolve_zones()
+        self.persist("timezones")
+        await ctx.send(f"Timezone {timezone} added.")
 
     @commands.command()
     async def remove_timezone(self, ctx: commands.Context, timezone: str):
@@ -114,49 +256,94 @@ class TimeExtension(NoConflictCog):
         """
         if timezone in self.timezones:
             self.timezones.remove(timezone)
-            await ctx.send(f"Timezone {timezone} added.")
+            self.__resolve_zones()
+            self.persist("timezones")
+            await ctx.send(f"Timezone {timezone} removed.")
         else:
             await ctx.send(f"Timezone {timezone} does not exist in bot.")
 
     @commands.command()
     async def patterns(self, ctx: commands.context):
-        await ctx.send("\r\r".join(map(lambda x: x.pattern, self.formats)))
+        await ctx.send("\r\r".join(
+            pattern.pattern + (f" (disabled, {self.sandbox.disabled[pattern.pattern]})"
+                               if pattern.pattern in self.sandbox.disabled else "")
+            for pattern in self.__all_patterns()))
 
-    @commands.Cog.listener()
+    def __render(self, time: datetime) -> List[Tuple[str, str]]:
+        """
+        The name and time of every watched zone at the given time, messages about the same minute share one render
+        """
+        key = (int(time.timestamp()) // 60, self.zone_version)
+        fields = self.__rendered.get(key)
+        if fields is not None:
+            self.render_hits += 1
+            self.__rendered.move_to_end(key)
+            return fields
+        self.render_misses += 1
+        fields = []
+        for zone in self.zones.values():
+            converted = time.astimezone(zone)
+            fields.append((converted.strftime("%Z"), converted.strftime("%I:%M %p")))
+        self.__rendered[key] = fields
+        while len(self.__rendered) > self.RENDER_CACHE_SIZE:
+            self.__rendered.popitem(last=False)
+        return fields
+
+    def __convert(self, match: re.Match) -> discord.Embed:
+        """
+        Build the embed converting a time mention to every watched timezone
+        """
+        link = "https://savvytime.com/countdown?name=Countdown"
+        embed = discord.Embed()
+        time = datetime.now()
+        match_dict = match.groupdict()
+        time = datetime(
+            int(match_dict.get("year", time.year)),
+            int(match_dict.get("month", time.month)),
+            int(match_dict.get("day", time.day)),
+            hour=int(match_dict.get("hour", time.hour)),
+            minute=int(match_dict.get("minute", time.minute)),
+            tzinfo=resolve_zone(match_dict.get("tz", "UTC"))
+        )
+        for name, value in self.__render(time):
+            embed.add_field(name=name, value=value)
+        embed.title = "Click here for countdown"
+        embed.url = f"{link+'&time='+str(int(time.timestamp()*1000))}"
+        return embed
+
+    @routed()
     @EventCheck(__unconverted_message)
     @EventCheck(__not_self)
-    @EventCheckAny(__watched_channel, __check_user)
     async def on_message(self, message: discord.Message):
-        link = "https://savvytime.com/countdown?name=Countdown"
-        ret = ""
-        f: re.Pattern
-        formatted: Iterator[Optional[re.Match]] = map(lambda f: f.search(message.content), self.formats)
-        formatted = list(filter(lambda x: x is not None, formatted))
-        embed = discord.Embed()
-        if formatted:
-            longest_match: re.Match = max(formatted, key=lambda x: len(x.group(0)))
-            time = datetime.now()
-            match_dict = longest_match.groupdict()
-            time = datetime(
-                int(match_dict.get("year", time.year)),
-                int(match_dict.get("month", time.month)),
-                int(match_dict.get("day", time.day)),
-                hour=int(match_dict.get("hour", time.hour)),
-                minute=int(match_dict.get("minute", time.minute)),
-                tzinfo=gettz(match_dict.get("tz", "UTC"))
-            )
-            ret = "Event happening at " + time.strftime("%I:%M %p %Z") + "\r"
-            for timezone in self.timezones:
-                newtime = gettz(timezone)
-                newtime = time.astimezone(newtime)
-                embed.add_field(name=newtime.strftime("%Z"), value=newtime.strftime("%I:%M %p"))
-                ret += newtime.strftime("%I:%M %p %Z") + "\r"
-            self.converted_messages.append(message.id)
-            embed.title = "Click here for countdown"
-            embed.url = f"{link+'&time='+str(int(time.timestamp()*1000))}"
-            await message.channel.send(
-                embed=embed
-            )
+        # the watch lists, patterns and converted messages are read from the store when the cog is created
+        await self.load_stored_state()
+        if message.id in self.converted_messages:
+            # the checks ran before the converted messages were read
+            return
+        matches: List[re.Match] = self.formats.scan(message.content)
+        if self.sandbox.patterns:
+            try:
+                sandboxed, disabled = await self.sandbox.scan(message.content)
+            except Exception as e:
+                # the default patterns found their times without the sandbox, those are still converted
+                print(f"Could not search {message.id} with the patterns of {message.guild}: {e}")
+                sandboxed, disabled = [], []
+            if sandboxed:
+                matches = non_overlapping(matches + sandboxed)
+            for pattern in disabled:
+                self.persist("disabled_patterns")
+                # tell the owner rather than everyone in the channel when possible
+                owner = message.guild.owner if message.guild is not None else None
+                await (owner or message.channel).send(
+                    f"Pattern {pattern.pattern} was disabled, it {self.sandbox.disabled[pattern.pattern]}")
+        if matches:
+            self.converted_messages.add(message.id)
+            # a reconnect can replay the message, it must not be converted twice after a restart either
+            if self.__persisting is None:
+                self.__persisting = asyncio.get_event_loop().call_later(self.CONVERTED_PERSIST_INTERVAL,
+                                                                        self.__persist_converted)
+        # a burst of times in a channel is answered with one message
+        await asyncio.gather(*(self.bot.outbox.send(message.channel, self.__convert(match)) for match in matches))
 
 
 def setup(bot: commands.Bot):
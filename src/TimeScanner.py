@@ -0,0 +1,208 @@
+import re
+from typing import Iterable, Iterator, List, Optional, Set, FrozenSet
+
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    # before python 3.11
+    import sre_parse
+
+_GROUP_NAME = re.compile(r"\(\?P([<=])(\w+)")
+
+
+def required_characters(pattern: re.Pattern) -> FrozenSet[str]:
+    """
+    Characters which are part of every string the pattern can match. Letters are left out, flags can change their
+    case.
+    """
+    def walk(parsed) -> Set[str]:
+        required: Set[str] = set()
+        for op, av in parsed:
+            if op is sre_parse.LITERAL:
+                required.add(chr(av))
+            elif op is sre_parse.SUBPATTERN:
+                required |= walk(av[-1])
+            elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT) and av[0] >= 1:
+                required |= walk(av[2])
+            elif op is sre_parse.BRANCH:
+                branches = [walk(branch) for branch in av[1]]
+                required |= set.intersection(*branches) if branches else set()
+        return required
+
+    try:
+        return frozenset(c for c in walk(sre_parse.parse(pattern.pattern, pattern.flags)) if not c.isalpha())
+    except Exception:
+        return frozenset()
+
+
+def first_characters(pattern: re.Pattern) -> Optional[List[str]]:
+    """
+    Character class items one of which every match of the pattern starts with, None if that cannot be told
+    """
+    categories = {sre_parse.CATEGORY_DIGIT: r"\d", sre_parse.CATEGORY_WORD: r"\w", sre_parse.CATEGORY_SPACE: r"\s"}
+
+    def first(parsed) -> Optional[List[str]]:
+        items: List[str] = []
+        for op, av in parsed:
+            if op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+                repeated = first(av[2])
+                if repeated is None:
+                    return None
+                items += repeated
+                if av[0] >= 1:
+                    return items
+                # an optional element, the match can just as well start with whatever follows it
+                continue
+            if op is sre_parse.LITERAL:
+                return items + [re.escape(chr(av))]
+            if op is sre_parse.IN:
+                for item_op, item in av:
+                    if item_op is sre_parse.LITERAL:
+                        items.append(re.escape(chr(item)))
+                    elif item_op is sre_parse.RANGE:
+                        items.append(f"{re.escape(chr(item[0]))}-{re.escape(chr(item[1]))}")
+                    elif item_op is sre_parse.CATEGORY and item in categories:
+                        items.append(categories[item])
+                    else:
+                        return None
+                return items
+            if op is sre_parse.SUBPATTERN:
+                # a group which turns flags on could change what its first character matches
+                subpattern = first(av[-1]) if not av[1] else None
+                return None if subpattern is None else items + subpattern
+            if op is sre_parse.BRANCH:
+                branches = [first(branch) for branch in av[1]]
+                return None if None in branches else items + [item for branch in branches for item in branch]
+            return None
+        # every element was optional, the match can be empty
+        return None
+
+    try:
+        return first(sre_parse.parse(pattern.pattern, pattern.flags))
+    except Exception:
+        return None
+
+
+def non_overlapping(matches: Iterable[re.Match]) -> List[re.Match]:
+    """
+    Keep the longest of overlapping matches, the rest in order of where they start
+    """
+    result: List[re.Match] = []
+    for match in sorted(matches, key=lambda x: (x.start(), -x.end())):
+        if not result or match.start() >= result[-1].end():
+            result.append(match)
+    return result
+
+
+class TimeScanner:
+    """
+    Finds every time mentioned in a string using a list of patterns, behaves like the list of those patterns.
+
+    The patterns are fused into one alternation which is compiled again only when the list changes, so a string is
+    searched once no matter how many patterns there are. Where several patterns match at the same place the longest
+    match wins. Before any regex runs, strings missing a character every pattern requires (the ':' of a time for the
+    default patterns) are rejected.
+    """
+
+    def __init__(self, patterns: Iterable[re.Pattern] = ()):
+        self.__patterns: List[re.Pattern] = list(patterns)
+        self.__fused: Optional[re.Pattern] = None
+        # patterns which could not be fused, e.g. those with numbered back references or inline global flags
+        self.__separate: List[re.Pattern] = []
+        self.__members: List[re.Pattern] = []
+        self.__prefilter: FrozenSet[str] = frozenset()
+        self.__dirty = True
+        self.version = 0
+
+    def __changed(self) -> None:
+        self.__dirty = True
+        self.version += 1
+
+    def append(self, pattern: re.Pattern) -> None:
+        self.__patterns.append(pattern)
+        self.__changed()
+
+    def remove(self, pattern: re.Pattern) -> None:
+        self.__patterns.remove(pattern)
+        self.__changed()
+
+    def pop(self, index: int = -1) -> re.Pattern:
+        pattern = self.__patterns.pop(index)
+        self.__changed()
+        return pattern
+
+    def __len__(self) -> int:
+        return len(self.__patterns)
+
+    def __iter__(self) -> Iterator[re.Pattern]:
+        return iter(self.__patterns)
+
+    def __contains__(self, pattern: re.Pattern) -> bool:
+        return pattern in self.__patterns
+
+    def __getitem__(self, index: int) -> re.Pattern:
+        return self.__patterns[index]
+
+    def __compile(self) -> None:
+        alternatives: List[str] = []
+        self.__members = []
+        self.__separate = []
+        for pattern in self.__patterns:
+            index = len(self.__members)
+            # group names have to be unique across the alternation
+            renamed = _GROUP_NAME.sub(lambda m: f"(?P{m.group(1)}_{index}_{m.group(2)}", pattern.pattern)
+            alternative = f"(?P<_{index}>{renamed})"
+            try:
+                if pattern.groups != re.compile(renamed, pattern.flags).groups or \
+                        re.search(r"\\[1-9]", pattern.pattern) or \
+                        pattern.flags & ~re.UNICODE:
+                    raise re.error("cannot be fused")
+                re.compile(alternative)
+            except re.error:
+                self.__separate.append(pattern)
+                continue
+            self.__members.append(pattern)
+            alternatives.append(alternative)
+        self.__fused = None
+        if alternatives:
+            fused = "|".join(alternatives)
+            # python tries every alternative at every position, looking ahead for a character one of them has to start
+            # with lets it skip straight to the places where a match can begin
+            starts = [first_characters(pattern) for pattern in self.__members]
+            if None not in starts:
+                fused = f"(?=[{''.join(sorted(set(item for items in starts for item in items)))}])(?:{fused})"
+            self.__fused = re.compile(fused)
+        requirements = [required_characters(pattern) for pattern in self.__patterns]
+        self.__prefilter = frozenset.intersection(*requirements) if requirements else frozenset()
+        self.__dirty = False
+
+    def scan(self, content: str) -> List[re.Match]:
+        """
+        Every non overlapping time mentioned in the content, in order
+        :return: the matches of the original patterns, so their groups keep their names
+        """
+        if self.__dirty:
+            self.__compile()
+        for character in self.__prefilter:
+            if character not in content:
+                return []
+
+        candidates: List[re.Match] = []
+        if self.__fused is not None:
+            position = 0
+            while position <= len(content):
+                found = self.__fused.search(content, position)
+                if found is None:
+                    break
+                start = found.start()
+                # the alternation stops at the first pattern which matches here, every one before it did not but one
+                # of the later patterns could still make a longer match
+                first = int(found.lastgroup[1:])
+                matches = filter(None, (pattern.match(content, start) for pattern in self.__members[first:]))
+                longest = max(matches, key=lambda x: x.end())
+                candidates.append(longest)
+                position = max(longest.end(), start + 1)
+        for pattern in self.__separate:
+            candidates.extend(pattern.finditer(content))
+
+        return non_overlapping(candidates)
@@ -1,21 +1,413 @@
+import asyncio
 import sys
+from functools import partial
+from time import perf_counter, time
+from types import SimpleNamespace
 
-from typing import Dict
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 
 from discord.ext import commands
+from discord.ext.commands import errors
+from discord.ext.commands.bot import _is_submodule
+from discord.state import ConnectionState
 import discord
 import typing
 
+from EventRouter import EventRouter, RouteKey, route_keys
+from ExtensionTemplates import ExtensionTemplates
+from FleetRollout import FleetRollout
+from GuildRegistry import GuildBotRegistry
+from GuildStore import GuildStore
+from HttpScheduler import HttpScheduler, priority, INTERACTIVE
+from LazyExtensions import ExtensionManifest, LazyCommand
+from LoopWatchdog import LoopWatchdog
+from Metrics import Metrics, guild_id_of
+from NoConflictCog import HandOver, NoConflictCog
+from Outbox import Outbox
 
-class MyDiscordBot(commands.Bot):
+
+class RoutedBot(commands.Bot):
+    """
+    A bot which also dispatches events to the routed listeners interested in them
+    """
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        self.router = EventRouter()
+        self.metrics = Metrics()
+        self.outbox = Outbox(metrics=self.metrics)
+        self.watchdog: Optional[LoopWatchdog] = None
+        self.scheduler: Optional[HttpScheduler] = None
+        # called with the bot and the name of an event whenever the bot starts or stops listening to it
+        self.listeners_changed: Optional[Callable[["RoutedBot", str], None]] = None
+        self.router.on_change = self.__listeners_changed
+        self.__waiting: Dict[str, int] = {}
+        # when set, extensions are executed once and shared with every other bot using the same templates
+        self.templates: Optional[ExtensionTemplates] = None
+        # when set, extensions loaded from the templates only get stand-ins for their commands and listeners, their
+        # cogs are created when one of those is first used
+        self.lazy_extensions = False
+        # extension -> its stand-in listeners, for the lazily loaded extensions whose cogs do not exist yet
+        self.__lazy: Dict[str, List[Tuple[str, Callable]]] = {}
+        # extension -> what its cogs will route to once created, worked out from their state
+        self.__stub_routes: Dict[str, asyncio.Future] = {}
+        # cog name -> state to import once the cog is created, for cogs of lazily loaded extensions
+        self.deferred_states: Dict[str, Dict[str, Any]] = {}
+
+    @property
+    def lazy_pending(self) -> List[str]:
+        """
+        The lazily loaded extensions whose cogs have not been created yet
+        """
+        return list(self.__lazy)
+
+    def load_extension(self, name, *, package=None):
+        if self.templates is None:
+            return super().load_extension(name, package=package)
+        name = self._resolve_name(name, package)
+        if name in self.extensions:
+            raise errors.ExtensionAlreadyLoaded(name)
+        lib = self.templates.module(name)
+        if self.lazy_extensions:
+            manifest = self.templates.manifest(name)
+            if not manifest.eager and self.__add_stubs(manifest):
+                self._BotBase__extensions[name] = lib
+                return
+        try:
+            lib.setup(self)
+        except Exception as e:
+            self._remove_module_references(lib.__name__)
+            self._call_module_finalizers(lib, name)
+            raise errors.ExtensionFailed(name, e) from e
+        self._BotBase__extensions[name] = lib
+
+    def __add_stubs(self, manifest: ExtensionManifest) -> bool:
+        """
+        Register the stand-ins of a lazily loaded extension
+        :return: False if one of its command names is taken, the real cogs have to resolve that
+        """
+        added: List[LazyCommand] = []
+        for stub in manifest.stubs:
+            try:
+                self.add_command(stub)
+            except commands.CommandRegistrationError:
+                for command in added:
+                    self.remove_command(command.name)
+                return False
+            added.append(stub)
+        listeners = []
+        for event in manifest.events | set(manifest.routed):
+            routed = event in manifest.routed
+            listener = partial(self.__lazy_routed_listener if routed else self.__lazy_listener, manifest.name, event)
+            # unloading the extension removes the listeners of its module
+            listener.__module__ = manifest.name
+            listener.__name__ = event
+            # the routed ones hear every event until the routes of the cogs are known
+            self.add_listener(listener, event)
+            listeners.append((event, listener))
+        self.__lazy[manifest.name] = listeners
+        if manifest.routed:
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                pass
+            else:
+                self.__routes(manifest.name)
+        return True
+
+    def __drop_stubs(self, extension: str) -> Optional[List[Tuple[str, Callable]]]:
+        """
+        Remove the stand-ins of a lazily loaded extension
+        :return: the stand-in listeners, None if the extension was not waiting to be created
+        """
+        self.__stub_routes.pop(extension, None)
+        listeners = self.__lazy.pop(extension, None)
+        for event, listener in listeners or ():
+            self.remove_listener(listener, event)
+            self.router.forget(listener)
+        return listeners
+
+    def __routes(self, extension: str) -> asyncio.Future:
+        routes = self.__stub_routes.get(extension)
+        if routes is None:
+            routes = self.__stub_routes[extension] = asyncio.ensure_future(self.__route_stubs(extension))
+        return routes
+
+    async def __route_stubs(self, extension: str) -> Optional[Dict[str, Set[RouteKey]]]:
+        """
+        Subscribe the stand-ins of routed listeners to what the cogs would route them to, the way the cogs themselves
+        will once they are created
+        :return: event -> the keys routed to, None if a cog can only tell once it is created
+        """
+        manifest = self.templates.manifest(extension)
+        listeners = self.__lazy.get(extension)
+        store = getattr(self, "store", None)
+        guild = getattr(self, "guild", None)
+        routes: Dict[str, Set[RouteKey]] = {event: set() for event in manifest.routed}
+        try:
+            for cog_name in set().union(*manifest.routed.values()):
+                # what the cog would import, the state of its last hibernation overlaid by what it persisted
+                state = dict(self.deferred_states.get(cog_name, {}))
+                if store is not None and guild is not None:
+                    state.update(await store.namespace(guild.id, cog_name).items())
+                cls = manifest.classes[cog_name]
+                cog_routes = cls.routes(state) if issubclass(cls, NoConflictCog) else None
+                if cog_routes is None:
+                    return None
+                for event, kind, snowflake in cog_routes:
+                    routes.setdefault(event, set()).add((kind, snowflake))
+        except Exception as e:
+            print(f"Could not work out the routes of {extension}, its cogs are created by the next event: {e}")
+            return None
+        if listeners is None or self.__lazy.get(extension) is not listeners:
+            # created or unloaded meanwhile
+            return routes
+        for event, listener in listeners:
+            if event in manifest.routed:
+                self.remove_listener(listener, event)
+                for kind, snowflake in routes[event]:
+                    self.router.subscribe(event, listener, kind, snowflake)
+        return routes
+
+    async def __lazy_routed_listener(self, extension: str, event: str, *args):
+        routes = await self.__routes(extension)
+        if routes is not None and not any(key in routes.get(event, ()) for key in route_keys(*args)):
+            # none of the cogs would have routed the event to themselves
+            return
+        await self.__lazy_listener(extension, event, *args)
+
+    async def __lazy_listener(self, extension: str, event: str, *args):
+        cogs = self.materialize(extension)
+        for cog in cogs:
+            if isinstance(cog, NoConflictCog):
+                # the routes of a cog are part of its state
+                await cog.load_stored_state()
+        # the event was dispatched before the cogs existed, their listeners get it now
+        for cog in cogs:
+            for name, listener in cog.get_listeners():
+                if name == event:
+                    self._schedule_event(listener, event, *args)
+        for listener in self.router.listeners(event, *args):
+            if getattr(listener, "__self__", None) in cogs:
+                self._schedule_event(listener, event, *args)
+
+    def materialize(self, name: str) -> List[commands.Cog]:
+        """
+        Create the cogs of a lazily loaded extension, if that has not happened yet
+        :return: the cogs of the extension
+        """
+        manifest = self.templates.manifest(name)
+        if self.__drop_stubs(name) is not None:
+            for command in list(self.commands):
+                if isinstance(command, LazyCommand) and command.extension == name:
+                    self.remove_command(command.name)
+            lib = self.extensions[name]
+            try:
+                lib.setup(self)
+            except Exception as e:
+                self._remove_module_references(lib.__name__)
+                self._call_module_finalizers(lib, name)
+                raise errors.ExtensionFailed(name, e) from e
+            for cog_name in manifest.cogs:
+                cog = self.get_cog(cog_name)
+                state = self.deferred_states.pop(cog_name, None)
+                if state is not None and isinstance(cog, NoConflictCog):
+                    cog.import_state(state)
+        return [cog for cog in map(self.get_cog, manifest.cogs) if cog is not None]
+
+    def get_cog(self, name):
+        cog = super().get_cog(name)
+        if cog is None and self.__lazy:
+            # the cog is asked for by name, e.g. to protect it, so it is about to be used
+            for extension in list(self.__lazy):
+                if name in self.templates.manifest(extension).cogs:
+                    self.materialize(extension)
+                    return super().get_cog(name)
+        return cog
+
+    def unload_extension(self, name, *, package=None):
+        self.__drop_stubs(self._resolve_name(name, package))
+        super().unload_extension(name, package=package)
+
+    def replace_extension(self, name: str) -> None:
+        """
+        Reload an extension from the module shared in the templates, which was executed already. Like reload_extension
+        the bot keeps the old version if the new one fails.
+        """
+        lib = self.extensions.get(name)
+        if lib is None:
+            raise errors.ExtensionNotLoaded(name)
+        handovers = self.__hand_over(name)
+        created = self.__drop_stubs(name) is None
+        self._remove_module_references(lib.__name__)
+        self._call_module_finalizers(lib, name)
+        try:
+            self.load_extension(name)
+            if created:
+                # the cogs were in use, the new ones have to be created now to know whether the new version works
+                self.materialize(name)
+        except Exception:
+            lib.setup(self)
+            self._BotBase__extensions[name] = lib
+            self.__take_over(handovers)
+            raise
+        self.__take_over(handovers)
+
+    def reload_extension(self, name, *, package=None):
+        name = self._resolve_name(name, package)
+        handovers = self.__hand_over(name)
+        # a reload executes the module again, bots loading the extension afterwards share the new version
+        old = self.templates.forget(name) if self.templates is not None else None
+        try:
+            super().reload_extension(name)
+        except Exception:
+            if old is not None:
+                self.templates.share(name, old)
+            # the old version was set up again
+            self.__take_over(handovers)
+            raise
+        self.__take_over(handovers)
+
+    def __hand_over(self, name: str) -> Dict[str, HandOver]:
+        """
+        What the created cogs of an extension pass on to their next instances
+        """
+        lib = self.extensions.get(name)
+        if lib is None:
+            return {}
+        return {cog_name: HandOver(cog) for cog_name, cog in self.cogs.items()
+                if isinstance(cog, NoConflictCog) and _is_submodule(lib.__name__, type(cog).__module__)}
+
+    def __take_over(self, handovers: Dict[str, HandOver]) -> None:
+        for cog_name, handover in handovers.items():
+            # creates the cog if its extension came back lazily
+            cog = self.get_cog(cog_name)
+            if isinstance(cog, NoConflictCog):
+                try:
+                    handover.apply(cog)
+                except Exception as e:
+                    print(f"Could not carry the state of {cog_name} over: {e}")
+
+    def _call_module_finalizers(self, lib, key):
+        if self.templates is None or key not in self.templates:
+            return super()._call_module_finalizers(lib, key)
+        # the module is shared, it has to stay imported for the other bots
+        try:
+            lib.teardown(self)
+        except Exception:
+            pass
+        finally:
+            self._BotBase__extensions.pop(key, None)
+
+    def __listeners_changed(self, event: str) -> None:
+        if self.listeners_changed is not None:
+            self.listeners_changed(self, event)
+
+    def listens(self, event: str) -> bool:
+        """
+        Whether anything on this bot wants to hear about the event
+        :param event: the name of the event, like on_reaction_add
+        """
+        return bool(self.extra_events.get(event)) or self.router.listens(event) or event in self.__waiting
+
+    def add_listener(self, func, name=None):
+        super().add_listener(func, name)
+        self.__listeners_changed(name or func.__name__)
+
+    def remove_listener(self, func, name=None):
+        super().remove_listener(func, name)
+        self.__listeners_changed(name or func.__name__)
+
+    async def wait_for(self, event, *, check=None, timeout=None):
+        name = "on_" + event
+        self.__waiting[name] = self.__waiting.get(name, 0) + 1
+        self.__listeners_changed(name)
+        try:
+            return await super().wait_for(event, check=check, timeout=timeout)
+        finally:
+            self.__waiting[name] -= 1
+            if not self.__waiting[name]:
+                del self.__waiting[name]
+            self.__listeners_changed(name)
+
+    def dispatch(self, event_name, *args, **kwargs):
+        super().dispatch(event_name, *args, **kwargs)
+        event = "on_" + event_name
+        for listener in self.router.listeners(event, *args):
+            self._schedule_event(listener, event, *args, **kwargs)
+
+    async def _run_event(self, coro, event_name, *args, **kwargs):
+        metrics = self.metrics
+        if not metrics.enabled:
+            return await super()._run_event(coro, event_name, *args, **kwargs)
+        metrics.listener_runs += 1
+        if metrics.listener_runs < metrics.listener_sample_every:
+            return await super()._run_event(coro, event_name, *args, **kwargs)
+        metrics.listener_runs = 0
+        # timed inside the task, a done callback would cost every event another turn of the loop
+        start = perf_counter()
+        try:
+            await super()._run_event(coro, event_name, *args, **kwargs)
+        finally:
+            cog = getattr(getattr(coro, "__self__", None), "qualified_name", None)
+            # the guild is only looked up when some guild's series are kept apart
+            guild_id = guild_id_of(*args) if metrics.tracking else 0
+            metrics.observe("listener", guild_id, cog, getattr(coro, "__name__", event_name),
+                            perf_counter() - start, metrics.listener_sample_every)
+
+    async def can_run(self, ctx, *, call_once=False):
+        # without any global checks there is nothing to time
+        if not self.metrics.enabled or not (self._check_once if call_once else self._checks):
+            return await super().can_run(ctx, call_once=call_once)
+        start = perf_counter()
+        try:
+            return await super().can_run(ctx, call_once=call_once)
+        finally:
+            self.metrics.observe("check", guild_id_of(ctx) if self.metrics.tracking else 0, None,
+                                 "bot_check_once" if call_once else "bot_check", perf_counter() - start)
+
+    async def invoke(self, ctx):
+        # someone is waiting for the reply, it goes before the requests of listeners and bulk work
+        with priority(INTERACTIVE):
+            if ctx.command is None or not self.metrics.enabled:
+                return await super().invoke(ctx)
+            start = perf_counter()
+            try:
+                await super().invoke(ctx)
+            finally:
+                command = ctx.command
+                # qualified_name joins the names of the parents on every call, most commands have none
+                name = command.name if command.parent is None else command.qualified_name
+                self.metrics.observe("command", guild_id_of(ctx) if self.metrics.tracking else 0,
+                                     command.cog_name, name, perf_counter() - start)
+
+
+class MyDiscordBot(RoutedBot):
     """
     Subclass of discord bot to override the behavior which blocks responses to other bots
     """
 
-    def __init__(self, guild, **options):
+    def __init__(self, guild, connection: Optional[ConnectionState] = None, **options):
+        """
+        :param guild: the guild this bot serves
+        :param connection: the connection state of the main bot, used instead of one of its own
+        """
+        # the client asks for its state while it is initialised
+        self.__shared_connection = connection
         super().__init__(**options)
+        if connection is not None:
+            self._connection = connection
         self.guild = guild
         self.key: typing.Optional[str] = None
+        self.parent: Optional[MainBot] = None
+        self.store: Optional[GuildStore] = None
+
+    def _get_state(self, **options):
+        if self.__shared_connection is None:
+            return super()._get_state(**options)
+        # a state of its own would be thrown away right after, and building one collects the garbage of the whole
+        # process
+        return SimpleNamespace()
 
     async def process_commands(self, message):
         ctx = await self.get_context(message)
@@ -31,36 +423,189 @@ class MyDiscordBot(commands.Bot):
         raise ValueError("A key must be supplied before the bot can be upgraded to premium")
 
 
-class MainBot(commands.Bot):
+class MainBot(RoutedBot):
 
-    def __init__(self, **options):
+    GUILD_EXTENSIONS: Tuple[str, ...] = ("AdminCommands", "SafetyChecks")
+    # where in the store the last time a guild sent a message is kept, (namespace, key)
+    ACTIVITY: Tuple[str, str] = ("MainBot", "last_active")
+    # the activity of a guild is written at most once per this many seconds
+    ACTIVITY_RESOLUTION = 60.0
+
+    def __init__(self, guild_bot_capacity: int = 1000, guild_bot_ttl: float = 3600.0,
+                 metrics_file: Optional[str] = "../metrics.prom", lazy_extensions: bool = True,
+                 warm_pool_size: int = 100, warm_batch_size: int = 10, **options):
+        """
+        :param guild_bot_capacity: the maximum amount of guild bots kept in memory
+        :param guild_bot_ttl: the amount of seconds a guild bot can be idle before it is hibernated
+        :param metrics_file: where the latency histograms are exported to for prometheus, None to not export them
+        :param lazy_extensions: whether guild bots create the cogs of their extensions only once they are used
+        :param warm_pool_size: the amount of most recently active guilds whose bots are built once the bot is ready
+        :param warm_batch_size: the amount of guild bots built at once while warming up
+        """
         super().__init__(**options)
-        self.__bots: Dict[discord.Guild, MyDiscordBot] = {}
+        self.lazy_guild_extensions = lazy_extensions
+        self.warm_pool_size = warm_pool_size
+        self.warm_batch_size = warm_batch_size
+        self.__warming: Optional[asyncio.Task] = None
+        # guild id -> the activity last written to the store
+        self.__active: Dict[int, float] = {}
+        self.store = GuildStore()
+        self.metrics_file = metrics_file
+        self.__exporting: Optional[asyncio.Task] = None
+        self.watchdog = LoopWatchdog()
+        # every guild bot shares this http client, so one guild must not be able to use it up
+        self.scheduler = HttpScheduler(self.__guild_of_route, metrics=self.metrics, shards=self.shard_count or 1)
+        self.scheduler.install(self.http)
+        self.outbox.scheduler = self.scheduler
+        self.templates = ExtensionTemplates()
+        self.fleet = FleetRollout(self)
+        self.registry = GuildBotRegistry(self.__create_guild_bot, capacity=guild_bot_capacity, ttl=guild_bot_ttl)
+        # event -> the guilds whose bot listens to it, so an event nobody listens to costs one lookup
+        self.__listening: Dict[str, Set[int]] = {}
 
-    async def process_commands(self, message):
-        guild: discord.Guild = message.guild
-        if guild in self.__bots:
-            ctx = await self.__bots[guild].get_context(message)
-            await self.__bots[guild].invoke(ctx)
-        elif guild is None:
-            await self.invoke(await self.get_context(message))
+    def __guild_bot_listeners_changed(self, bot: "MyDiscordBot", event: str) -> None:
+        guild_id = bot.guild.id
+        if self.registry.peek(guild_id) not in (None, bot):
+            # a bot which is being hibernated must not unlist its successor
+            return
+        listening = self.__listening.setdefault(event, set())
+        if bot.listens(event):
+            listening.add(guild_id)
         else:
-            bot = MyDiscordBot(message.guild, command_prefix="$")
+            listening.discard(guild_id)
+            if not listening:
+                del self.__listening[event]
+
+    def dispatch(self, event_name, *args, **kwargs):
+        super().dispatch(event_name, *args, **kwargs)
+        # messages reach the guild bots through process_commands, which wakes hibernated ones up first
+        listening = self.__listening.get("on_" + event_name)
+        if listening and event_name != "message":
+            guild_id = guild_id_of(*args)
+            if guild_id in listening:
+                bot = self.registry.peek(guild_id)
+                if bot is not None:
+                    bot.dispatch(event_name, *args, **kwargs)
+                else:
+                    # hibernated guilds stay listed for the events they listened to
+                    guild = self.get_guild(guild_id)
+                    if guild is not None:
+                        asyncio.ensure_future(self.__wake(guild, event_name, *args, **kwargs))
+
+    async def __wake(self, guild: discord.Guild, event_name: str, *args, **kwargs) -> None:
+        """
+        Restore the bot of a hibernated guild for an event it listened to and hand the event to it
+        """
+        bot = await self.registry.get(guild)
+        # the restored bot may not listen to the event any more, if it could not load an extension for example
+        self.__guild_bot_listeners_changed(bot, "on_" + event_name)
+        bot.dispatch(event_name, *args, **kwargs)
+
+    def __guild_of_route(self, route) -> int:
+        if route.guild_id is not None:
+            return int(route.guild_id)
+        if route.channel_id is not None:
+            channel = self._connection.get_channel(int(route.channel_id))
+            guild = getattr(channel, "guild", None)
+            if guild is not None:
+                return guild.id
+        return 0
+
+    def __create_guild_bot(self, guild: discord.Guild) -> MyDiscordBot:
+        # the new bot shares the connection and http handler of this one
+        bot = MyDiscordBot(guild, connection=self._connection, command_prefix="$")
+        bot.http = self.http
+        bot.owner_id = guild.owner_id
+        bot.parent = self
+        bot.store = self.store
+        bot.metrics = self.metrics
+        bot.outbox = self.outbox
+        bot.watchdog = self.watchdog
+        bot.scheduler = self.scheduler
+        bot.listeners_changed = self.__guild_bot_listeners_changed
+        bot.templates = self.templates
+        bot.lazy_extensions = self.lazy_guild_extensions
+
+        for extension in self.GUILD_EXTENSIONS:
+            bot.load_extension(extension)
+        return bot
+
+    async def on_ready(self):
+        # ready is dispatched again after every reconnect, the pool is warmed once
+        if self.__warming is None:
+            self.__warming = asyncio.ensure_future(self.warm_guild_bots())
 
-            # we have to copy the old connection and http handler over to the new bot
-            bot._connection = self._connection
-            bot.http = self.http
-            bot.owner_id = guild.owner_id
+    async def warm_guild_bots(self) -> None:
+        """
+        Build the bots of the most recently active guilds before their first message comes in, a batch at a time so
+        the events coming in meanwhile are not held up. The warm_pool gauges tell how far along it is.
+        """
+        start = perf_counter()
+        last_active: Dict[int, float] = await self.store.by_guild(*self.ACTIVITY)
+        guilds = sorted(self.guilds, key=lambda guild: last_active.get(guild.id, 0.0), reverse=True)
+        guilds = guilds[:min(self.warm_pool_size, self.registry.capacity)]
+        self.metrics.gauge("warm_pool_target", len(guilds))
+        self.metrics.gauge("warm_pool_ready", 0)
+        self.metrics.gauge("warm_pool_warm", 0)
+        ready = 0
+        for n in range(0, len(guilds), self.warm_batch_size):
+            batch = guilds[n:n + self.warm_batch_size]
+            ready += sum(await asyncio.gather(*(self.__warm_guild_bot(guild) for guild in batch)))
+            self.metrics.gauge("warm_pool_ready", ready)
+            # let the events which came in while the batch was built through
+            await asyncio.sleep(0)
+        self.metrics.gauge("warm_pool_seconds", perf_counter() - start)
+        self.metrics.gauge("warm_pool_warm", 1)
 
-            bot.load_extension("AdminCommands")
-            bot.load_extension("SafetyChecks")
-            self.__bots[guild] = bot
-            await bot.invoke(await bot.get_context(message))
+    async def __warm_guild_bot(self, guild: discord.Guild) -> bool:
+        """
+        :return: whether the guild's bot is alive and warmed up, a failed warm-up or a full registry leave it cold
+        """
+        try:
+            with self.metrics.time("warm_up", guild.id, None, "guild_bot"):
+                if await self.registry.warm(guild):
+                    bot = self.registry.peek(guild.id)
+                    await asyncio.gather(*(cog.warm_up() for cog in bot.cogs.values()
+                                           if isinstance(cog, NoConflictCog)))
+        except Exception as e:
+            print(f"Could not warm up the bot of {guild.id}: {e}")
+            return False
+        return guild.id in self.registry
 
+    async def start(self, *args, **kwargs):
+        if self.metrics_file is not None:
+            self.__exporting = asyncio.ensure_future(self.metrics.export(self.metrics_file))
+        self.watchdog.start()
+        await super().start(*args, **kwargs)
+
+    async def close(self):
+        if self.__exporting is not None:
+            self.__exporting.cancel()
+        if self.__warming is not None:
+            self.__warming.cancel()
+        self.watchdog.stop()
+        await super().close()
+        await self.registry.close()
+        await self.store.close()
+
+    async def process_commands(self, message):
+        guild: discord.Guild = message.guild
+        if guild is None:
+            await self.invoke(await self.get_context(message))
+        else:
+            now = time()
+            if now - self.__active.get(guild.id, 0.0) >= self.ACTIVITY_RESOLUTION:
+                # which guilds were active last decides whose bots are warmed up after a restart
+                self.__active[guild.id] = now
+                self.store.set((guild.id,) + self.ACTIVITY, now)
+            bot = await self.registry.get(guild)
+            # the guild's bot processes its commands itself and its listeners hear the message too
+            bot.dispatch("message", message)
 
-client = MainBot(command_prefix="$")
 
-client.load_extension("AdminCommands")
-client.load_extension("SafetyChecks")
-client.run(sys.argv[1])
+if __name__ == "__main__":
+    client = MainBot(command_prefix="$")
 
+    client.load_extension("AdminCommands")
+    client.load_extension("SafetyChecks")
+    client.run(sys.argv[1])
@@ -0,0 +1,304 @@
+import asyncio
+import itertools
+import time
+import weakref
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Any, List, Iterable, Optional, Iterator, Callable
+
+import discord.client
+from discord import ClientUser
+from discord.http import HTTPClient, Route
+from discord.ext import commands
+
+# milliseconds since the first second of 2015, the epoch of discord's snowflakes
+DISCORD_EPOCH = 1420070400000
+
+
+def make_snowflake(sequence: int, timestamp: Optional[float] = None) -> int:
+    """
+    Build a snowflake which sorts and shards like a real one
+    :param sequence: distinguishes snowflakes made within the same millisecond
+    :param timestamp: the unix time the snowflake was made at, defaults to now
+    """
+    timestamp = time.time() if timestamp is None else timestamp
+    return ((int(timestamp * 1000) - DISCORD_EPOCH) << 22) | (sequence & 0x3FFFFF)
+
+
+class FakeHTTPClient(HTTPClient):
+    """
+    A stand-in for discord's REST api which answers every request locally. Requests are counted by route so that the
+    amount of work the bot asked of discord can be compared between runs.
+    """
+
+    def __init__(self, gateway: "FakeGateway", loop=None, latency: float = 0.0):
+        """
+        :param latency: seconds every request takes to be answered
+        """
+        super().__init__(loop=loop)
+        self.gateway = gateway
+        self.latency = latency
+        self.requests: Counter = Counter()
+        self.__ids = itertools.count()
+
+    async def request(self, route: Route, *, files=None, form=None, **kwargs):
+        self.requests[(route.method, route.path)] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        payload: Dict[str, Any] = kwargs.get("json") or {}
+        segments = route.url[len(Route.BASE):].split("/")
+
+        if route.method == "GET" and route.path == "/users/{user_id}":
+            return self.gateway.user_payload(int(segments[-1]))
+        if route.method == "POST" and route.path == "/channels/{channel_id}/messages":
+            return self.gateway.message_payload(
+                guild_id=self.gateway.guild_of(route.channel_id),
+                channel_id=route.channel_id,
+                author_id=self.gateway.bot_id,
+                content=payload.get("content") or "",
+                embeds=[payload["embed"]] if payload.get("embed") else [],
+            )
+        if route.method == "PATCH" and route.path == "/channels/{channel_id}/messages/{message_id}":
+            return self.gateway.message_payload(
+                guild_id=self.gateway.guild_of(route.channel_id),
+                channel_id=route.channel_id,
+                author_id=self.gateway.bot_id,
+                content=payload.get("content") or "",
+                message_id=int(segments[-1]),
+            )
+        if route.method == "POST" and route.path == "/guilds/{guild_id}/roles":
+            role = self.gateway.role_payload(make_snowflake(next(self.__ids)), payload.get("name", "new role"))
+            # discord follows up with a GUILD_ROLE_CREATE event
+            self.gateway.client._connection.parse_guild_role_create({"guild_id": str(route.guild_id), "role": role})
+            return role
+        if route.method == "GET" and route.path == "/channels/{channel_id}/messages":
+            return []
+        return None
+
+    async def static_login(self, token, *, bot):
+        return self.gateway.user_payload(self.gateway.bot_id, bot=True)
+
+    async def close(self):
+        pass
+
+
+class CollectedTasks(list):
+    """
+    The tasks started by the events fed in FakeGateway.collect_tasks, along with the tasks those started in turn
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        super().__init__()
+        self.__loop = loop
+        # resolves to the loop time at which the last of the tasks finished
+        self.finished: asyncio.Future = loop.create_future()
+
+    def add(self, task: asyncio.Task) -> None:
+        self.append(task)
+        task.add_done_callback(self.__done)
+
+    def close(self) -> None:
+        """
+        No more events are fed, if none of them started a task the collection is finished right away
+        """
+        self.__done(None)
+
+    def __done(self, _) -> None:
+        if not self.finished.done() and all(task.done() for task in self):
+            self.finished.set_result(self.__loop.time())
+
+
+_ClientEventTask = discord.client._ClientEventTask
+
+
+class _CollectedEventTask(_ClientEventTask):
+    """
+    discord.py creates the tasks of event handlers itself, past the loop's task factory. This takes its place while
+    tasks are collected.
+    """
+    track: Optional[Callable[[asyncio.Task], None]] = None
+    # the collections which may still get tasks, discord.py gets its own class back once there are none
+    collections = 0
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if _CollectedEventTask.track is not None:
+            _CollectedEventTask.track(self)
+
+    @staticmethod
+    def acquire(track: Callable[[asyncio.Task], None]) -> None:
+        _CollectedEventTask.collections += 1
+        _CollectedEventTask.track = track
+        discord.client._ClientEventTask = _CollectedEventTask
+
+    @staticmethod
+    def release(_=None) -> None:
+        _CollectedEventTask.collections -= 1
+        if _CollectedEventTask.collections == 0:
+            _CollectedEventTask.track = None
+            discord.client._ClientEventTask = _ClientEventTask
+
+
+class FakeGateway:
+    """
+    A local stand-in for the discord gateway. Guilds are created directly in the client's cache and message events
+    are fed through the client's connection state exactly as they would be when they arrive from the websocket.
+    """
+
+    def __init__(self, client: commands.Bot):
+        self.client = client
+        self.bot_id = make_snowflake(0)
+        self.__ids = itertools.count(1)
+        self.__channel_guilds: Dict[int, int] = {}
+        # the tasks created while events are fed inside collect_tasks
+        self.__collected: Optional[CollectedTasks] = None
+        # task -> the collection it belongs to, so the tasks it starts join it
+        self.__collections: "weakref.WeakKeyDictionary[asyncio.Task, CollectedTasks]" = weakref.WeakKeyDictionary()
+
+        self.http = FakeHTTPClient(self, loop=client.loop)
+        client.http = self.http
+        client._connection.http = self.http
+        scheduler = getattr(client, "scheduler", None)
+        if scheduler is not None:
+            # requests are still scheduled fairly, but there is no global rate limit to stay under
+            scheduler.rate = float("inf")
+            scheduler.install(self.http)
+        client._connection.user = ClientUser(state=client._connection, data=self.user_payload(self.bot_id, bot=True))
+
+    def next_id(self) -> int:
+        return make_snowflake(next(self.__ids))
+
+    def guild_of(self, channel_id: int) -> Optional[int]:
+        return self.__channel_guilds.get(channel_id)
+
+    @staticmethod
+    def user_payload(user_id: int, bot: bool = False) -> Dict[str, Any]:
+        return {
+            "id": str(user_id),
+            "username": f"user{user_id % 10000}",
+            "discriminator": f"{user_id % 10000:04}",
+            "avatar": None,
+            "bot": bot,
+        }
+
+    @staticmethod
+    def role_payload(role_id: int, name: str) -> Dict[str, Any]:
+        return {"id": str(role_id), "name": name, "permissions": "0", "position": 0, "color": 0, "hoist": False,
+                "managed": False, "mentionable": False}
+
+    def add_guild(self, guild_id: int, owner_id: int, channels: int = 1) -> List[int]:
+        """
+        Add a guild to the client's cache
+        :param guild_id: the id of the guild
+        :param owner_id: the id of the owner of the guild
+        :param channels: how many text channels to make in the guild
+        :return: the ids of the guild's text channels
+        """
+        channel_ids = [self.next_id() for _ in range(channels)]
+        for channel_id in channel_ids:
+            self.__channel_guilds[channel_id] = guild_id
+        self.client._connection._add_guild_from_data({
+            "id": str(guild_id),
+            "name": f"guild{guild_id % 10000}",
+            "owner_id": str(owner_id),
+            "member_count": 2,
+            "roles": [self.role_payload(guild_id, "@everyone")],
+            "channels": [
+                {"id": str(channel_id), "type": 0, "name": f"channel{n}", "position": n}
+                for n, channel_id in enumerate(channel_ids)
+            ],
+            "members": [],
+            "emojis": [],
+        })
+        return channel_ids
+
+    def message_payload(self, guild_id: Optional[int], channel_id: int, author_id: int, content: str,
+                        embeds: Iterable[Dict[str, Any]] = (), message_id: Optional[int] = None) -> Dict[str, Any]:
+        data = {
+            "id": str(message_id or self.next_id()),
+            "channel_id": str(channel_id),
+            "author": self.user_payload(author_id, bot=author_id == self.bot_id),
+            "content": content,
+            "timestamp": "2020-01-01T00:00:00+00:00",
+            "edited_timestamp": None,
+            "tts": False,
+            "mention_everyone": False,
+            "mentions": [],
+            "mention_roles": [],
+            "attachments": [],
+            "embeds": list(embeds),
+            "pinned": False,
+            "type": 0,
+        }
+        if guild_id is not None:
+            data["guild_id"] = str(guild_id)
+            data["member"] = {"roles": [], "joined_at": "2020-01-01T00:00:00+00:00", "deaf": False, "mute": False}
+        return data
+
+    def send_message(self, guild_id: int, channel_id: int, author_id: int, content: str) -> int:
+        """
+        Feed a MESSAGE_CREATE event to the client
+        :return: the id of the new message
+        """
+        payload = self.message_payload(guild_id, channel_id, author_id, content)
+        self.client._connection.parse_message_create(payload)
+        return int(payload["id"])
+
+    def add_reaction(self, guild_id: int, channel_id: int, message_id: int, user_id: int, emoji: str = "👍") -> None:
+        """
+        Feed a MESSAGE_REACTION_ADD event to the client, the rich reaction_add event is only dispatched when the
+        message is still in the client's message cache
+        """
+        self.client._connection.parse_message_reaction_add({
+            "user_id": str(user_id),
+            "channel_id": str(channel_id),
+            "message_id": str(message_id),
+            "guild_id": str(guild_id),
+            "emoji": {"id": None, "name": emoji},
+            "member": {"user": self.user_payload(user_id), "roles": [], "joined_at": "2020-01-01T00:00:00+00:00",
+                       "deaf": False, "mute": False},
+        })
+
+    @contextmanager
+    def collect_tasks(self) -> Iterator[CollectedTasks]:
+        """
+        Collect the tasks the client creates while the block runs, i.e. the handlers of the events fed in it, and
+        every task those handlers start
+        """
+        loop = asyncio.get_event_loop()
+        if loop.get_task_factory() is None:
+            def factory(factory_loop, coro, **kwargs):
+                task = asyncio.Task(coro, loop=factory_loop, **kwargs)
+                self.__track(task)
+                return task
+            loop.set_task_factory(factory)
+        _CollectedEventTask.acquire(self.__track)
+        self.__collected = collected = CollectedTasks(loop)
+        try:
+            yield collected
+        finally:
+            self.__collected = None
+            # the handlers started in the block can still dispatch events, those are collected until all of them are
+            # done and then discord.py's own task class is put back
+            collected.finished.add_done_callback(_CollectedEventTask.release)
+            collected.close()
+
+    def __track(self, task: asyncio.Task) -> None:
+        collected = self.__collected
+        if collected is None:
+            parent = asyncio.current_task(task.get_loop())
+            collected = self.__collections.get(parent) if parent is not None else None
+        if collected is not None:
+            collected.add(task)
+            self.__collections[task] = collected
+
+    async def drain(self) -> None:
+        """
+        Wait until every event handler started by the events fed so far has finished
+        """
+        current = asyncio.current_task()
+        while True:
+            pending = [task for task in asyncio.all_tasks() if task is not current and not task.done()]
+            if not pending:
+                return
+            await asyncio.wait(pending)
@@ -0,0 +1,119 @@
+"""
+A local HTTP server answering like the discord API does as far as rate limits go. Every channel or guild has a bucket
+of bucket_limit requests per bucket_period seconds, everything together is limited to global_limit requests per
+second, and exhausted limits are answered with 429 and the headers discord sends, so discord.py's own rate limit
+handling runs against it unchanged.
+"""
+import asyncio
+import itertools
+import json
+import time
+from typing import Dict, List, Tuple, Any
+
+from aiohttp import web
+
+
+class FakeDiscordServer:
+
+    def __init__(self, bucket_limit: int = 5, bucket_period: float = 1.0, global_limit: int = 50,
+                 latency: float = 0.005):
+        """
+        :param latency: seconds every response is delayed by
+        """
+        self.bucket_limit = bucket_limit
+        self.bucket_period = bucket_period
+        self.global_limit = global_limit
+        self.latency = latency
+        # bucket -> (requests left, when it resets)
+        self.__buckets: Dict[str, Tuple[int, float]] = {}
+        self.__global: Tuple[int, float] = (global_limit, 0.0)
+        self.__ids = itertools.count(1)
+        self.__runner = None
+        # (time, method, path, status) of every request
+        self.log: List[Tuple[float, str, str, int]] = []
+        self.url = ""
+
+    async def start(self, port: int = 0) -> str:
+        """
+        :return: the url to put in front of the api paths
+        """
+        app = web.Application()
+        app.router.add_route("*", "/api/v7/{tail:.*}", self.__handle)
+        self.__runner = web.AppRunner(app)
+        await self.__runner.setup()
+        site = web.TCPSite(self.__runner, "127.0.0.1", port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}/api/v7"
+        return self.url
+
+    async def stop(self) -> None:
+        if self.__runner is not None:
+            await self.__runner.cleanup()
+
+    @staticmethod
+    def bucket_of(method: str, path: str) -> str:
+        # like discord, the channel or guild id is part of the bucket and other ids are not
+        segments = path.strip("/").split("/")
+        return f"{method} {'/'.join(segments[:2])}"
+
+    def __limit(self, bucket: str, now: float) -> Tuple[bool, Dict[str, str], Dict[str, Any]]:
+        remaining, resets = self.__global
+        if now >= resets:
+            remaining, resets = self.global_limit, now + 1.0
+        if remaining <= 0:
+            retry = resets - now
+            return False, {"Retry-After": str(retry), "X-RateLimit-Global": "true"}, \
+                {"message": "You are being rate limited.", "retry_after": retry * 1000, "global": True}
+        self.__global = (remaining - 1, resets)
+
+        remaining, resets = self.__buckets.get(bucket, (self.bucket_limit, 0.0))
+        if now >= resets:
+            remaining, resets = self.bucket_limit, now + self.bucket_period
+        if remaining <= 0:
+            retry = resets - now
+            return False, {"Retry-After": str(retry)}, \
+                {"message": "You are being rate limited.", "retry_after": retry * 1000, "global": False}
+        remaining -= 1
+        self.__buckets[bucket] = (remaining, resets)
+        return True, {
+            "X-RateLimit-Limit": str(self.bucket_limit),
+            "X-RateLimit-Remaining": str(remaining),
+            "X-RateLimit-Reset": f"{time.time() + resets - now:.3f}",
+            "X-RateLimit-Reset-After": f"{resets - now:.3f}",
+            "X-RateLimit-Bucket": bucket,
+        }, {}
+
+    async def __handle(self, request: web.Request) -> web.Response:
+        path = "/" + request.match_info["tail"]
+        now = time.monotonic()
+        allowed, headers, error = self.__limit(self.bucket_of(request.method, path), now)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        # discord.py takes a 429 without this header for a cloudflare ban
+        headers["Via"] = "1.1 google"
+        if not allowed:
+            self.log.append((now, request.method, path, 429))
+            return self.__json(error, 429, headers)
+        self.log.append((now, request.method, path, 200))
+        if request.method == "DELETE":
+            return web.Response(status=204, headers=headers)
+        return self.__json(self.__payload(request.method, path), 200, headers)
+
+    @staticmethod
+    def __json(data: Dict[str, Any], status: int, headers: Dict[str, str]) -> web.Response:
+        # discord.py only decodes a body whose content type is exactly application/json, without a charset
+        headers["Content-Type"] = "application/json"
+        return web.Response(body=json.dumps(data).encode(), status=status, headers=headers)
+
+    def __payload(self, method: str, path: str) -> Dict[str, Any]:
+        if path == "/users/@me":
+            return {"id": "1", "username": "bot", "discriminator": "0000", "avatar": None, "bot": True}
+        segments = path.strip("/").split("/")
+        if method == "POST" and segments[0] == "channels" and segments[-1] == "messages":
+            return {"id": str(next(self.__ids)), "channel_id": segments[1], "content": "", "embeds": [],
+                    "attachments": [], "mentions": [], "mention_roles": [], "pinned": False, "tts": False,
+                    "mention_everyone": False, "type": 0, "timestamp": "2020-01-01T00:00:00+00:00",
+                    "edited_timestamp": None,
+                    "author": {"id": "1", "username": "bot", "discriminator": "0000", "avatar": None, "bot": True}}
+        return {}
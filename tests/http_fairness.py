@@ -0,0 +1,95 @@
+"""
+Sends the requests of one guild bulk deleting in many channels and of many quiet guilds replying to commands through
+discord.py's http client against fake_discord_server.py, with and without the HttpScheduler in front, and reports
+how long the quiet guilds waited as JSON.
+
+    python tests/http_fairness.py
+    python tests/http_fairness.py --noisy 600 --quiet-guilds 50
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from os import path
+from typing import Dict, Any, List
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), "..", "src"))
+sys.path.insert(0, path.dirname(path.abspath(__file__)))
+
+from discord.http import HTTPClient, Route
+
+from HttpScheduler import HttpScheduler, priority, BULK, INTERACTIVE
+from fake_discord_server import FakeDiscordServer
+
+NOISY_GUILD = 1
+# guild g owns the channels g * 100 up to g * 100 + 99
+CHANNELS_PER_GUILD = 100
+
+
+def guild_of(route: Route) -> int:
+    if route.guild_id is not None:
+        return int(route.guild_id)
+    return int(route.channel_id) // CHANNELS_PER_GUILD if route.channel_id is not None else 0
+
+
+def percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+async def run(scheduled: bool, noisy: int, noisy_channels: int, quiet_guilds: int, replies: int) -> Dict[str, Any]:
+    server = FakeDiscordServer()
+    Route.BASE = await server.start()
+    http = HTTPClient()
+    await http.static_login("token", bot=True)
+    if scheduled:
+        HttpScheduler(guild_of).install(http)
+
+    async def purge(n: int) -> None:
+        with priority(BULK):
+            channel = NOISY_GUILD * CHANNELS_PER_GUILD + n % noisy_channels
+            await http.delete_messages(channel, [n * 2, n * 2 + 1])
+
+    quiet: List[float] = []
+
+    async def reply(guild: int, n: int) -> None:
+        # replies trickle in while the purge is going on
+        await asyncio.sleep(0.5 * n + 0.05 * guild)
+        with priority(INTERACTIVE):
+            start = time.perf_counter()
+            await http.send_message(guild * CHANNELS_PER_GUILD, f"reply {n}")
+            quiet.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    noisy_tasks = [asyncio.ensure_future(purge(n)) for n in range(noisy)]
+    await asyncio.gather(*(reply(guild, n) for guild in range(2, quiet_guilds + 2) for n in range(replies)))
+    quiet_done = time.perf_counter() - start
+    await asyncio.gather(*noisy_tasks)
+    noisy_done = time.perf_counter() - start
+
+    await http.close()
+    await server.stop()
+    return {
+        "quiet_p50_ms": round(percentile(quiet, 0.5) * 1000, 1),
+        "quiet_p99_ms": round(percentile(quiet, 0.99) * 1000, 1),
+        "quiet_max_ms": round(max(quiet) * 1000, 1),
+        "quiet_done_s": round(quiet_done, 2),
+        "noisy_done_s": round(noisy_done, 2),
+        "rate_limited": sum(1 for entry in server.log if entry[3] == 429),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare how long quiet guilds wait behind a noisy one")
+    parser.add_argument("--noisy", type=int, default=300, help="how many bulk deletes the noisy guild makes")
+    parser.add_argument("--noisy-channels", type=int, default=20, help="how many channels it deletes in")
+    parser.add_argument("--quiet-guilds", type=int, default=10)
+    parser.add_argument("--replies", type=int, default=3, help="how many replies every quiet guild sends")
+    arguments = parser.parse_args()
+
+    report = {}
+    for name, scheduled in (("unscheduled", False), ("scheduled", True)):
+        report[name] = asyncio.get_event_loop().run_until_complete(
+            run(scheduled, arguments.noisy, arguments.noisy_channels, arguments.quiet_guilds, arguments.replies))
+    print(json.dumps(report, indent=2, sort_keys=True))
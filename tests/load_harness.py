@@ -0,0 +1,215 @@
+"""
+Feeds a stream of messages and reactions spread over many guilds through MainBot and a fake gateway, then reports
+throughput, latency and memory as JSON which can be compared between commits.
+
+    python tests/load_harness.py --guilds 1000 --events 20000
+    python tests/load_harness.py --record stream.jsonl
+    python tests/load_harness.py --replay stream.jsonl --rate 2000
+    python tests/load_harness.py --extensions TimeExtension,GuildExtension --eager
+    python tests/load_harness.py --warm
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import tracemalloc
+from contextlib import redirect_stdout
+from os import path, getcwd, chdir, makedirs
+from tempfile import TemporaryDirectory
+from typing import Dict, Any, List, Tuple
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), "..", "src"))
+
+from FakeGateway import FakeGateway, make_snowflake
+
+# what members of the simulated guilds say, commands as well as plain chatter
+CONTENTS = [
+    "$loaded_extensions",
+    "$available_commands",
+    "anyone up for a raid at 8:30 EST?",
+    "meet at 10:30 UTC sharp",
+    "gg",
+    "lol that was close",
+    "does anyone know how to get to the second boss",
+]
+
+
+def synthetic_events(guilds: int, events: int, reactions: float, seed: int) -> List[Dict[str, Any]]:
+    """
+    A deterministic stream of events, guilds, channels, authors and messages are referred to by index
+    :param reactions: the share of events which are reactions to a recent message of the same guild
+    """
+    rng = random.Random(seed)
+    stream: List[Dict[str, Any]] = []
+    recent: Dict[int, List[int]] = {}
+    for n in range(events):
+        guild = rng.randrange(guilds)
+        if recent.get(guild) and rng.random() < reactions:
+            stream.append({"type": "reaction", "guild": guild, "message": rng.choice(recent[guild]),
+                           "user": rng.randrange(20)})
+        else:
+            content = rng.choice(CONTENTS)
+            # commands are left to the owner, author 0, everyone else would just be turned down by AdminCommands
+            author = 0 if content.startswith("$") else rng.randrange(1, 20)
+            stream.append({"type": "message", "guild": guild, "channel": rng.randrange(2), "author": author,
+                           "content": content})
+            # only react to messages which would still be in the client's message cache
+            recent[guild] = (recent.get(guild, []) + [n])[-3:]
+    return stream
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[int(q * (len(ordered) - 1))] if ordered else 0.0
+
+
+async def measure(stream: List[Dict[str, Any]], guilds: int, rate: float, capacity: int,
+                  extensions: Tuple[str, ...], eager: bool, warm: bool) -> Dict[str, Any]:
+    from bot import MainBot
+
+    client = MainBot(command_prefix="$", guild_bot_capacity=capacity, lazy_extensions=not eager,
+                     warm_pool_size=guilds if warm else 0)
+    client.GUILD_EXTENSIONS = MainBot.GUILD_EXTENSIONS + extensions
+    gateway = FakeGateway(client)
+    client.load_extension("AdminCommands")
+    client.load_extension("SafetyChecks")
+    guild_ids = [make_snowflake(n, timestamp=1600000000 + n) for n in range(guilds)]
+    channels = {guild_id: gateway.add_guild(guild_id, owner_id=guild_id + 1, channels=2) for guild_id in guild_ids}
+
+    def user(guild: int, index: int) -> int:
+        return guild_ids[guild] + 1 + index
+
+    loop = asyncio.get_event_loop()
+
+    # like after a restart, the bots of the guilds are built before their first message if they are warmed up
+    await client.warm_guild_bots()
+    await gateway.drain()
+    warm_up = client.metrics.gauges()["warm_pool_seconds"]
+
+    # how long the first message of a guild takes, its bot is built while it waits unless it was warmed up
+    first_latencies: List[float] = []
+    for guild_id in guild_ids:
+        fed = loop.time()
+        with gateway.collect_tasks() as tasks:
+            gateway.send_message(guild_id, channels[guild_id][0], guild_id + 1, "$loaded_extensions")
+        first_latencies.append(await tasks.finished - fed)
+    await gateway.drain()
+    for guild_id in guild_ids:
+        await client.registry.hibernate(guild_id)
+
+    # the memory a guild costs once its bot has been woken up by a first message
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for guild_id in guild_ids:
+        gateway.send_message(guild_id, channels[guild_id][0], guild_id + 1, "$loaded_extensions")
+    await gateway.drain()
+    memory_per_guild = (tracemalloc.get_traced_memory()[0] - before) / guilds
+    tracemalloc.stop()
+    gateway.http.requests.clear()
+
+    latencies: List[float] = []
+    # the index of a message event -> (message id, channel id)
+    sent: Dict[int, Tuple[int, int]] = {}
+    messages = reactions = 0
+
+    start = loop.time()
+    for n, event in enumerate(stream):
+        if rate:
+            delay = start + n / rate - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        guild_id = guild_ids[event["guild"]]
+        fed = loop.time()
+        with gateway.collect_tasks() as tasks:
+            if event["type"] == "message":
+                channel_id = channels[guild_id][event["channel"]]
+                message_id = gateway.send_message(guild_id, channel_id, user(event["guild"], event["author"]),
+                                                  event["content"])
+                sent[n] = (message_id, channel_id)
+                messages += 1
+            else:
+                message_id, channel_id = sent[event["message"]]
+                gateway.add_reaction(guild_id, channel_id, message_id, user(event["guild"], event["user"]))
+                reactions += 1
+        if tasks:
+            # the handlers of the event, and whatever they started, e.g. the guild bot's own handlers
+            tasks.finished.add_done_callback(lambda finished, fed=fed: latencies.append(finished.result() - fed))
+        else:
+            latencies.append(loop.time() - fed)
+        # let the handlers run as they would between two websocket frames
+        await asyncio.sleep(0)
+    await gateway.drain()
+    elapsed = loop.time() - start
+    bots = list(client.registry)
+    # extensions of live guild bots which were loaded lazily and never used
+    never_created = sum(len(bot.lazy_pending) for bot in bots)
+    await client.close()
+
+    return {
+        "guilds": guilds,
+        "events": len(stream),
+        "messages": messages,
+        "reactions": reactions,
+        "seconds": round(elapsed, 3),
+        "events_per_second": round(len(stream) / elapsed, 1),
+        "latency_p50_ms": round(percentile(latencies, 0.5) * 1000, 3),
+        "latency_p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "warm_up_seconds": round(warm_up, 3),
+        "first_message_p50_ms": round(percentile(first_latencies, 0.5) * 1000, 3),
+        "first_message_p99_ms": round(percentile(first_latencies, 0.99) * 1000, 3),
+        "extensions_never_created": never_created,
+        "extensions_loaded": sum(len(bot.extensions) for bot in bots),
+        "memory_per_guild_kb": round(memory_per_guild / 1024, 1),
+        "http_requests": sum(gateway.http.requests.values()),
+        "guild_bots": len(client.registry),
+    }
+
+
+def run(stream: List[Dict[str, Any]], guilds: int, rate: float, capacity: int, extensions: Tuple[str, ...] = (),
+        eager: bool = False, warm: bool = False) -> Dict[str, Any]:
+    previous = getcwd()
+    with TemporaryDirectory() as directory:
+        # the bot keeps its files next to its working directory
+        makedirs(path.join(directory, "bot"))
+        chdir(path.join(directory, "bot"))
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            return loop.run_until_complete(measure(stream, guilds, rate, capacity, extensions, eager, warm))
+        finally:
+            loop.close()
+            chdir(previous)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the bot against a fake gateway")
+    parser.add_argument("--guilds", type=int, default=1000)
+    parser.add_argument("--events", type=int, default=20000)
+    parser.add_argument("--reactions", type=float, default=0.2, help="the share of events which are reactions")
+    parser.add_argument("--rate", type=float, default=0, help="events fed per second, 0 feeds as fast as possible")
+    parser.add_argument("--capacity", type=int, default=1000, help="the amount of guild bots kept in memory")
+    parser.add_argument("--extensions", default="",
+                        help="comma separated extensions every guild bot loads besides the default ones")
+    parser.add_argument("--eager", action="store_true", help="create the cogs of every extension right away")
+    parser.add_argument("--warm", action="store_true", help="build every guild's bot before its first message")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--record", metavar="FILE", help="write the synthetic stream to a file instead of running it")
+    parser.add_argument("--replay", metavar="FILE", help="run a recorded stream instead of a synthetic one")
+    arguments = parser.parse_args()
+
+    if arguments.replay:
+        with open(arguments.replay) as f:
+            events = [json.loads(line) for line in f if line.strip()]
+        arguments.guilds = max(event["guild"] for event in events) + 1
+    else:
+        events = synthetic_events(arguments.guilds, arguments.events, arguments.reactions, arguments.seed)
+    if arguments.record:
+        with open(arguments.record, "w") as f:
+            f.writelines(json.dumps(event, sort_keys=True) + "\n" for event in events)
+    else:
+        # whatever the bot prints must not end up in the report
+        with redirect_stdout(sys.stderr):
+            report = run(events, arguments.guilds, arguments.rate, arguments.capacity,
+                         tuple(filter(None, arguments.extensions.split(","))), arguments.eager, arguments.warm)
+        print(json.dumps(report, indent=2, sort_keys=True))
@@ -0,0 +1,129 @@
+"""
+Replays a stream of command messages on 1 to --shards worker processes, every shard running MainBot against its own
+fake gateway, and prints the throughput of every shard count along with how close it comes to scaling linearly.
+
+    python tests/shard_replay.py 20000
+    python tests/shard_replay.py 20000 --guilds 100 --shards 4
+    python tests/shard_replay.py 20000 --min-efficiency 0.7
+"""
+import argparse
+import asyncio
+import multiprocessing
+import queue
+import sys
+import time
+from os import path
+from typing import Dict, List, Tuple, Sequence
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), "..", "src"))
+sys.path.insert(0, path.dirname(path.abspath(__file__)))
+
+from FakeGateway import FakeGateway, make_snowflake
+from ShardRunner import ShardSupervisor, shard_for
+
+# (guild id, channel index, author id, content)
+MessageEvent = Tuple[int, int, int, str]
+
+
+def replay_shard(shard_id: int, shard_count: int, events: Sequence[MessageEvent], results) -> None:
+    """
+    Run one shard of the bot against a fake gateway, replaying the events which belong to this shard
+    :param results: a queue the amount of events replayed and the time it took are put on
+    """
+    from bot import MainBot
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    async def replay() -> Tuple[int, float]:
+        client = MainBot(command_prefix="$")
+        gateway = FakeGateway(client)
+        channels: Dict[int, List[int]] = {}
+        owned = [event for event in events if shard_for(event[0], shard_count) == shard_id]
+        for guild_id, channel, _, _ in owned:
+            if guild_id not in channels:
+                channels[guild_id] = gateway.add_guild(guild_id, owner_id=guild_id + 1, channels=channel + 1)
+        start = time.perf_counter()
+        for guild_id, channel, author_id, content in owned:
+            gateway.send_message(guild_id, channels[guild_id][channel], author_id, content)
+            # let the handlers run as they would between two websocket frames
+            await asyncio.sleep(0)
+        await gateway.drain()
+        return len(owned), time.perf_counter() - start
+
+    try:
+        results.put((shard_id,) + loop.run_until_complete(replay()))
+    finally:
+        loop.close()
+
+
+def synthetic_events(guilds: int, messages: int) -> List[MessageEvent]:
+    """
+    A deterministic stream of command messages spread evenly over the given amount of guilds
+    """
+    guild_ids = [make_snowflake(n, timestamp=1600000000 + n) for n in range(guilds)]
+    return [(guild_ids[n % guilds], 0, guild_ids[n % guilds] + 2, "$loaded_extensions") for n in range(messages)]
+
+
+def replay(events: Sequence[MessageEvent], shard_count: int, timeout: float = 600.0) -> Dict[str, float]:
+    """
+    Replay the events on shard_count worker processes
+    :param timeout: seconds after which shards which are still replaying are terminated
+    :return: the throughput of the run in messages per second
+    :raises RuntimeError: if a shard crashed or timed out, its results would be missing
+    """
+    results = multiprocessing.Queue()
+    supervisor = ShardSupervisor(replay_shard, shard_count, args=(events, results), max_restarts=0)
+    supervisor.supervise(timeout=timeout)
+    # every shard has exited, the results which were put on the queue are on their way already
+    totals = []
+    for _ in range(shard_count):
+        try:
+            totals.append(results.get(timeout=5.0))
+        except queue.Empty:
+            break
+    missing = set(range(shard_count)) - {shard_id for shard_id, _, _ in totals}
+    if missing:
+        raise RuntimeError(f"Shards {', '.join(map(str, sorted(missing)))} crashed or timed out before reporting")
+    replayed = sum(count for _, count, _ in totals)
+    # shards run in parallel, so the run took as long as the slowest shard
+    elapsed = max(duration for _, _, duration in totals)
+    return {"shards": shard_count, "messages": replayed, "seconds": elapsed, "throughput": replayed / elapsed}
+
+
+def scaling(events: Sequence[MessageEvent], max_shards: int) -> List[Dict[str, float]]:
+    """
+    Replay the events on 1 to max_shards shards
+    :return: the results of every run, with its speedup over a single shard and that speedup divided by the amount of
+    shards, 1.0 being linear scaling
+    """
+    runs = []
+    for count in range(1, max_shards + 1):
+        run = replay(events, count)
+        run["speedup"] = run["throughput"] / runs[0]["throughput"] if runs else 1.0
+        run["efficiency"] = run["speedup"] / count
+        runs.append(run)
+    return runs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay synthetic messages on several shard processes")
+    parser.add_argument("messages", type=int, help="the amount of messages to replay")
+    parser.add_argument("--shards", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--guilds", type=int, default=1000)
+    parser.add_argument("--min-efficiency", type=float, default=None,
+                        help="fail if a shard count up to the amount of cores scales less linearly than this")
+    arguments = parser.parse_args()
+
+    load = synthetic_events(arguments.guilds, arguments.messages)
+    results = scaling(load, arguments.shards)
+    for result in results:
+        print(result)
+    if arguments.min_efficiency is not None:
+        # past the amount of cores the shards share them, no scaling is expected there
+        slow = [result for result in results[:multiprocessing.cpu_count()]
+                if result["efficiency"] < arguments.min_efficiency]
+        for result in slow:
+            print(f"{result['shards']} shards scale at {result['efficiency']:.2f} of linear, "
+                  f"below {arguments.min_efficiency}")
+        sys.exit(1 if slow else 0)
@@ -0,0 +1,98 @@
+"""
+Caching and batching of the GuildStore
+
+    python -m pytest tests/test_guild_store.py
+"""
+import asyncio
+import sys
+from os import path
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), "..", "src"))
+
+from GuildStore import GuildStore
+
+
+def run(tmp_path, scenario, **options):
+    async def main():
+        store = GuildStore(str(tmp_path / "state.sqlite3"), **options)
+        try:
+            return await scenario(store)
+        finally:
+            await store.close()
+    return asyncio.run(main())
+
+
+def test_namespaces_are_read_once(tmp_path):
+    async def scenario(store):
+        store.set((1, "Cog", "a"), 1)
+        await store.flush()
+        first = await store.items(1, "Cog")
+        second = await store.namespace(1, "Cog").items()
+        value = await store.get((1, "Cog", "a"))
+        return first, second, value, store.misses, store.hits
+
+    assert run(tmp_path, scenario) == ({"a": 1}, {"a": 1}, 1, 1, 2)
+
+
+def test_writes_go_through_the_cache(tmp_path):
+    async def scenario(store):
+        namespace = store.namespace(1, "Cog")
+        namespace.set("a", 1)
+        namespace.set("b", 2)
+        await store.flush()
+        await namespace.items()
+        namespace.set("a", 3)
+        namespace.delete("b")
+        return await namespace.items(), await namespace.get("b", "gone"), store.misses
+
+    assert run(tmp_path, scenario) == ({"a": 3}, "gone", 1)
+
+
+def test_writes_during_a_read_are_not_lost(tmp_path):
+    async def scenario(store):
+        namespace = store.namespace(1, "Cog")
+        reading = asyncio.ensure_future(namespace.items())
+        # until the read is running on the store's thread
+        for _ in range(3):
+            await asyncio.sleep(0)
+        # written and committed while the read is in flight, the read returns what was there before
+        namespace.set("a", 1)
+        await store.flush()
+        await reading
+        return await namespace.items()
+
+    assert run(tmp_path, scenario) == {"a": 1}
+
+
+def test_evicted_namespace_is_read_back_fresh(tmp_path):
+    async def scenario(store):
+        namespace = store.namespace(1, "Cog")
+        await namespace.items()
+        namespace.set("a", 1)
+        committing = asyncio.ensure_future(store.flush())
+        await asyncio.sleep(0)
+        # pushes the namespace out of the cache while its batch is committing
+        other = store.namespace(2, "Cog")
+        other.set("b", 2)
+        await other.items()
+        ret = await namespace.get("a")
+        await committing
+        return ret
+
+    assert run(tmp_path, scenario, cache_size=1) == 1
+
+
+def test_cache_is_bounded_by_values(tmp_path):
+    async def scenario(store):
+        for guild_id in range(10):
+            store.set((guild_id, "Cog", "a"), guild_id)
+        await store.flush()
+        for guild_id in range(10):
+            await store.items(guild_id, "Cog")
+        misses = store.misses
+        await store.items(9, "Cog")
+        await store.items(0, "Cog")
+        return store.misses - misses
+
+    # the last namespaces read are still cached, the first ones were evicted
+    assert run(tmp_path, scenario, cache_size=5) == 1
@@ -0,0 +1,81 @@
+"""
+Lazily loaded extensions whose cogs only listen to routed events are created by the events routed to them
+
+    python -m pytest tests/test_lazy_routes.py
+"""
+import asyncio
+import os
+import sys
+from os import path
+
+import pytest
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), "..", "src"))
+sys.path.insert(0, path.dirname(path.abspath(__file__)))
+
+from FakeGateway import FakeGateway, make_snowflake
+
+OWNER = make_snowflake(1000)
+MEMBER = make_snowflake(1001)
+SEND = ("POST", "/channels/{channel_id}/messages")
+
+
+@pytest.fixture
+def workdir(tmp_path):
+    # guild data is kept next to the bot's working directory
+    (tmp_path / "bot").mkdir()
+    cwd = os.getcwd()
+    os.chdir(tmp_path / "bot")
+    yield tmp_path
+    os.chdir(cwd)
+
+
+def run(scenario):
+    from bot import MainBot
+
+    async def main():
+        client = MainBot(command_prefix="$", metrics_file=None)
+        client.GUILD_EXTENSIONS = MainBot.GUILD_EXTENSIONS + ("TimeExtension",)
+        gateway = FakeGateway(client)
+        guild_id = make_snowflake(5)
+        channels = gateway.add_guild(guild_id, owner_id=OWNER, channels=2)
+
+        async def say(channel: int, author: int, content: str) -> int:
+            gateway.http.requests.clear()
+            gateway.send_message(guild_id, channel, author, content)
+            await gateway.drain()
+            return gateway.http.requests[SEND]
+
+        try:
+            return await scenario(client, say, guild_id, channels)
+        finally:
+            await client.store.close()
+
+    return asyncio.run(main())
+
+
+def test_unrouted_messages_do_not_create_the_cogs(workdir):
+    async def scenario(client, say, guild_id, channels):
+        await say(channels[0], MEMBER, "at 10:30 UTC")
+        return client.registry.peek(guild_id).lazy_pending
+
+    assert run(scenario) == ["TimeExtension"]
+
+
+@pytest.mark.parametrize("hibernation_file", [True, False])
+def test_routed_messages_create_the_cogs(workdir, hibernation_file):
+    from GuildRegistry import GuildBotRegistry
+
+    async def scenario(client, say, guild_id, channels):
+        await say(channels[0], OWNER, "$watch_channel")
+        await client.store.flush()
+        await client.registry.hibernate(guild_id)
+        if not hibernation_file:
+            # the watched channel is only known from the store
+            os.remove(GuildBotRegistry.hibernation_path(guild_id))
+        elsewhere = await say(channels[1], MEMBER, "at 10:30 UTC")
+        pending = client.registry.peek(guild_id).lazy_pending
+        watched = await say(channels[0], MEMBER, "at 10:30 UTC")
+        return elsewhere, pending, watched, client.registry.peek(guild_id).lazy_pending
+
+    assert run(scenario) == (0, ["TimeExtension"], 1, [])
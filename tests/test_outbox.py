@@ -0,0 +1,208 @@
+"""
+Merging of sends and edits in the Outbox
+
+    python -m pytest tests/test_outbox.py
+"""
+import asyncio
+import sys
+from os import path
+
+import discord
+import pytest
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), "..", "src"))
+
+from Outbox import Outbox, merge_embeds, MAX_FIELDS
+
+
+class Channel:
+    def __init__(self, channel_id: int, fail: bool = False, fail_after: int = None):
+        self.id = channel_id
+        self.fail = fail
+        self.fail_after = fail_after
+        self.sent = []
+
+    async def send(self, embed: discord.Embed):
+        if self.fail or self.fail_after == len(self.sent):
+            raise RuntimeError("discord is down")
+        self.sent.append(embed)
+        return len(self.sent)
+
+
+class Message:
+    def __init__(self, message_id: int, channel: Channel):
+        self.id = message_id
+        self.channel = channel
+        self.edits = []
+
+    async def edit(self, **fields):
+        self.edits.append(fields)
+
+
+class Scheduler:
+    def __init__(self, congested_for: int):
+        self.congested_for = congested_for
+
+    def congested(self, guild_id: int) -> bool:
+        self.congested_for -= 1
+        return self.congested_for >= 0
+
+
+def embed(title: str, fields: int = 1, url: str = None) -> discord.Embed:
+    ret = discord.Embed(title=title) if url is None else discord.Embed(title=title, url=url)
+    for n in range(fields):
+        ret.add_field(name=f"{title} {n}", value=str(n))
+    return ret
+
+
+def test_merge_keeps_the_first_title_and_introduces_the_others():
+    merged = merge_embeds([embed("first", url="https://a"), embed("second", url="https://b"), embed("third")])
+    assert len(merged) == 1
+    assert merged[0].title == "first" and merged[0].url == "https://a"
+    assert [field.name for field in merged[0].fields] == \
+        ["first 0", "second", "second 0", "third", "third 0"]
+    assert merged[0].fields[1].value == "[https://b](https://b)"
+
+
+def test_merge_starts_a_new_embed_when_the_fields_run_out():
+    embeds = [embed(str(n), fields=5) for n in range(10)]
+    merged = merge_embeds(embeds)
+    assert all(len(current.fields) <= MAX_FIELDS for current in merged)
+    # every field is kept, along with a header for each embed which was merged into another
+    assert sum(len(current.fields) for current in merged) == 50 + 10 - len(merged)
+
+
+def test_merge_does_not_change_its_input():
+    first = embed("first")
+    merge_embeds([first, embed("second")])
+    assert len(first.fields) == 1
+
+
+def test_sends_in_a_window_become_one_message():
+    async def run():
+        outbox = Outbox(window=0.01)
+        channel, other = Channel(1), Channel(2)
+        futures = [outbox.send(channel, embed(str(n))) for n in range(3)] + [outbox.send(other, embed("other"))]
+        results = await asyncio.gather(*futures)
+        return outbox, channel, other, results
+
+    outbox, channel, other, results = asyncio.run(run())
+    assert len(channel.sent) == 1 and len(channel.sent[0].fields) == 5
+    assert len(other.sent) == 1
+    assert results == [1, 1, 1, 1]
+    stats = outbox.channels[1]
+    assert (stats.flushes, stats.queued, stats.sent, stats.requests_saved) == (1, 3, 1, 2)
+
+
+def test_sends_after_a_flush_start_a_new_window():
+    async def run():
+        outbox = Outbox(window=0.01)
+        channel = Channel(1)
+        await outbox.send(channel, embed("first"))
+        await outbox.send(channel, embed("second"))
+        return channel
+
+    assert [sent.title for sent in asyncio.run(run()).sent] == ["first", "second"]
+
+
+def test_only_the_latest_edit_is_made():
+    async def run():
+        outbox = Outbox(window=0.01)
+        message = Message(10, Channel(1))
+        first = outbox.edit(message, content="one")
+        outbox.edit(message, content="two", embed=None)
+        assert outbox.pending_edit(message) == {"content": "two", "embed": None}
+        last = outbox.edit(message, content="three")
+        assert await first is message and await last is message
+        return outbox, message
+
+    outbox, message = asyncio.run(run())
+    assert message.edits == [{"content": "three"}]
+    assert outbox.pending_edit(message) == {}
+    assert outbox.channels[1].edits_queued == 3 and outbox.channels[1].edits_sent == 1
+
+
+def test_a_failed_send_fails_everyone_waiting_on_it():
+    async def run():
+        outbox = Outbox(window=0.01)
+        channel = Channel(1, fail=True)
+        return await asyncio.gather(outbox.send(channel, embed("a")), outbox.send(channel, embed("b")),
+                                    return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+def test_each_send_resolves_to_the_message_holding_its_embed():
+    async def run():
+        outbox = Outbox(window=0.01)
+        channel = Channel(1)
+        # too many fields to merge any two of them
+        return await asyncio.gather(*(outbox.send(channel, embed(str(n), fields=20)) for n in range(3)))
+
+    assert asyncio.run(run()) == [1, 2, 3]
+
+
+def test_a_failed_message_only_fails_the_sends_in_it():
+    async def run():
+        outbox = Outbox(window=0.01)
+        channel = Channel(1, fail_after=1)
+        return await asyncio.gather(*(outbox.send(channel, embed(str(n), fields=20)) for n in range(2)),
+                                    return_exceptions=True)
+
+    sent, failed = asyncio.run(run())
+    assert sent == 1 and isinstance(failed, RuntimeError)
+
+
+def test_channel_stats_are_bounded():
+    async def run():
+        outbox = Outbox(window=0.01, max_channels=2)
+        for channel_id in range(3):
+            await outbox.send(Channel(channel_id), embed(str(channel_id)))
+        return outbox
+
+    assert list(asyncio.run(run()).channels) == [1, 2]
+
+
+def test_congested_guilds_keep_merging():
+    class GuildChannel(Channel):
+        guild = discord.Object(5)
+
+    async def run():
+        outbox = Outbox(window=0.01, scheduler=Scheduler(congested_for=2))
+        channel = GuildChannel(1)
+        first = outbox.send(channel, embed("first"))
+        # past the window, but the guild's requests are still congested
+        await asyncio.sleep(0.015)
+        second = outbox.send(channel, embed("second"))
+        await asyncio.gather(first, second)
+        return channel
+
+    channel = asyncio.run(run())
+    assert len(channel.sent) == 1 and channel.sent[0].title == "first"
+
+
+def test_congestion_holds_for_at_most_max_hold_windows():
+    class GuildChannel(Channel):
+        guild = discord.Object(5)
+
+    async def run():
+        outbox = Outbox(window=0.001, scheduler=Scheduler(congested_for=10 ** 6))
+        channel = GuildChannel(1)
+        await asyncio.wait_for(outbox.send(channel, embed("first")), 1.0)
+        return channel
+
+    assert len(asyncio.run(run()).sent) == 1
+
+
+@pytest.mark.parametrize("count", [1, 2, MAX_FIELDS + 1])
+def test_every_embed_is_sent(count):
+    async def run():
+        outbox = Outbox(window=0.01)
+        channel = Channel(1)
+        await asyncio.gather(*(outbox.send(channel, embed(str(n))) for n in range(count)))
+        return channel
+
+    channel = asyncio.run(run())
+    titles = {sent.title for sent in channel.sent} | {field.name for sent in channel.sent for field in sent.fields}
+    assert all(str(n) in titles for n in range(count))
@@ -0,0 +1,95 @@
+"""
+Timeouts, strikes and dying workers of the PatternSandbox
+
+    python -m pytest tests/test_pattern_sandbox.py
+"""
+import asyncio
+import multiprocessing
+import re
+import sys
+from os import path
+
+import pytest
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), "..", "src"))
+
+import PatternSandbox
+from PatternSandbox import PatternTimeout, WorkerDied, WorkerPool
+
+SAFE = (r"(?P<hour>\d{1,2}):(?P<minute>\d{2})", 0)
+# backtracks for far longer than any timeout on a long run of a's which does not end the string
+EVIL = (r"(a+)+$", 0)
+STALLING = "a" * 40 + "!"
+
+
+def workers():
+    return [process for process in multiprocessing.active_children() if process.name == "PatternSandbox"]
+
+
+def test_timeout_blames_the_running_pattern():
+    pool = WorkerPool(size=1)
+    with pytest.raises(PatternTimeout) as raised:
+        asyncio.run(pool.scan([SAFE, EVIL], STALLING, 0.2))
+    assert raised.value.index == 1
+    # the worker was replaced, the next search works
+    assert asyncio.run(pool.scan([SAFE], "at 12:30", 5.0)) == [(0, 3, 8, {"hour": "12", "minute": "30"})]
+
+
+def test_worker_killed_mid_scan_is_replaced():
+    pool = WorkerPool(size=1)
+    # other pools' workers are left alone
+    others = set(workers())
+    asyncio.run(pool.scan([SAFE], "", 5.0))
+    before = set(workers()) - others
+    assert len(before) == 1
+
+    async def kill_during_scan():
+        search = asyncio.ensure_future(pool.scan([EVIL], STALLING, 30.0))
+        await asyncio.sleep(0.2)
+        next(iter(before)).kill()
+        return await search
+
+    with pytest.raises(WorkerDied) as raised:
+        asyncio.run(kill_during_scan())
+    assert raised.value.index == 0
+
+    # the dead worker is not handed out again, a new one takes its place
+    assert asyncio.run(pool.scan([SAFE], "at 1:05", 5.0)) == [(0, 3, 7, {"hour": "1", "minute": "05"})]
+    after = set(workers()) - others
+    assert len(after) == 1 and not after & before
+
+
+def test_sandbox_disables_a_pattern_after_its_strikes(monkeypatch):
+    monkeypatch.setattr(PatternSandbox, "_pool", WorkerPool(size=1))
+    monkeypatch.setattr(PatternSandbox.PatternSandbox, "TIMEOUT", 0.2)
+    evil = re.compile(EVIL[0])
+    sandbox = PatternSandbox.PatternSandbox([re.compile(SAFE[0]), evil])
+
+    for _ in range(PatternSandbox.PatternSandbox.STRIKES - 1):
+        assert asyncio.run(sandbox.scan(STALLING)) == ([], [])
+        assert evil.pattern not in sandbox.disabled
+    assert asyncio.run(sandbox.scan(STALLING)) == ([], [evil])
+    assert evil.pattern in sandbox.disabled
+
+    # the disabled pattern is not searched with any more, the others still are
+    matches, disabled = asyncio.run(sandbox.scan(STALLING + " 10:45"))
+    assert [match.group() for match in matches] == ["10:45"] and disabled == []
+
+
+def test_a_match_clears_the_strikes(monkeypatch):
+    monkeypatch.setattr(PatternSandbox, "_pool", WorkerPool(size=1))
+    monkeypatch.setattr(PatternSandbox.PatternSandbox, "TIMEOUT", 0.2)
+    evil = re.compile(EVIL[0])
+    sandbox = PatternSandbox.PatternSandbox([evil])
+
+    for _ in range(PatternSandbox.PatternSandbox.STRIKES - 1):
+        asyncio.run(sandbox.scan(STALLING))
+    # strikes only count in a row
+    assert asyncio.run(sandbox.scan("aaa"))[0]
+    for _ in range(PatternSandbox.PatternSandbox.STRIKES - 1):
+        assert asyncio.run(sandbox.scan(STALLING)) == ([], [])
+    assert evil.pattern not in sandbox.disabled
+
+
+def test_validate_refuses_nested_quantifiers():
+    assert asyncio.run(PatternSandbox.PatternSandbox().validate(re.compile(EVIL[0])))
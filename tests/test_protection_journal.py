@@ -0,0 +1,144 @@
+"""
+Recovery, compaction and rollback of the ProtectionJournal
+
+    python -m pytest tests/test_protection_journal.py
+"""
+import asyncio
+import os
+import sys
+import time
+from os import path
+
+import pytest
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), "..", "src"))
+
+from ProtectionJournal import ProtectionJournal, FRAME
+
+
+def open_journal(directory, state=None, initial=None):
+    journal = ProtectionJournal(str(directory), state or (lambda: {}))
+    return journal, asyncio.run(journal.open(initial))
+
+
+def record(journal, *changes):
+    async def write():
+        for change in changes:
+            journal.record(*change)
+        await journal.flush()
+    asyncio.run(write())
+
+
+def log_file(directory):
+    logs = [name for name in os.listdir(directory) if name.endswith(".log")]
+    assert len(logs) == 1
+    return path.join(directory, logs[0])
+
+
+def test_reopen_replays_the_log(tmp_path):
+    journal, protections = open_journal(tmp_path, initial={"Cog": {("role", 1)}})
+    assert protections == {"Cog": {("role", 1)}}
+    record(journal, ("add", "Cog", ("user", 2)), ("remove", "Cog", ("role", 1)), ("add", "Other", ("channel", 3)))
+
+    _, protections = open_journal(tmp_path)
+    assert protections == {"Cog": {("user", 2)}, "Other": {("channel", 3)}}
+
+
+def test_torn_tail_is_dropped(tmp_path):
+    journal, _ = open_journal(tmp_path, initial={})
+    record(journal, ("add", "Cog", ("user", 1)), ("add", "Cog", ("user", 2)))
+    log = log_file(tmp_path)
+    size = path.getsize(log)
+    # the process died halfway through writing the last record
+    with open(log, 'r+b') as f:
+        f.truncate(size - 3)
+
+    journal, protections = open_journal(tmp_path)
+    assert protections == {"Cog": {("user", 1)}}
+    # the tail is cut off, new records follow the last complete one
+    record(journal, ("add", "Cog", ("user", 3)))
+    _, protections = open_journal(tmp_path)
+    assert protections == {"Cog": {("user", 1), ("user", 3)}}
+
+
+def test_crc_mismatch_ends_the_log(tmp_path):
+    journal, _ = open_journal(tmp_path, initial={})
+    record(journal, ("add", "Cog", ("user", 1)), ("add", "Cog", ("user", 2)), ("add", "Cog", ("user", 3)))
+    log = log_file(tmp_path)
+    with open(log, 'rb') as f:
+        data = bytearray(f.read())
+    length, _ = FRAME.unpack_from(data, 0)
+    # flip a byte in the body of the second record
+    data[2 * FRAME.size + length + 1] ^= 0xFF
+    with open(log, 'wb') as f:
+        f.write(data)
+
+    _, protections = open_journal(tmp_path)
+    assert protections == {"Cog": {("user", 1)}}
+    assert path.getsize(log) == FRAME.size + length
+
+
+def test_compaction_replaces_the_snapshot(tmp_path):
+    state = {"Cog": {("user", 1)}}
+    journal, _ = open_journal(tmp_path, state=lambda: state, initial=state)
+    record(journal, ("add", "Cog", ("user", 2)))
+    state = {"Cog": {("user", 1), ("user", 2)}}
+    asyncio.run(journal.compact())
+
+    snapshots = sorted(name for name in os.listdir(tmp_path) if name.endswith(".snapshot"))
+    assert len(snapshots) == 2
+    assert not any(name.endswith(".tmp") for name in os.listdir(tmp_path))
+    # a snapshot left half written by a crash is ignored
+    with open(path.join(tmp_path, "1.snapshot.tmp"), 'wb') as f:
+        f.write(b"garbage")
+    _, protections = open_journal(tmp_path)
+    assert protections == {"Cog": {("user", 1), ("user", 2)}}
+
+
+def test_only_the_last_generations_are_kept(tmp_path):
+    journal, _ = open_journal(tmp_path, initial={})
+    for _ in range(ProtectionJournal.HISTORY + 3):
+        asyncio.run(journal.compact())
+    snapshots = [name for name in os.listdir(tmp_path) if name.endswith(".snapshot")]
+    assert len(snapshots) == ProtectionJournal.HISTORY
+
+
+def test_rollback_to_a_point_in_time(tmp_path):
+    state = {"Cog": {("role", 1)}}
+    journal, _ = open_journal(tmp_path, state=lambda: state, initial=state)
+    record(journal, ("add", "Cog", ("user", 2)))
+    time.sleep(0.01)
+    between = time.time()
+    time.sleep(0.01)
+    record(journal, ("remove", "Cog", ("role", 1)), ("add", "Other", ("user", 3)))
+
+    assert asyncio.run(journal.state_at(between)) == {"Cog": {("role", 1), ("user", 2)}}
+    assert asyncio.run(journal.state_at(time.time())) == {"Cog": {("user", 2)}, "Other": {("user", 3)}}
+
+
+def test_rollback_across_a_compaction(tmp_path):
+    state = {"Cog": {("role", 1)}}
+    journal, _ = open_journal(tmp_path, state=lambda: state, initial=state)
+    time.sleep(0.01)
+    before = time.time()
+    time.sleep(0.01)
+    record(journal, ("add", "Cog", ("user", 2)))
+    state = {"Cog": {("role", 1), ("user", 2)}}
+    asyncio.run(journal.compact())
+
+    assert asyncio.run(journal.state_at(before)) == {"Cog": {("role", 1)}}
+
+
+def test_rollback_past_the_history_fails(tmp_path):
+    journal, _ = open_journal(tmp_path, initial={})
+    with pytest.raises(ValueError):
+        asyncio.run(journal.state_at(0))
+
+
+def test_removing_the_last_entry_drops_the_protection(tmp_path):
+    journal, _ = open_journal(tmp_path, initial={"Cog": {("role", 1)}, "Other": {("user", 2)}})
+    record(journal, ("remove", "Cog", ("role", 1)))
+
+    _, protections = open_journal(tmp_path)
+    assert protections == {"Other": {("user", 2)}}
+    assert asyncio.run(journal.state_at(time.time())) == {"Other": {("user", 2)}}
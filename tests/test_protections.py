@@ -0,0 +1,87 @@
+"""
+Protecting and unprotecting cogs through the AdminCommands of a guild bot
+
+    python -m pytest tests/test_protections.py
+"""
+import asyncio
+import os
+import sys
+from os import path
+
+import pytest
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), "..", "src"))
+sys.path.insert(0, path.dirname(path.abspath(__file__)))
+
+from FakeGateway import FakeGateway, make_snowflake
+
+OWNER = make_snowflake(1000)
+MEMBER = make_snowflake(1001)
+
+
+@pytest.fixture
+def workdir(tmp_path):
+    # guild data is kept next to the bot's working directory
+    (tmp_path / "bot").mkdir()
+    cwd = os.getcwd()
+    os.chdir(tmp_path / "bot")
+    yield tmp_path
+    os.chdir(cwd)
+
+
+def run(scenario):
+    from bot import MainBot
+
+    async def main():
+        client = MainBot(command_prefix="$", metrics_file=None)
+        gateway = FakeGateway(client)
+        guild_id = make_snowflake(5)
+        channel = gateway.add_guild(guild_id, owner_id=OWNER)[0]
+        outcomes = []
+
+        async def say(author: int, content: str):
+            gateway.send_message(guild_id, channel, author, content)
+            await gateway.drain()
+
+        async def completed(ctx):
+            outcomes.append((ctx.author.id, ctx.command.name, True))
+
+        async def failed(ctx, error):
+            outcomes.append((ctx.author.id, ctx.command.name, False))
+
+        await say(OWNER, "$load_extension TimeExtension")
+        bot = client.registry.peek(guild_id)
+        bot.add_listener(completed, "on_command_completion")
+        bot.add_listener(failed, "on_command_error")
+        try:
+            await scenario(say, bot, outcomes)
+        finally:
+            await client.store.close()
+        return outcomes
+
+    return asyncio.run(main())
+
+
+def test_unprotected_cog_is_open_to_everyone_again(workdir):
+    async def scenario(say, bot, outcomes):
+        await say(OWNER, "$protect_cog TimeExtension")
+        await say(MEMBER, "$patterns")
+        await say(OWNER, "$remove_cog_protection TimeExtension")
+        await say(MEMBER, "$patterns")
+        await say(OWNER, "$status")
+
+    outcomes = run(scenario)
+    assert [outcome for outcome in outcomes if outcome[0] == MEMBER] == \
+        [(MEMBER, "patterns", False), (MEMBER, "patterns", True)]
+
+
+def test_deleting_the_only_role_unprotects_the_cog(workdir):
+    async def scenario(say, bot, outcomes):
+        await say(OWNER, "$protect_cog TimeExtension")
+        role = next(role for role in bot.guild.roles if role.name == "SuperUser")
+        bot.dispatch("guild_role_delete", role)
+        await asyncio.sleep(0)
+        await say(MEMBER, "$patterns")
+
+    outcomes = run(scenario)
+    assert outcomes[-1] == (MEMBER, "patterns", True)
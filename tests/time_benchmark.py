@@ -0,0 +1,135 @@
+"""
+Runs every line of time_corpus.txt through TimeExtension's match and convert path and compares the throughput with
+time_benchmark_baseline.json, exiting with 1 when it fell by more than the threshold. Throughput is compared as a ratio
+to a reference workload which only uses the standard library and is measured in the same run, so the baseline holds on
+a slower or busier machine as well. The corpus holds every line once, repeated lines would be served from the memo.
+
+    python tests/time_benchmark.py
+    python tests/time_benchmark.py --threshold 0.1
+    python tests/time_benchmark.py --update-baseline
+"""
+import argparse
+import asyncio
+import json
+import re
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from os import path
+from typing import Dict, Any, List
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), "..", "src"))
+
+CORPUS = path.join(path.dirname(path.abspath(__file__)), "time_corpus.txt")
+BASELINE = path.join(path.dirname(path.abspath(__file__)), "time_benchmark_baseline.json")
+
+
+def load_corpus() -> List[str]:
+    with open(CORPUS, encoding="utf-8") as f:
+        return [line.rstrip("\n") for line in f]
+
+
+# a plain time pattern, fixed here so the reference never changes along with the code under test
+REFERENCE_PATTERN = re.compile(r"(?P<hour>\d{1,2}):(?P<minute>\d{2}) ?(?P<tz>[\w/]+)")
+
+
+def reference(lines: List[str], rounds: int) -> float:
+    """
+    The messages per second of a naive match and format of every line, the yardstick the throughput is measured with
+    """
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for line in lines:
+            for match in REFERENCE_PATTERN.finditer(line):
+                try:
+                    moment = datetime(2020, 1, 1, int(match["hour"]), int(match["minute"]), tzinfo=timezone.utc)
+                except ValueError:
+                    continue
+                moment.strftime("%H:%M %Z")
+    return len(lines) * rounds / (time.perf_counter() - start)
+
+
+def measure(lines: List[str], rounds: int) -> Dict[str, Any]:
+    from bot import MyDiscordBot
+    from TimeExtension import TimeExtension
+
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    cog = TimeExtension(MyDiscordBot(None, command_prefix="$"))
+    convert = cog._TimeExtension__convert
+    matches = invalid = 0
+
+    def process(line: str) -> None:
+        nonlocal matches, invalid
+        for match in cog.formats.scan(line):
+            matches += 1
+            try:
+                convert(match)
+            except ValueError:
+                # things like 99:99 look like a time but are not one
+                invalid += 1
+
+    reference_before = reference(lines, rounds)
+    start = time.perf_counter()
+    for line in lines:
+        process(line)
+    # every later round finds its renders memoized, only the first one tells how often distinct lines share them
+    render_hits, render_misses = cog.render_hits, cog.render_misses
+    for _ in range(rounds - 1):
+        for line in lines:
+            process(line)
+    elapsed = time.perf_counter() - start
+
+    # a separate pass, tracing allocations slows everything down. CPython does not count allocations, tracemalloc only
+    # sees the blocks which are alive, so the bytes a message needs at its peak stand in for how much it allocates
+    tracemalloc.start()
+    peak = 0
+    before = tracemalloc.get_traced_memory()[0]
+    for line in lines:
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        process(line)
+        peak += tracemalloc.get_traced_memory()[1] - current
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    throughput = len(lines) * rounds / elapsed
+    # the reference runs on both sides of the measurement so a load change during the run evens out
+    yardstick = (reference(lines, rounds) + reference_before) / 2
+    return {
+        "lines": len(lines),
+        "rounds": rounds,
+        "matches_per_round": matches // (rounds + 1),
+        "invalid_per_round": invalid // (rounds + 1),
+        "messages_per_second": round(throughput, 1),
+        "reference_messages_per_second": round(yardstick, 1),
+        "relative_throughput": round(throughput / yardstick, 4),
+        "peak_bytes_per_message": round(peak / len(lines), 1),
+        "retained_bytes_per_message": round(retained / len(lines), 1),
+        "first_round_render_hits": render_hits,
+        "first_round_render_misses": render_misses,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark time detection against a fixed corpus")
+    parser.add_argument("--rounds", type=int, default=20, help="how many times the corpus is run through")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="the share of the baseline's relative throughput which may be lost before failing")
+    parser.add_argument("--update-baseline", action="store_true", help="store this run as the new baseline")
+    arguments = parser.parse_args()
+
+    report = measure(load_corpus(), arguments.rounds)
+    print(json.dumps(report, indent=2, sort_keys=True))
+    if arguments.update_baseline:
+        with open(BASELINE, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write("\n")
+    elif path.exists(BASELINE):
+        with open(BASELINE) as f:
+            baseline = json.load(f)
+        floor = baseline["relative_throughput"] * (1 - arguments.threshold)
+        if report["relative_throughput"] < floor:
+            print(f"Throughput regressed: {report['relative_throughput']} times the reference workload, "
+                  f"the baseline allows no less than {floor:.4f}", file=sys.stderr)
+            sys.exit(1)